@@ -1,26 +1,199 @@
 import os
 import logging
 import random
-import requests
 import json
-from typing import Optional, Dict
+import time
+from typing import AsyncIterator, Optional, Dict, List, Set
 import asyncio
 
+import httpx
+
+from crisis_handler import crisis_handler
+from knowledge_base import knowledge_base
+from response_cache import ResponseCache, make_cache_key, depersonalize, personalize
+from circuit_breaker import CircuitBreaker
+from rate_limiter import InFlightLimiter
+from history_packer import pack_history
+from mood_analytics import describe as describe_mood
+import metrics
+
 logger = logging.getLogger(__name__)
 
+# Настройки пула соединений и таймаутов DeepSeek (можно переопределить через окружение)
+DEEPSEEK_MAX_CONNECTIONS = int(os.getenv('DEEPSEEK_MAX_CONNECTIONS', 200))
+DEEPSEEK_MAX_KEEPALIVE = int(os.getenv('DEEPSEEK_MAX_KEEPALIVE', 50))
+DEEPSEEK_KEEPALIVE_EXPIRY = float(os.getenv('DEEPSEEK_KEEPALIVE_EXPIRY', 60))
+DEEPSEEK_CONNECT_TIMEOUT = float(os.getenv('DEEPSEEK_CONNECT_TIMEOUT', 5))
+DEEPSEEK_READ_TIMEOUT = float(os.getenv('DEEPSEEK_READ_TIMEOUT', 15))
+DEEPSEEK_POOL_TIMEOUT = float(os.getenv('DEEPSEEK_POOL_TIMEOUT', 5))
+DEEPSEEK_TOTAL_TIMEOUT = float(os.getenv('DEEPSEEK_TOTAL_TIMEOUT', 20))
+# Через сколько мс отдавать запасной ответ, не дожидаясь DeepSeek (0 - ждать до таймаута)
+AI_HEDGE_TIMEOUT_MS = int(os.getenv('AI_HEDGE_TIMEOUT_MS', 0))
+
+# Системный промпт - общий для всех запросов
+SYSTEM_PROMPT = """Ты - добрый, эмпатичный и профессиональный психологический помощник MindMate.
+
+Твоя роль:
+1. Поддерживать пользователя в трудные моменты
+2. Задавать наводящие вопросы для самопознания
+3. Предлагать практические техники для улучшения состояния
+4. Быть дружелюбным и доступным
+
+Твой стиль общения:
+• Используй эмпатию и понимание
+• Будь конкретным и практичным
+• Говори на "ты" (неформально, но уважительно)
+• Используй эмодзи для эмоциональной окраски 🎯
+• Будь кратким (2-3 предложения в основном, максимум 5)
+
+Что НЕЛЬЗЯ делать:
+• Не давай медицинских диагнозов
+• Не назначай лекарства
+• Не заменяй профессиональную психологическую помощь
+• Не обещай мгновенного излечения
+
+В сложных случаях мягко направляй к специалистам."""
+
+# Шаблонные фразы, которые убираются из начала ответа
+PHRASES_TO_REMOVE = [
+    "Конечно, я помогу вам с этим.",
+    "Я понимаю, что вы чувствуете.",
+    "Спасибо, что поделились со мной.",
+    "Как искусственный интеллект, я могу сказать, что",
+    "На основе вашего сообщения,",
+    "Уважаемый пользователь,",
+    "Дорогой пользователь,"
+]
+SHORT_RESPONSE_EMOJIS = ['🎯', '🤗', '💫', '🌟', '✨']
+FILLER_EMOJIS = ['🤗', '💫', '🌟', '✨', '🎯', '🧘', '💭', '🌈']
+
+
+class ResponseCleaner:
+    """Инкрементальная очистка ответа: та же обработка, что и _clean_response,
+    но для текста, приходящего по частям при потоковой генерации.
+
+    feed() возвращает очищенный текст, который уже можно показать пользователю,
+    finish() - оставшийся хвост. Начало ответа придерживается, пока не станет
+    ясно, не является ли оно шаблонной фразой.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._buffer = ""
+        self._phrase_index = 0
+        self._prefix_resolved = False
+        self._pending_space = False
+
+    @property
+    def has_content(self) -> bool:
+        """Получен ли непустой текст (включая еще придержанное начало)"""
+        return bool(self.text or self._buffer.strip())
+
+    def feed(self, chunk: str) -> str:
+        if not self._prefix_resolved:
+            self._buffer += chunk
+            if not self._resolve_prefix(final=False):
+                return ""
+            chunk, self._buffer = self._buffer, ""
+        return self._emit(chunk)
+
+    def finish(self) -> str:
+        tail = ""
+        if not self._prefix_resolved:
+            self._resolve_prefix(final=True)
+            tail = self._emit(self._buffer)
+            self._buffer = ""
+        # Если ответ слишком короткий, добавляем эмодзи
+        if len(self.text) < 20 and not any(c in self.text for c in SHORT_RESPONSE_EMOJIS):
+            addition = f" {random.choice(FILLER_EMOJIS)}"
+            self.text += addition
+            tail += addition
+        return tail
+
+    def _resolve_prefix(self, final: bool) -> bool:
+        """Убирает шаблонные фразы из начала. False - нужно дождаться продолжения"""
+        text = self._buffer.lstrip()
+        for index in range(self._phrase_index, len(PHRASES_TO_REMOVE)):
+            phrase = PHRASES_TO_REMOVE[index]
+            if text.startswith(phrase):
+                text = text[len(phrase):].lstrip()
+            elif not final and phrase.startswith(text):
+                # Текст пока совпадает с началом фразы - ждем следующие части
+                self._buffer, self._phrase_index = text, index
+                return False
+        self._buffer = text
+        self._prefix_resolved = True
+        return True
+
+    def _emit(self, chunk: str) -> str:
+        """Схлопывает пробельные символы (как ' '.join(text.split()))"""
+        parts = []
+        words = chunk.split()
+        if not words:
+            if chunk and self.text:
+                self._pending_space = True
+            return ""
+        if self._pending_space or (chunk[0].isspace() and self.text):
+            parts.append(" ")
+        parts.append(" ".join(words))
+        self._pending_space = chunk[-1].isspace()
+        out = "".join(parts)
+        self.text += out
+        return out
+
 class DeepSeekService:
     """Сервис для работы с DeepSeek API"""
     
     def __init__(self):
         self.api_key = os.getenv('DEEPSEEK_API_KEY')
         self.api_url = "https://api.deepseek.com/chat/completions"
+        self._client: Optional[httpx.AsyncClient] = None
+        # Кеш ответов DeepSeek для похожих коротких сообщений (кризисные не кешируются)
+        self.cache = ResponseCache()
+        # Предохранитель: при сбоях DeepSeek запросы сразу уходят в запасные ответы
+        self.circuit = CircuitBreaker("deepseek")
+        # Не больше AI_MAX_IN_FLIGHT одновременных запросов к DeepSeek (остальным - запасной ответ)
+        self.in_flight = InFlightLimiter()
+        self.hedged_fallbacks = 0
+        self._background: Set[asyncio.Task] = set()
         
         if self.api_key:
             logger.info("✅ DeepSeek API configured")
-            logger.info(f"🔑 API Key: {self.api_key[:10]}...")
         else:
             logger.warning("⚠️ DeepSeek API key not found - using fallback responses")
     
+    def _get_client(self) -> httpx.AsyncClient:
+        """Возвращает общий асинхронный HTTP-клиент с пулом keep-alive соединений"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                    "Accept": "application/json"
+                },
+                limits=httpx.Limits(
+                    max_connections=DEEPSEEK_MAX_CONNECTIONS,
+                    max_keepalive_connections=DEEPSEEK_MAX_KEEPALIVE,
+                    keepalive_expiry=DEEPSEEK_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(
+                    connect=DEEPSEEK_CONNECT_TIMEOUT,
+                    read=DEEPSEEK_READ_TIMEOUT,
+                    write=DEEPSEEK_CONNECT_TIMEOUT,
+                    pool=DEEPSEEK_POOL_TIMEOUT
+                )
+            )
+        return self._client
+    
+    async def close(self):
+        """Закрывает HTTP-клиент (вызывается при остановке приложения)"""
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
     async def get_ai_response(self, user_message: str, user_context: Optional[Dict] = None) -> str:
         """
         Получает ответ от DeepSeek или использует запасные ответы
@@ -33,65 +206,255 @@ class DeepSeekService:
             Ответ от ИИ или запасной ответ
         """
         
-        # Сначала проверяем кризисные сообщения
-        if self._is_crisis_message(user_message):
+        # Сначала проверяем кризисные сообщения (используем результат уже выполненной проверки, если он есть)
+        if user_context and 'is_crisis' in user_context:
+            is_crisis = user_context['is_crisis']
+        else:
+            is_crisis = self._is_crisis_message(user_message)
+        
+        if is_crisis:
+            metrics.REPLIES.inc("crisis")
             return self._get_crisis_response()
         
         try:
             # Если есть ключ API - пробуем использовать DeepSeek
             if self.api_key:
-                response = await self._call_deepseek_api(user_message, user_context)
-                if response and response.strip():
-                    return response
+                cache_key, cached = self._cache_lookup(user_message, user_context)
+                if cached is not None:
+                    metrics.REPLIES.inc("cache")
+                    return cached
+                
+                # Лимит сообщений превышен, цепь разомкнута или занято слишком много
+                # запросов - сразу используем запасной ответ
+                if self._ai_allowed(user_context) and self._acquire_call_slot():
+                    if AI_HEDGE_TIMEOUT_MS > 0:
+                        response = await self._hedged_call(user_message, user_context, cache_key)
+                    else:
+                        response = await self._guarded_call(user_message, user_context, cache_key)
+                    if response:
+                        metrics.REPLIES.inc("ai")
+                        return response
             
             # Если DeepSeek не сработал - используем запасные ответы
+            metrics.REPLIES.inc("fallback")
             return self._get_fallback_response(user_message, user_context)
             
         except Exception as e:
-            logger.error(f"🤖 AI Service error: {str(e)[:100]}")
+            logger.error("🤖 AI Service error: %s", str(e)[:100])
+            metrics.REPLIES.inc("fallback")
             return self._get_fallback_response(user_message, user_context)
     
+    async def get_ai_response_stream(self, user_message: str,
+                                     user_context: Optional[Dict] = None) -> AsyncIterator[str]:
+        """
+        Потоковый вариант get_ai_response: отдает очищенный ответ частями
+        по мере генерации. Если DeepSeek недоступен или не прислал ни одного
+        токена - отдает запасной ответ целиком.
+        """
+        if user_context and 'is_crisis' in user_context:
+            is_crisis = user_context['is_crisis']
+        else:
+            is_crisis = self._is_crisis_message(user_message)
+        
+        if is_crisis:
+            metrics.REPLIES.inc("crisis")
+            yield self._get_crisis_response()
+            return
+        
+        cleaner = ResponseCleaner()
+        cache_key = None
+        failed = False
+        if self.api_key:
+            cache_key, cached = self._cache_lookup(user_message, user_context)
+            if cached is not None:
+                metrics.REPLIES.inc("cache")
+                yield cached
+                return
+            
+            if self._ai_allowed(user_context) and self._acquire_call_slot():
+                started = time.monotonic()
+                try:
+                    async for delta in self._stream_deepseek_api(user_message, user_context):
+                        piece = cleaner.feed(delta)
+                        if piece:
+                            yield piece
+                except Exception as e:
+                    failed = True
+                    logger.error("🤖 AI streaming error: %s: %s", type(e).__name__, str(e)[:100])
+                except BaseException:
+                    # Поток прерван снаружи (отмена, aclose) - результат неизвестен
+                    self.circuit.record_cancelled()
+                    raise
+                finally:
+                    self.in_flight.release()
+                
+                latency = time.monotonic() - started
+                if failed or not cleaner.has_content:
+                    self.circuit.record_failure(latency)
+                else:
+                    self.circuit.record_success(latency)
+        
+        if cleaner.has_content:
+            metrics.REPLIES.inc("ai")
+            # Ответ уже начат - дописываем придержанный хвост
+            tail = cleaner.finish()
+            if tail:
+                yield tail
+            if not failed:
+                self._cache_store(cache_key, cleaner.text, user_context)
+            return
+        
+        # Ни одного токена (нет ключа, ошибка или пустой ответ) - запасной ответ
+        metrics.REPLIES.inc("fallback")
+        yield self._get_fallback_response(user_message, user_context)
+    
+    @staticmethod
+    def _ai_allowed(context: Optional[Dict]) -> bool:
+        """False, если для сообщения превышен лимит (ai_allowed в контексте) - отвечаем без DeepSeek"""
+        return not context or context.get('ai_allowed', True)
+    
+    def _acquire_call_slot(self) -> bool:
+        """Занимает слот для вызова DeepSeek: в пределах AI_MAX_IN_FLIGHT и при замкнутой цепи.
+        Слот освобождает _guarded_call (в потоковом режиме - get_ai_response_stream)"""
+        if not self.in_flight.try_acquire():
+            return False
+        if not self.circuit.allow_request():
+            self.in_flight.release()
+            return False
+        return True
+    
+    async def _guarded_call(self, message: str, context: Optional[Dict], cache_key) -> Optional[str]:
+        """Вызов DeepSeek с учетом в предохранителе и сохранением ответа в кеш"""
+        started = time.monotonic()
+        try:
+            response = await self._call_deepseek_api(message, context)
+        except asyncio.CancelledError:
+            # Хедж отменил вызов: без этого пробный слот полуоткрытой цепи не вернется
+            self.circuit.record_cancelled()
+            raise
+        except Exception:
+            self.circuit.record_failure(time.monotonic() - started)
+            raise
+        finally:
+            self.in_flight.release()
+        latency = time.monotonic() - started
+        
+        if response and response.strip():
+            self.circuit.record_success(latency)
+            self._cache_store(cache_key, response, context)
+            return response
+        
+        self.circuit.record_failure(latency)
+        return None
+    
+    async def _hedged_call(self, message: str, context: Optional[Dict], cache_key) -> Optional[str]:
+        """Ждет DeepSeek не дольше AI_HEDGE_TIMEOUT_MS. Если ответа нет - возвращает None
+        (будет запасной ответ), а запрос продолжает работать в фоне и прогревает кеш"""
+        call = asyncio.ensure_future(self._guarded_call(message, context, cache_key))
+        done, _ = await asyncio.wait({call}, timeout=AI_HEDGE_TIMEOUT_MS / 1000)
+        if done:
+            return call.result()
+        
+        self.hedged_fallbacks += 1
+        if cache_key is None:
+            # Ответ некуда сохранить - фоновый запрос бесполезен
+            call.cancel()
+        else:
+            self._background.add(call)
+            call.add_done_callback(self._background.discard)
+        return None
+    
+    def stats(self) -> Dict:
+        """Состояние предохранителя и запасного пути"""
+        return {
+            "circuit": self.circuit.stats(),
+            "hedge_timeout_ms": AI_HEDGE_TIMEOUT_MS,
+            "hedged_fallbacks": self.hedged_fallbacks,
+            "background_calls": len(self._background),
+            "in_flight": self.in_flight.stats()
+        }
+    
+    def _cache_lookup(self, message: str, context: Optional[Dict] = None):
+        """Ищет ответ в кеше. Возвращает (ключ, персонализированный ответ или None)"""
+        if not self.cache.enabled:
+            return None, None
+        key = make_cache_key(message, context)
+        if key is None:
+            return None, None
+        cached = self.cache.get(key)
+        if cached is None:
+            return key, None
+        return key, personalize(cached, context.get('name') if context else None)
+    
+    def _cache_store(self, key, response: str, context: Optional[Dict] = None):
+        """Сохраняет ответ DeepSeek в кеш (без имени пользователя)"""
+        if key is None:
+            return
+        template = depersonalize(response, context.get('name') if context else None)
+        if template is not None:
+            self.cache.put(key, template)
+    
+    def _build_request_data(self, message: str, context: Optional[Dict] = None, stream: bool = False) -> Dict:
+        """Формирует тело запроса к DeepSeek"""
+        return {
+            "model": "deepseek-chat",
+            "messages": self._build_messages(message, context),
+            "temperature": 0.7,  # Креативность (0-1)
+            "max_tokens": 500,    # Максимальная длина ответа
+            "top_p": 0.9,         # Разнообразие ответов
+            "stream": stream      # Потоковая передача (server-sent events)
+        }
+    
+    async def _stream_deepseek_api(self, message: str, context: Optional[Dict] = None) -> AsyncIterator[str]:
+        """Вызывает DeepSeek API в потоковом режиме и отдает фрагменты текста (SSE)"""
+        data = self._build_request_data(message, context, stream=True)
+        deadline = time.monotonic() + DEEPSEEK_TOTAL_TIMEOUT
+        started = time.monotonic()
+        first_token = True
+        
+        logger.info("📤 Streaming request to DeepSeek",
+                    extra={"event": "deepseek_request", "stream": True, "chars": len(message)})
+        
+        async with self._get_client().stream("POST", self.api_url, json=data) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                logger.error("❌ DeepSeek API error: %s - %r", response.status_code, body[:100])
+                return
+            
+            async for line in response.aiter_lines():
+                if time.monotonic() > deadline:
+                    logger.error("⏰ DeepSeek stream exceeded total timeout")
+                    return
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    return
+                
+                chunk = json.loads(payload)
+                choices = chunk.get('choices') or []
+                delta = choices[0].get('delta', {}).get('content') if choices else None
+                if delta:
+                    if first_token:
+                        first_token = False
+                        logger.info("⚡ DeepSeek first token in %.0f ms", (time.monotonic() - started) * 1000,
+                                    extra={"event": "deepseek_first_token"})
+                    yield delta
+    
     async def _call_deepseek_api(self, message: str, context: Optional[Dict] = None) -> Optional[str]:
         """Вызывает DeepSeek API"""
+        started = time.perf_counter()
+        outcome = "error"
         try:
-            # Подготовка промпта для нейросети
-            system_prompt = self._build_system_prompt(context)
-            user_prompt = self._build_user_prompt(message, context)
-            
-            # Заголовки запроса
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-                "Accept": "application/json"
-            }
-            
-            # Данные запроса
-            data = {
-                "model": "deepseek-chat",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user", 
-                        "content": user_prompt
-                    }
-                ],
-                "temperature": 0.7,  # Креативность (0-1)
-                "max_tokens": 500,    # Максимальная длина ответа
-                "top_p": 0.9,         # Разнообразие ответов
-                "stream": False       # Не использовать потоковую передачу
-            }
+            data = self._build_request_data(message, context)
             
-            logger.info(f"📤 Sending request to DeepSeek: {message[:50]}...")
+            logger.info("📤 Sending request to DeepSeek",
+                        extra={"event": "deepseek_request", "stream": False, "chars": len(message)})
             
-            # Отправляем запрос с таймаутом
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=data,
-                timeout=15  # 15 секунд таймаут
+            # Отправляем запрос через общий пул соединений с общим таймаутом
+            response = await asyncio.wait_for(
+                self._get_client().post(self.api_url, json=data),
+                timeout=DEEPSEEK_TOTAL_TIMEOUT
             )
             
             # Проверяем статус ответа
@@ -105,74 +468,76 @@ class DeepSeekService:
                     # Очищаем и форматируем ответ
                     ai_response = self._clean_response(ai_response)
                     
-                    logger.info(f"✅ DeepSeek response received: {ai_response[:50]}...")
+                    logger.info("✅ DeepSeek response received in %.0f ms", (time.perf_counter() - started) * 1000,
+                                extra={"event": "deepseek_response", "chars": len(ai_response)})
+                    outcome = "ok"
                     return ai_response
                 else:
                     logger.error("❌ DeepSeek returned empty choices")
                     return None
             else:
-                logger.error(f"❌ DeepSeek API error: {response.status_code} - {response.text[:100]}")
+                logger.error("❌ DeepSeek API error: %s - %s", response.status_code, response.text[:100])
                 return None
                 
-        except requests.exceptions.Timeout:
+        except (httpx.TimeoutException, asyncio.TimeoutError):
             logger.error("⏰ DeepSeek API timeout")
+            outcome = "timeout"
             return None
-        except requests.exceptions.ConnectionError as e:
-            logger.error(f"🔌 DeepSeek connection error: {e}")
+        except httpx.TransportError as e:
+            logger.error("🔌 DeepSeek connection error: %s", e)
             return None
         except json.JSONDecodeError as e:
-            logger.error(f"📄 JSON decode error: {e}")
+            logger.error("📄 JSON decode error: %s", e)
             return None
         except Exception as e:
-            logger.error(f"⚠️ DeepSeek API exception: {type(e).__name__}: {str(e)[:100]}")
+            logger.error("⚠️ DeepSeek API exception: %s: %s", type(e).__name__, str(e)[:100])
             return None
+        finally:
+            metrics.DEEPSEEK_SECONDS.observe(time.perf_counter() - started, outcome)
     
-    def _build_system_prompt(self, context: Optional[Dict] = None) -> str:
-        """Строит системный промпт для нейросети"""
+    def _build_system_prompt(self) -> str:
+        """Строит системный промпт для нейросети.
+        
+        Промпт не зависит от пользователя и побайтно одинаков во всех запросах,
+        чтобы у провайдера срабатывало кеширование префикса.
+        """
+        return SYSTEM_PROMPT
+    
+    def _build_context_prompt(self, context: Optional[Dict] = None) -> str:
+        """Строит сведения о пользователе (имя, настроение, кризис) для отдельного сообщения"""
+        
+        parts = []
         
-        base_prompt = """Ты - добрый, эмпатичный и профессиональный психологический помощник MindMate.
-
-Твоя роль:
-1. Поддерживать пользователя в трудные моменты
-2. Задавать наводящие вопросы для самопознания
-3. Предлагать практические техники для улучшения состояния
-4. Быть дружелюбным и доступным
-
-Твой стиль общения:
-• Используй эмпатию и понимание
-• Будь конкретным и практичным
-• Говори на "ты" (неформально, но уважительно)
-• Используй эмодзи для эмоциональной окраски 🎯
-• Будь кратким (2-3 предложения в основном, максимум 5)
-
-Что НЕЛЬЗЯ делать:
-• Не давай медицинских диагнозов
-• Не назначай лекарства
-• Не заменяй профессиональную психологическую помощь
-• Не обещай мгновенного излечения
-
-В сложных случаях мягко направляй к специалистам."""
-
         # Добавляем контекст если есть
         if context:
             if context.get('name'):
-                base_prompt += f"\n\nИмя пользователя: {context['name']}"
+                parts.append(f"Имя пользователя: {context['name']}")
             
-            if context.get('mood_history'):
-                moods = context['mood_history']
-                if moods:
-                    avg_mood = sum(moods) / len(moods)
-                    base_prompt += f"\nИстория настроений пользователя: среднее {avg_mood:.1f}/10"
-                    
-                    if avg_mood < 5:
-                        base_prompt += " (пользователь часто чувствует себя плохо)"
-                    elif avg_mood > 7:
-                        base_prompt += " (пользователь обычно в хорошем настроении)"
+            # Сводка настроения фиксированного размера (см. mood_analytics.describe)
+            parts.extend(describe_mood(context.get('mood_stats')))
             
             if context.get('is_crisis'):
-                base_prompt += "\n\n⚠️ ВНИМАНИЕ: Пользователь в кризисном состоянии! Будь особенно осторожен и поддерживающ."
+                parts.append("\n⚠️ ВНИМАНИЕ: Пользователь в кризисном состоянии! Будь особенно осторожен и поддерживающ.")
         
-        return base_prompt
+        return "\n".join(parts).strip()
+    
+    def _build_messages(self, message: str, context: Optional[Dict] = None) -> List[Dict]:
+        """Собирает сообщения запроса: неизменный системный промпт, сводка старых реплик,
+        недавняя история в пределах бюджета токенов, сведения о пользователе и новое сообщение"""
+        messages = [{"role": "system", "content": self._build_system_prompt()}]
+        
+        history, summary = pack_history(context.get('chat_history') if context else None)
+        if summary:
+            messages.append({"role": "system", "content": summary})
+        messages.extend(history)
+        
+        # Изменчивые сведения идут после истории, чтобы не сбивать кешируемый префикс
+        context_prompt = self._build_context_prompt(context)
+        if context_prompt:
+            messages.append({"role": "system", "content": context_prompt})
+        
+        messages.append({"role": "user", "content": self._build_user_prompt(message, context)})
+        return messages
     
     def _build_user_prompt(self, message: str, context: Optional[Dict] = None) -> str:
         """Строит пользовательский промпт"""
@@ -193,48 +558,19 @@ class DeepSeekService:
         if not response:
             return ""
         
-        # Убираем стандартные шаблонные фразы
-        phrases_to_remove = [
-            "Конечно, я помогу вам с этим.",
-            "Я понимаю, что вы чувствуете.",
-            "Спасибо, что поделились со мной.",
-            "Как искусственный интеллект, я могу сказать, что",
-            "На основе вашего сообщения,",
-            "Уважаемый пользователь,",
-            "Дорогой пользователь,"
-        ]
-        
-        cleaned = response.strip()
-        for phrase in phrases_to_remove:
-            if cleaned.startswith(phrase):
-                cleaned = cleaned[len(phrase):].strip()
-        
-        # Убираем двойные пробелы и лишние переносы
-        cleaned = ' '.join(cleaned.split())
-        
-        # Если ответ слишком короткий, добавляем эмодзи
-        if len(cleaned) < 20 and not any(c in cleaned for c in ['🎯', '🤗', '💫', '🌟', '✨']):
-            emojis = ['🤗', '💫', '🌟', '✨', '🎯', '🧘', '💭', '🌈']
-            cleaned = f"{cleaned} {random.choice(emojis)}"
-        
-        return cleaned
+        cleaner = ResponseCleaner()
+        cleaner.feed(response)
+        cleaner.finish()
+        return cleaner.text
     
     def _is_crisis_message(self, message: str) -> bool:
         """Определяет кризисные сообщения"""
         if not message:
             return False
         
-        message_lower = message.lower()
-        
-        crisis_keywords = [
-            'суицид', 'самоубийство', 'умру', 'покончить', 'покончу',
-            'повешусь', 'вешаться', 'выброшусь', 'выбрасываться',
-            'отравлюсь', 'отравиться', 'порежусь', 'резать',
-            'не хочу жить', 'не хочу больше жить', 'надоело жить',
-            'конец', 'все кончено', 'бесполезно', 'безнадежно'
-        ]
-        
-        return any(keyword in message_lower for keyword in crisis_keywords)
+        # Тот же словарь и автомат, что и у CrisisHandler: уровень 2 и выше
+        level, _ = crisis_handler.scan(message)
+        return level >= 2
     
     def _get_crisis_response(self) -> str:
         """Ответ на кризисное сообщение"""
@@ -264,119 +600,10 @@ class DeepSeekService:
     
     def _get_fallback_response(self, message: str, context: Optional[Dict] = None) -> str:
         """Умные запасные ответы если DeepSeek недоступен"""
-        
-        if not message:
-            return "Спасибо за обращение! Как я могу помочь тебе сегодня? 🤗"
-        
-        message_lower = message.lower()
-        
-        # База знаний с умными ответами на разные темы
-        knowledge_base = {
-            'тревог': [
-                "Когда чувствуешь тревогу, попробуй технику 'заземления': назови 5 вещей вокруг себя, 4 которые можешь потрогать, 3 звука, 2 запаха, 1 вкус. Это помогает вернуться в настоящее. 🌿",
-                "Тревога часто говорит о том, что что-то важно для тебя. Можешь определить, что именно вызывает это чувство? Иногда простое осознание уже снижает тревогу. 💭",
-                "Дыхание 4-7-8: вдох на 4 счета, задержка на 7, выдох на 8. Повтори 3 раза. Это физиологически успокаивает нервную систему. 🧘"
-            ],
-            
-            'стресс': [
-                "Стресс — сигнал сделать паузу. Можешь выделить 5 минут просто посидеть в тишине? Иногда тишина лечит лучше слов. 🌸",
-                "Попробуй технику Pomodoro: 25 минут работы, 5 минут отдыха. Маленькие перерывы предотвращают большое выгорание. ⏰",
-                "Когда стресс накапливается, полезно 'разделить' его: что именно сейчас вызывает напряжение? Часто проблема кажется меньше, когда мы ее называем словами. 💡"
-            ],
-            
-            'груст': [
-                "Грусть имеет право быть. Иногда полезно просто сказать: 'Да, сейчас грустно, и это нормально'. Принятие своих чувств уже облегчает состояние. 🍂",
-                "В грустные дни маленькие ритуалы помогают: теплый чай в любимой кружке, мягкий плед, спокойная музыка. Что тебе обычно нравится? ☕",
-                "Грусть часто приходит, чтобы что-то показать. Может, есть что-то важное в твоей жизни, на что нужно обратить внимание? 🤔"
-            ],
-            
-            'устал': [
-                "Усталость говорит: 'Пора отдохнуть'. Можешь сегодня сделать что-то просто для удовольствия, без цели? Даже 15 минут помогают перезагрузиться. 🌙",
-                "Попробуй технику 'микровосстановления': 5 минут глубокого дыхания, 5 минут растяжки, 5 минут в тишине. Это как быстрая перезагрузка для тела и ума. 🔄",
-                "Усталость — не слабость, а знак, что ты много делаешь. Какой самый маленький шаг к отдыху ты можешь сделать прямо сейчас? 🐢"
-            ],
-            
-            'один': [
-                "Чувство одиночества знакомо многим, даже когда вокруг люди. Может, стоит позвонить тому, с кем давно не общался? Часто другие тоже ждут нашего звонка. 📞",
-                "Иногда помогает просто выйти в людное место: кафе, парк, библиотека. Наблюдать за жизнь вокруг — уже не так одиноко. 🌆",
-                "Ты не один в этом чувстве. Многие проходят через подобное. Что обычно помогает тебе чувствовать связь с другими? 🤝"
-            ],
-            
-            'работа': [
-                "Работа может занимать много энергии. Важно находить баланс. Что помогает тебе переключаться после работы? 🎯",
-                "Иногда полезно спросить себя: 'Что я могу сделать прямо сейчас, чтобы облегчить ситуацию?' Часто ответ проще, чем кажется. 💡",
-                "Попробуй технику 'самый важный час': определи, какой один час дня самый продуктивный, и используй его для самой важной задачи. ⭐"
-            ],
-            
-            'отношен': [
-                "Отношения — как танец: иногда нужно приблизиться, иногда отступить. Что в этой ситуации требует твоего внимания больше всего? 💃",
-                "Важно выражать свои чувства словами 'Я чувствую...' вместо 'Ты делаешь...'. Это меняет весь диалог и помогает быть услышанным. 🗣️",
-                "Иногда полезно сделать паузу в обсуждении проблем и просто побыть вместе: прогуляться, посмотреть фильм, помолчать рядом. 🌙"
-            ],
-            
-            'страх': [
-                "Страх часто преувеличивает опасность. Можешь представить самый реалистичный (а не худший) исход ситуации? Чаще всего реальность мягче, чем наши страхи. 🌈",
-                "Иногда помогает представить, что бы ты посоветовал другу в такой же ситуации. Мы часто добрее и мудрее к другим, чем к себе. 🤗",
-                "Попробуй технику 'а что, если': 'А что, если всё получится?' Часто мы фокусируемся только на негативных сценариях, забывая о возможностях. 🌟"
-            ],
-            
-            'сон': [
-                "Проблемы со сном часто говорят о перегруженном уме. Попробуй перед сном записать все мысли на бумагу — как будто выгружаешь их из головы. 📝",
-                "Вечерний ритуал помогает сигнализировать мозгу: 'Пора спать'. Чай, книга, приглушенный свет, спокойная музыка — что из этого тебе нравится? 🌙",
-                "Если не спится, не ворочайся в кровати больше 20 минут. Встань, посиди при тусклом свете, почитай что-то спокойное, потом возвращайся в кровать. 🔄"
-            ],
-            
-            'мотив': [
-                "Мотивация — как волны: то приходит, то уходит. Важно плыть даже когда волн нет. Какой самый маленький шаг ты можешь сделать прямо сейчас? 🛶",
-                "Иногда помогает начать с 'всего 5 минут'. Скажи себе: 'Я сделаю это всего 5 минут'. Чаще всего, начав, продолжаешь дольше. ⏱️",
-                "Разбей большую задачу на крошечные шаги. Каждый выполненный шаг — повод похвалить себя. Маленькие победы ведут к большим результатам. 🎉"
-            ],
-            
-            'здоров': [
-                "Забота о здоровье — это процесс. Маленькие ежедневные привычки важнее редких больших усилий. Что ты можешь сделать сегодня для своего здоровья? 🍎",
-                "Тело и психика связаны. Иногда физическая активность помогает психическому состоянию больше, чем размышления. 🏃‍♂️",
-                "Прислушивайся к сигналам своего тела. Оно часто знает, что ему нужно. 🧠"
-            ]
-        }
-        
-        # Ищем подходящую тему в сообщении
-        for topic, responses in knowledge_base.items():
-            if topic in message_lower:
-                selected_response = random.choice(responses)
-                
-                # Персонализируем если есть контекст
-                if context and context.get('name'):
-                    selected_response = selected_response.replace("тебе", f"{context['name']}, тебе")
-                
-                return selected_response
-        
-        # Общие поддерживающие ответы
-        general_responses = [
-            "Спасибо, что делишься этим со мной. Что для тебя самое важное в этой ситуации? 💭",
-            "Понимаю, что это непросто. Хочешь обсудить это подробнее? Я здесь, чтобы слушать и поддерживать. 👂",
-            "Ты не одинок в таких переживаниях. Многие проходят через похожие чувства и ситуации. 🌈",
-            "Важно, что ты обращаешь внимание на свое состояние. Это уже большой шаг к изменениям и улучшениям. 🚶‍♂️",
-            "Иногда просто проговаривание помогает увидеть ситуацию по-новому. Что ты чувствуешь в связи с этим? 🤔",
-            "Как я могу поддержать тебя в этом? Может, тебе нужна конкретная техника или просто возможность выговориться? 💖",
-            "Спасибо за доверие. Давай подумаем вместе, что могло бы помочь в этой ситуации. 💡"
-        ]
-        
-        # Добавляем персонализацию если есть контекст
-        if context:
-            # Если есть история настроений
-            if context.get('mood_history') and len(context['mood_history']) > 0:
-                last_mood = context['mood_history'][-1]
-                if last_mood <= 4:
-                    general_responses.append(f"Вижу, что в последний раз настроение было {last_mood}/10. Давай подумаем, что могло бы помочь тебе прямо сейчас? 🌱")
-                elif last_mood >= 8:
-                    general_responses.append(f"Рад, что в последний раз настроение было {last_mood}/10! Что обычно помогает тебе сохранять такое хорошее состояние? ✨")
-            
-            # Если есть имя
-            if context.get('name'):
-                personalized = [r.replace("тебе", f"{context['name']}, тебе") for r in general_responses]
-                general_responses.extend(personalized)
-        
-        return random.choice(general_responses)
+        started = time.perf_counter()
+        response = knowledge_base.get_response(message, context)
+        metrics.FALLBACK_SECONDS.observe(time.perf_counter() - started)
+        return response
 
 # Создаем глобальный экземпляр сервиса
 ai_service = DeepSeekService()
@@ -0,0 +1,49 @@
+"""Время импорта модулей бота при холодном запуске.
+
+Каждый модуль импортируется в отдельном чистом процессе (как при старте
+контейнера); asyncio, json и logging импортируются заранее - их все равно
+загружают FastAPI и uvicorn. Печатает медиану по нескольким запускам.
+
+Запуск: python benchmarks/cold_start.py [модуль ...]
+"""
+import os
+import sys
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 15
+MODULES = ["storage", "mood_chart", "crisis_handler", "knowledge_base", "log_setup",
+           "metrics", "ai_service", "bot"]
+
+PROBE = (
+    "import asyncio, json, logging, time\n"
+    "started = time.perf_counter()\n"
+    "import {module}\n"
+    "print((time.perf_counter() - started) * 1000)\n"
+)
+
+
+def import_ms(module: str) -> float:
+    result = subprocess.run([sys.executable, "-c", PROBE.format(module=module)],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    return float(result.stdout)
+
+
+def main():
+    modules = sys.argv[1:] or MODULES
+    print(f"{'module':<18}{'median ms':>10}{'min ms':>10}")
+    for module in modules:
+        try:
+            import_ms(module)  # прогрев: компиляция .pyc
+            samples = [import_ms(module) for _ in range(RUNS)]
+        except ImportError as e:
+            print(f"{module:<18}  skipped: {e}")
+            continue
+        print(f"{module:<18}{statistics.median(samples):>10.2f}{min(samples):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Журнал кризисных событий: цена записи для ответа, пропускная способность, поиск.
+
+1. Сколько обработчик тратит на фиксацию события: log_crisis_interaction
+   (буфер) против записи прямо в обработчике (INSERT + COMMIT с fsync).
+2. Фоновая запись потока событий: событий в секунду и число пачек (fsync).
+3. Поиск по пользователю, по уровню и по периоду в журнале из EVENTS событий.
+4. Оповещения об уровне 3 на локальную заглушку получателя (HTTP-сервер
+   в этом же процессе); нужен httpx.
+
+Запуск: python benchmarks/crisis_audit.py
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crisis_audit as audit_module  # noqa: E402
+from crisis_audit import SCHEMA, CrisisAuditLog  # noqa: E402
+
+EVENTS = 50_000
+USERS = 2000
+INLINE_ROUNDS = 200
+TEXTS = [
+    "я так больше не могу, все бессмысленно",
+    "не хочу жить, позвони мне +7 999 123-45-67",
+    "думаю покончить с этим сегодня",
+]
+
+
+def percentile(values, q):
+    return sorted(values)[min(len(values) - 1, int(len(values) * q))]
+
+
+def capture_cost(directory: str):
+    """мкс на событие: буфер против синхронной записи в обработчике"""
+    log = CrisisAuditLog(directory=directory, alert_url="")
+    buffered = []
+    for i in range(INLINE_ROUNDS * 10):
+        started = time.perf_counter()
+        log.record(i % USERS, 2, TEXTS[i % len(TEXTS)], i % USERS)
+        buffered.append((time.perf_counter() - started) * 1e6)
+
+    conn = sqlite3.connect(os.path.join(directory, "inline.sqlite3"), isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.executescript(SCHEMA)
+    inline = []
+    for i in range(INLINE_ROUNDS):
+        started = time.perf_counter()
+        conn.execute("INSERT INTO events (ts, user_id, chat_id, level, source, text) VALUES (?, ?, ?, ?, ?, ?)",
+                     (time.time(), i, i, 2, "message", TEXTS[i % len(TEXTS)]))
+        inline.append((time.perf_counter() - started) * 1e6)
+    conn.close()
+
+    print(f"{'capture in handler':<26}{'p50 us':>10}{'p99 us':>10}")
+    for name, values in (("buffered record()", buffered), ("inline INSERT + fsync", inline)):
+        print(f"{name:<26}{statistics.median(values):>10.1f}{percentile(values, 0.99):>10.1f}")
+
+
+async def write_and_query(directory: str):
+    log = CrisisAuditLog(directory=directory, flush_interval=0.2, batch_size=500, alert_url="")
+    log.start()
+    rng = random.Random(1)
+    batches = {"n": 0}
+    write_batch = log._write_batch
+
+    def counted(batch):
+        batches["n"] += 1
+        return write_batch(batch)
+
+    log._write_batch = counted
+    started = time.perf_counter()
+    for i in range(EVENTS):
+        log.record(rng.randrange(USERS), rng.choice((2, 2, 2, 3)), TEXTS[i % len(TEXTS)], i)
+        if i % 1000 == 0:
+            await asyncio.sleep(0)  # обработчики отдают управление между сообщениями
+    while log.written < EVENTS:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    print(f"\n{EVENTS} events written in {elapsed:.2f}s ({EVENTS / elapsed:.0f}/s), "
+          f"{batches['n']} batches (fsync)")
+
+    now = time.time()
+    queries = [
+        ("user", dict(user_id=42)),
+        ("level 3, last hour", dict(level=3, since=now - 3600)),
+        ("level >= 2, 100 newest", dict(min_level=2)),
+        ("user + level 3", dict(user_id=42, level=3)),
+    ]
+    print(f"{'query':<26}{'rows':>6}{'ms':>8}")
+    for name, kwargs in queries:
+        started = time.perf_counter()
+        rows = await log.query(**kwargs)
+        print(f"{name:<26}{len(rows):>6}{(time.perf_counter() - started) * 1000:>8.2f}")
+    await log.stop()
+
+
+async def notifier_standin(received: list):
+    """Заглушка получателя оповещений: принимает POST, отвечает 200"""
+    async def handle(reader, writer):
+        headers = {}
+        await reader.readline()
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        received.append(json.loads(body))
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def alerts(directory: str):
+    received = []
+    server = await notifier_standin(received)
+    port = server.sockets[0].getsockname()[1]
+    log = CrisisAuditLog(directory=directory, alert_url=f"http://127.0.0.1:{port}/alert")
+    log.start()
+    for i in range(20):
+        log.record(i, 3 if i % 4 == 0 else 2, "думаю покончить с этим, +7 999 123-45-67", i)
+    await log.stop()
+    server.close()
+    await server.wait_closed()
+    print(f"\nalerts: {log.alerts_sent} sent, {log.alerts_failed} failed, notifier received {len(received)}")
+    if received:
+        print(f"sample: {received[0]}")
+
+
+def main():
+    audit_module.logger.disabled = True
+    with tempfile.TemporaryDirectory() as directory:
+        capture_cost(directory)
+        asyncio.run(write_and_query(os.path.join(directory, "load")))
+        asyncio.run(alerts(os.path.join(directory, "alerts")))
+
+
+if __name__ == "__main__":
+    main()
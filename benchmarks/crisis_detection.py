@@ -0,0 +1,87 @@
+"""Точность и скорость определения кризисных сообщений.
+
+Прогоняет размеченные корпуса через морфологический индекс CrisisHandler
+и через прежний поиск подстрок, печатает precision, recall и пропускную
+способность:
+- crisis_corpus.jsonl - корпус, на котором подбирались ключевые слова;
+- crisis_holdout.jsonl - отложенный корпус: по нему словарь не настраивают,
+  он показывает, как индекс ведет себя на новых формулировках.
+
+Запуск: python benchmarks/crisis_detection.py
+"""
+import os
+import sys
+import json
+import time
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crisis_handler import CRISIS_EXACT, CRISIS_KEYWORDS, crisis_handler  # noqa: E402
+from keyword_matcher import AhoCorasick  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crisis_corpus.jsonl')
+HOLDOUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crisis_holdout.jsonl')
+CRISIS_THRESHOLD = 2
+THROUGHPUT_ROUNDS = 200
+
+# Прежний способ: поиск подстрок в message.lower()
+_substring_matcher = AhoCorasick(
+    (keyword, level) for groups in (CRISIS_KEYWORDS, CRISIS_EXACT)
+    for level, keywords in groups.items() for keyword in keywords
+)
+
+
+def substring_level(message: str) -> int:
+    return max((match.value for match in _substring_matcher.iter_matches(message.lower())), default=0)
+
+
+def index_level(message: str) -> int:
+    return crisis_handler.scan(message)[0]
+
+
+def evaluate(name, detect, corpus):
+    tp = fp = fn = exact = 0
+    for text, expected in corpus:
+        level = detect(text)
+        exact += level == expected
+        predicted, actual = level >= CRISIS_THRESHOLD, expected >= CRISIS_THRESHOLD
+        tp += predicted and actual
+        fp += predicted and not actual
+        fn += actual and not predicted
+
+    messages = [text for text, _ in corpus] * THROUGHPUT_ROUNDS
+    started = time.perf_counter()
+    for text in messages:
+        detect(text)
+    elapsed = time.perf_counter() - started
+
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    print(f"{name:<12} precision {precision:.3f}  recall {recall:.3f}  "
+          f"level accuracy {exact / len(corpus):.3f}  throughput {len(messages) / elapsed:,.0f} msg/s")
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return [(row['text'], row['level']) for row in map(json.loads, f) if row]
+
+
+def missed(detect, corpus):
+    """Сообщения, уровень которых определен неверно: (текст, ожидаемый, полученный)"""
+    return [(text, expected, level) for text, expected in corpus if (level := detect(text)) != expected]
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    for title, path in (("Corpus", CORPUS_PATH), ("Held-out", HOLDOUT_PATH)):
+        corpus = load(path)
+        print(f"{title}: {len(corpus)} messages, crisis = level >= {CRISIS_THRESHOLD}")
+        evaluate("substring", substring_level, corpus)
+        evaluate("index", index_level, corpus)
+    for text, expected, level in missed(index_level, load(HOLDOUT_PATH)):
+        print(f"  held-out miss: {text!r} expected {expected}, got {level}")
+
+
+if __name__ == "__main__":
+    main()
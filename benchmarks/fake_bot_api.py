@@ -0,0 +1,175 @@
+"""Локальный поддельный Bot API для проверки очереди исходящих (send_pipeline).
+
+Сервер на asyncio отвечает на sendMessage / sendChatAction / getMe как
+Telegram, но строже: общий лимит и лимит на чат, при превышении - 429 с
+retry_after, плюс случайные 502. Настоящий telegram.Bot ходит в него через
+base_url, так что проверяется вся цепочка: PTB -> ошибки -> повторы.
+
+Сценарий: рассылка по многим чатам, обычные ответы и кризисные ответы
+в разгар рассылки, серия "печатает..." в один чат. Печатает задержку по
+полосам, число 429/502 и повторов, сколько typing дошло до сервера и
+нарушения порядка сообщений внутри чатов.
+
+Запуск: python benchmarks/fake_bot_api.py
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import statistics
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GLOBAL_PER_SECOND = 30
+CHAT_PER_SECOND = 1
+CHAT_BURST = 3
+FAIL_RATE = 0.02
+
+
+class FakeBotApi:
+    """Минимальный HTTP/1.1 сервер с keep-alive и лимитами Telegram"""
+
+    def __init__(self):
+        self.server = None
+        self.port = None
+        self.received = {}  # chat_id -> тексты в порядке приема
+        self.calls = {}
+        self.rejected_429 = 0
+        self.failed_502 = 0
+        self._global = []
+        self._chats = {}
+        self._message_id = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._connection, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method = request_line.split()[1].decode().rsplit("/", 1)[-1]
+                status, payload = self._handle(method, self._params(headers, body))
+                data = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _params(headers, body: bytes) -> dict:
+        if headers.get("content-type", "").startswith("application/json"):
+            return json.loads(body or b"{}")
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    def _limited(self, chat_id) -> bool:
+        now = time.monotonic()
+        self._global = [t for t in self._global if now - t < 1]
+        chat = self._chats.setdefault(chat_id, [])
+        chat[:] = [t for t in chat if now - t < CHAT_BURST / CHAT_PER_SECOND]
+        if len(self._global) >= GLOBAL_PER_SECOND or len(chat) >= CHAT_BURST:
+            return True
+        self._global.append(now)
+        chat.append(now)
+        return False
+
+    def _handle(self, method: str, params: dict):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}}
+        chat_id = int(params.get("chat_id", 0))
+        if method in ("sendMessage", "sendChatAction"):
+            if random.random() < FAIL_RATE:
+                self.failed_502 += 1
+                return 502, {"ok": False, "error_code": 502, "description": "Bad Gateway"}
+            if self._limited(chat_id):
+                self.rejected_429 += 1
+                return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                             "parameters": {"retry_after": 1}}
+        if method == "sendMessage":
+            self._message_id += 1
+            self.received.setdefault(chat_id, []).append(params["text"])
+            return 200, {"ok": True, "result": {
+                "message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": params["text"]}}
+        return 200, {"ok": True, "result": True}
+
+
+async def scenario():
+    from telegram import Bot
+    from rate_limiter import SendShaper
+    from send_pipeline import BULK, CRISIS, REPLY, OutboundPipeline
+
+    api = FakeBotApi()
+    await api.start()
+    bot = Bot("123:fake", base_url=f"http://127.0.0.1:{api.port}/bot")
+    await bot.initialize()
+    pipeline = OutboundPipeline(shaper=SendShaper(per_second=25, chat_per_minute=60, chat_burst=3))
+    pipeline.start()
+
+    latencies = {"crisis": [], "reply": [], "bulk": []}
+
+    async def send(chat_id, lane, priority, seq):
+        started = time.monotonic()
+        await pipeline.send(chat_id, lambda: bot.send_message(chat_id, f"{lane} {seq}"), priority)
+        latencies[lane].append(time.monotonic() - started)
+
+    tasks = [asyncio.create_task(send(chat_id % 150, "bulk", BULK, i))
+             for i, chat_id in enumerate(range(300))]
+    tasks += [asyncio.create_task(send(1000 + i % 50, "reply", REPLY, i)) for i in range(100)]
+    await asyncio.sleep(0.5)
+    tasks += [asyncio.create_task(send(i, "crisis", CRISIS, i)) for i in range(10)]
+    for _ in range(20):
+        pipeline.typing(2000, lambda: bot.send_chat_action(2000, "typing"))
+        await asyncio.sleep(0.1)
+
+    started = time.monotonic()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.monotonic() - started
+    errors = [r for r in results if isinstance(r, Exception)]
+
+    print(f"{'lane':<8}{'count':>7}{'p50 s':>8}{'max s':>8}")
+    for lane, values in latencies.items():
+        if values:
+            print(f"{lane:<8}{len(values):>7}{statistics.median(values):>8.2f}{max(values):>8.2f}")
+
+    violations = 0
+    for texts in api.received.values():
+        for lane in ("bulk", "reply"):
+            seqs = [int(text.split()[1]) for text in texts if text.startswith(lane)]
+            violations += sum(1 for a, b in zip(seqs, seqs[1:]) if a > b)
+
+    stats = pipeline.stats()
+    print(f"\ndrained in {elapsed:.1f}s, errors: {len(errors)}, out-of-order: {violations}")
+    print(f"server: 429 x{api.rejected_429}, 502 x{api.failed_502}, "
+          f"typing calls {api.calls.get('sendChatAction', 0)}/20")
+    print(f"pipeline: retries {stats['retries']}, typing skipped {stats['typing_skipped']}, "
+          f"shaper wait {stats['shaper']['waited_seconds']}s")
+
+    await pipeline.stop()
+    await bot.shutdown()
+    await api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(scenario())
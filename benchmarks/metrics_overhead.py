@@ -0,0 +1,79 @@
+"""Накладные расходы метрик на горячем пути.
+
+Меряет стоимость Histogram.observe / Counter.inc, обработчика под
+декоратором track_handler по сравнению с тем же обработчиком без него,
+и время выгрузки /metrics.
+
+Запуск: python benchmarks/metrics_overhead.py
+"""
+import os
+import sys
+import time
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+from metrics import Counter, Histogram, Registry, track_handler  # noqa: E402
+
+ROUNDS = 200_000
+
+
+def per_call_ns(func, rounds: int = ROUNDS) -> float:
+    started = time.perf_counter()
+    for i in range(rounds):
+        func(i)
+    return (time.perf_counter() - started) / rounds * 1e9
+
+
+async def handler(update, context):
+    return None
+
+
+async def handler_ns(func, rounds: int = ROUNDS) -> float:
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=1))
+    started = time.perf_counter()
+    for i in range(rounds):
+        update.effective_user.id = i % 5000
+        await func(update, None)
+    return (time.perf_counter() - started) / rounds * 1e9
+
+
+def main():
+    histogram = Histogram("bench_seconds", "bench", ["handler"])
+    counter = Counter("bench_total", "bench", ["source"])
+
+    observe_ns = per_call_ns(lambda i: histogram.observe(0.0123, "start"))
+    inc_ns = per_call_ns(lambda i: counter.inc("ai"))
+    baseline_ns = per_call_ns(lambda i: None)
+
+    plain_ns = asyncio.run(handler_ns(handler))
+    tracked_ns = asyncio.run(handler_ns(track_handler("bench")(handler)))
+
+    registry = Registry()
+    wide = registry.register(Histogram("bench_wide_seconds", "bench", ["handler"]))
+    for name in range(50):
+        wide.observe(0.01, f"handler_{name}")
+    started = time.perf_counter()
+    for _ in range(100):
+        registry.render()
+    render_ms = (time.perf_counter() - started) / 100 * 1000
+
+    metrics.active_users.update_gauges()
+
+    print(f"{'operation':<36}{'ns/call':>10}")
+    print(f"{'empty call (baseline)':<36}{baseline_ns:>10.0f}")
+    print(f"{'Histogram.observe':<36}{observe_ns - baseline_ns:>10.0f}")
+    print(f"{'Counter.inc':<36}{inc_ns - baseline_ns:>10.0f}")
+    print(f"{'async handler':<36}{plain_ns:>10.0f}")
+    print(f"{'async handler + track_handler':<36}{tracked_ns:>10.0f}")
+    print(f"{'track_handler overhead':<36}{tracked_ns - plain_ns:>10.0f}")
+    print(f"\n/metrics render, 50 histogram series: {render_ms:.2f} ms")
+    overhead_us = (tracked_ns - plain_ns) / 1000
+    # Обработка обновления с вызовом Telegram API занимает десятки миллисекунд
+    print(f"Overhead per update: {overhead_us:.1f} us ({overhead_us / 10_000:.3%} of a 10 ms update)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Экономия от заранее собранных ответов и клавиатур.
+
+Сравнивает сборку кризисного ответа при каждом вызове с готовым текстом,
+и создание клавиатуры + сериализацию (to_dict + json.dumps, как делает
+python-telegram-bot при отправке) с заранее посчитанной клавиатурой.
+Печатает время и пиковый объем временной памяти на один ответ.
+
+Запуск: python benchmarks/precomputed_replies.py
+"""
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crisis_handler import crisis_handler  # noqa: E402
+
+ROUNDS = 20_000
+
+
+def measure(func, rounds: int = ROUNDS):
+    """(мкс на вызов, пиковый объем временной памяти на вызов в байтах)"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = (time.perf_counter() - started) / rounds * 1e6
+
+    tracemalloc.start()
+    func()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def report(name, old, new):
+    (old_us, old_bytes), (new_us, new_bytes) = old, new
+    print(f"{name:<28}{old_us:>10.2f}{new_us:>10.2f}{old_us / max(new_us, 1e-9):>8.0f}x"
+          f"{old_bytes:>12.0f}{new_bytes:>12.0f}")
+
+
+def keyboard_cases():
+    try:
+        from telegram import KeyboardButton, ReplyKeyboardMarkup
+        import bot
+    except ImportError as e:
+        print(f"\n(keyboards skipped: {e})")
+        return []
+
+    def build_and_serialize():
+        keyboard = ReplyKeyboardMarkup([
+            [KeyboardButton("📊 Записать настроение"), KeyboardButton("🧘 Техники релаксации")],
+            [KeyboardButton("💫 Позитивные аффирмации"), KeyboardButton("📈 Моя статистика")],
+            [KeyboardButton("💬 Чат с ИИ-помощником"), KeyboardButton("🚨 Кризисная помощь")],
+            [KeyboardButton("ℹ️ Помощь")]
+        ], resize_keyboard=True)
+        return json.dumps(keyboard.to_dict())
+
+    def precomputed():
+        return json.dumps(bot.get_main_keyboard().to_dict())
+
+    return [("main keyboard + JSON", build_and_serialize, precomputed)]
+
+
+def main():
+    cases = [
+        ("crisis response, level 3",
+         lambda: crisis_handler._render_response(3),
+         lambda: crisis_handler._generate_response(3)),
+        ("crisis response, level 1",
+         lambda: crisis_handler._render_response(1, crisis_handler.crisis_resources["self_help_techniques"][0]),
+         lambda: crisis_handler._generate_response(1)),
+    ] + keyboard_cases()
+
+    print(f"{'per reply':<28}{'old us':>10}{'new us':>10}{'':>9}{'old peak B':>12}{'new peak B':>12}")
+    for name, old, new in cases:
+        report(name, measure(old), measure(new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Нагрузочный тест шардирования по процессам (SHARD_WORKERS).
+
+Гоняет поток обновлений от множества чатов через ShardPool с разным
+числом процессов. Обработчик в процессе - кризисный анализ и подбор
+запасного ответа (CPU-часть чата с ИИ), повторенные HANDLER_ROUNDS раз,
+чтобы обновление стоило порядка миллисекунды, как в боте с разбором
+Update. Печатает пропускную способность, ускорение относительно одного
+процесса и проверку порядка сообщений внутри чатов.
+
+Затем считает, какая доля чатов переезжает на другой процесс при перезапуске
+с другим SHARD_WORKERS (консистентное хеширование против остатка от деления).
+
+Этот же файл - app_module для процессов пула (start_shard и т.д.).
+
+Запуск: python benchmarks/shard_scaling.py [число процессов ...]
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shard_pool import HashRing, ShardPool  # noqa: E402
+
+UPDATES = 3000
+CHATS = 500
+HANDLER_ROUNDS = int(os.getenv('SHARD_BENCH_ROUNDS', 10))
+MESSAGES = [
+    "мне очень тревожно перед экзаменом",
+    "не могу уснуть уже третью ночь",
+    "поссорился с другом и не знаю, что делать",
+    "чувствую себя одиноко",
+    "я так больше не могу",
+    "как справиться со стрессом на работе?",
+]
+
+# ---------- процесс пула ----------
+_last_seq = {}
+_order_errors = 0
+
+
+async def start_shard():
+    logging.disable(logging.CRITICAL)
+
+
+async def process_shard_update(update: dict):
+    global _order_errors
+    from crisis_handler import crisis_handler
+    from knowledge_base import knowledge_base
+
+    chat_id, seq = update["chat_id"], update["seq"]
+    if _last_seq.get(chat_id, seq - 1) != seq - 1:
+        _order_errors += 1
+    _last_seq[chat_id] = seq
+
+    text = update["text"]
+    for _ in range(HANDLER_ROUNDS):
+        crisis_handler.detect_crisis_level(text)
+        knowledge_base.get_response(text)
+
+
+async def stop_shard():
+    if _order_errors:
+        print(f"  shard pid {os.getpid()}: {_order_errors} out-of-order updates", file=sys.stderr)
+
+
+# ---------- нагрузка ----------
+async def run(workers: int) -> float:
+    pool = ShardPool("shard_scaling", workers, max_pending=200)
+    pool.start()
+    # Прогрев: процессы запущены и импортировали модули
+    for chat_id in range(workers * 20):
+        pool.submit(chat_id, {"chat_id": -chat_id - 1, "seq": 1, "text": MESSAGES[0]})
+    await pool.wait_idle(60)
+
+    seqs = {}
+    started = time.perf_counter()
+    for i in range(UPDATES):
+        chat_id = (i * 7919) % CHATS
+        seqs[chat_id] = seqs.get(chat_id, 0) + 1
+        update = {"chat_id": chat_id, "seq": seqs[chat_id], "text": MESSAGES[i % len(MESSAGES)]}
+        while not pool.submit(chat_id, update):
+            await asyncio.sleep(0.001)
+    await pool.wait_idle(120)
+    elapsed = time.perf_counter() - started
+    await pool.stop()
+    return UPDATES / elapsed
+
+
+def rebalance_table(keys: int = 100_000):
+    print(f"\n{'workers':<10}{'moved ring':>12}{'moved mod N':>13}{'ideal':>8}{'max/avg load':>14}")
+    for n in range(1, 8):
+        before, after = HashRing(range(n)), HashRing(range(n + 1))
+        moved = sum(1 for key in range(keys) if before.node_for(key) != after.node_for(key))
+        moved_mod = sum(1 for key in range(keys) if key % n != key % (n + 1))
+        loads = [0] * (n + 1)
+        for key in range(keys):
+            loads[after.node_for(key)] += 1
+        print(f"{n} -> {n + 1:<5}{moved / keys:>12.1%}{moved_mod / keys:>13.1%}{1 / (n + 1):>8.1%}"
+              f"{max(loads) / (keys / (n + 1)):>14.2f}")
+
+
+def main():
+    logging.disable(logging.WARNING)  # предупреждения о переполнении - ожидаемая обратная связь
+    counts = [int(arg) for arg in sys.argv[1:]] or [1, 2, 4]
+    print(f"CPU cores: {os.cpu_count()}, handler rounds: {HANDLER_ROUNDS}, {UPDATES} updates / {CHATS} chats")
+    print(f"{'processes':<12}{'updates/s':>12}{'speedup':>10}")
+    baseline = None
+    for workers in counts:
+        throughput = asyncio.run(run(workers))
+        baseline = baseline or throughput
+        print(f"{workers:<12}{throughput:>12.0f}{throughput / baseline:>9.2f}x")
+    rebalance_table()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
@@ -0,0 +1,121 @@
+"""Пропускная способность приема вебхуков на одном ядре: до и после fast path.
+
+До: тело разбирается целиком в dict (json, как FastAPI для `request: dict`),
+затем Update.de_json строит объекты для каждого обновления.
+После: peek_update (orjson, если установлен) достает тип, chat_id и текст,
+обновления без обработчика отбрасываются, Update строится только для
+оставшихся.
+
+Поток обновлений - смесь, похожая на живую: текстовые сообщения и команды,
+правки сообщений, фото и стикеры, нажатия инлайн-кнопок, изменения статуса
+бота в чате. Без python-telegram-bot сравнивается только разбор JSON.
+
+Запуск: python benchmarks/webhook_ingest.py
+"""
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webhook_fastpath  # noqa: E402
+from webhook_fastpath import peek_update  # noqa: E402
+
+UPDATES = 20_000
+ROUNDS = 3
+
+
+def user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "Аня", "last_name": "Петрова",
+            "username": f"user{user_id}", "language_code": "ru"}
+
+
+def message(update_id: int, chat_id: int, **fields) -> dict:
+    result = {"message_id": update_id, "date": 1700000000 + update_id, "from": user(chat_id),
+              "chat": {"id": chat_id, "type": "private", "first_name": "Аня", "username": f"user{chat_id}"}}
+    result.update(fields)
+    return result
+
+
+def make_update(update_id: int, rng: random.Random) -> dict:
+    chat_id = rng.randrange(1, 5000)
+    roll = rng.random()
+    if roll < 0.55:
+        text = rng.choice(["мне сегодня очень тревожно, не могу сосредоточиться на работе",
+                           "💬 Чат с ИИ-помощником", "7", "спасибо, стало немного легче"])
+        return {"update_id": update_id, "message": message(update_id, chat_id, text=text)}
+    if roll < 0.65:
+        return {"update_id": update_id, "message": message(
+            update_id, chat_id, text="/mood", entities=[{"type": "bot_command", "offset": 0, "length": 5}])}
+    if roll < 0.75:
+        return {"update_id": update_id, "edited_message": message(
+            update_id, chat_id, text="исправил опечатку", edit_date=1700000100 + update_id)}
+    if roll < 0.85:
+        photo = [{"file_id": f"AgAC{i}{update_id}", "file_unique_id": f"AQAD{i}", "width": 90 * (i + 1),
+                  "height": 60 * (i + 1), "file_size": 1500 * (i + 1)} for i in range(4)]
+        return {"update_id": update_id, "message": message(update_id, chat_id, photo=photo)}
+    if roll < 0.90:
+        sticker = {"file_id": f"CAAC{update_id}", "file_unique_id": "AgAD", "type": "regular", "width": 512,
+                   "height": 512, "is_animated": False, "is_video": False, "emoji": "😊", "set_name": "mood"}
+        return {"update_id": update_id, "message": message(update_id, chat_id, sticker=sticker)}
+    if roll < 0.95:
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user(chat_id), "chat_instance": "-1", "data": "mood:7",
+            "message": message(update_id, chat_id, text="Как настроение?")}}
+    return {"update_id": update_id, "my_chat_member": {
+        "chat": {"id": chat_id, "type": "private", "first_name": "Аня"}, "from": user(chat_id),
+        "date": 1700000000 + update_id,
+        "old_chat_member": {"status": "member", "user": user(1)},
+        "new_chat_member": {"status": "kicked", "user": user(1), "until_date": 0}}}
+
+
+def pin_single_core():
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+
+def throughput(ingest, bodies) -> float:
+    best = 0.0
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for body in bodies:
+            ingest(body)
+        best = max(best, len(bodies) / (time.perf_counter() - started))
+    return best
+
+
+def main():
+    pin_single_core()
+    rng = random.Random(42)
+    bodies = [json.dumps(make_update(i, rng), ensure_ascii=False).encode() for i in range(UPDATES)]
+    handled = sum(1 for body in bodies if peek_update(body).handled)
+    decoder = "orjson" if webhook_fastpath.loads is not json.loads else "json (orjson not installed)"
+    print(f"{UPDATES} updates, {handled / UPDATES:.0%} reach a handler, decoder: {decoder}")
+
+    try:
+        from telegram import Bot, Update
+        bot = Bot("123:fake")
+    except ImportError as e:
+        print(f"(Update.de_json skipped: {e})")
+        Update = bot = None
+
+    def before(body):
+        payload = json.loads(body)
+        if Update:
+            Update.de_json(payload, bot)
+
+    def after(body):
+        head = peek_update(body)
+        if Update and head.handled:
+            Update.de_json(head.payload, bot)
+
+    old, new = throughput(before, bodies), throughput(after, bodies)
+    print(f"{'path':<10}{'updates/s':>12}")
+    print(f"{'before':<10}{old:>12.0f}")
+    print(f"{'after':<10}{new:>12.0f}{new / old:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,60 @@
 import os
+import hmac
+import json
+import time
+import asyncio
 import logging
 import random
 from datetime import datetime
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from fastapi import FastAPI
-import uvicorn
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 # Импортируем наши модули
 from ai_service import ai_service
-from crisis_handler import crisis_handler
+from crisis_handler import crisis_handler, escape_markdown
+from crisis_audit import CRISIS_AUDIT_TOKEN, crisis_audit
+from update_queue import UpdateQueue
+from shard_pool import ShardPool
+from webhook_fastpath import peek_update
+from storage import MemoryUserStore, create_user_store
+from mood_series import MoodSeries
+from mood_analytics import analyze as analyze_mood
+from mood_chart import MOOD_CHART, chart_renderer
+import metrics
+from metrics import track_handler
+from log_setup import setup_logging, stop_logging
+from rate_limiter import chat_rate_limiter
+from message_coalescer import MessageCoalescer
+from message_router import USER_MODE_CACHE_SIZE, MessageRouter, ModeCache, parse_mood_number
+from send_pipeline import BULK, CRISIS, REPLY, OutboundPipeline
+from reminder_scheduler import REMINDERS_ENABLED, REMINDERS_PATH, Reminder, ReminderScheduler, parse_remind_args
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Настройка логирования (формат, асинхронная запись и прореживание - см. log_setup)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Получаем токен из переменных окружения
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
+# Режим очереди: /webhook сразу отвечает 200, обновления обрабатывают фоновые воркеры
+WEBHOOK_QUEUE_MODE = os.getenv('WEBHOOK_QUEUE_MODE', '').lower() in ('1', 'true', 'yes')
+UPDATE_QUEUE_WORKERS = int(os.getenv('UPDATE_QUEUE_WORKERS', 8))
+UPDATE_QUEUE_MAXSIZE = int(os.getenv('UPDATE_QUEUE_MAXSIZE', 1000))
+
+# Процессы-обработчики: обновления распределяются по ним по chat_id (0 - один процесс)
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', 0))
+
+# Потоковые ответы ИИ: первое сообщение отправляется с первыми токенами и затем редактируется
+AI_STREAMING = os.getenv('AI_STREAMING', '').lower() in ('1', 'true', 'yes')
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.0))
+STREAM_MIN_CHARS = int(os.getenv('STREAM_MIN_CHARS', 40))
+
+# Сколько последних реплик хранить (в запрос к ИИ попадает столько, сколько влезет в бюджет токенов)
+CHAT_HISTORY_LIMIT = int(os.getenv('CHAT_HISTORY_LIMIT', 30))
+
 # Создаем приложения
 app = FastAPI(title="MindMate Bot")
 bot_app = None
@@ -30,42 +64,87 @@ if TOKEN:
         bot_app = Application.builder().token(TOKEN).build()
         logger.info("✅ Telegram bot initialized successfully")
     except Exception as e:
-        logger.error(f"❌ Failed to initialize bot: {e}")
+        logger.error("❌ Failed to initialize bot: %s", e)
         bot_app = None
 else:
     logger.warning("⚠️ TELEGRAM_BOT_TOKEN not found. Telegram functions disabled.")
 
-# База данных в памяти (временно, можно заменить на базу)
-user_data = {}
+# Готовность: обработчики зарегистрированы и бот инициализирован (см. ensure_bot_ready)
+bot_ready = False
+bot_init_lock = asyncio.Lock()
+
+async def process_raw_update(payload: dict):
+    """Полный разбор в Update - только для обновлений, у которых есть обработчик"""
+    await bot_app.process_update(Update.de_json(payload, bot_app.bot))
+
+update_queue = None
+shard_pool = None
+if bot_app and SHARD_WORKERS > 0:
+    # Этот процесс только принимает вебхуки; обработка - в процессах пула
+    shard_pool = ShardPool(__name__, SHARD_WORKERS)
+elif bot_app and WEBHOOK_QUEUE_MODE:
+    update_queue = UpdateQueue(process_raw_update, UPDATE_QUEUE_WORKERS, UPDATE_QUEUE_MAXSIZE)
+
+# Хранилище состояния пользователей (memory / sqlite / redis, см. STORAGE_BACKEND)
+user_store = create_user_store()
+
+# Все исходящие сообщения: приоритеты, лимиты Telegram, повторы (см. send_pipeline)
+outbound = OutboundPipeline()
+
+async def reply(update: Update, text: str, priority: int = REPLY, **kwargs):
+    """Ответ на сообщение пользователя через очередь исходящих"""
+    return await outbound.send(update.effective_chat.id, lambda: update.message.reply_text(text, **kwargs), priority)
 
 # ========== КЛАВИАТУРЫ ==========
+class PrecomputedKeyboard(ReplyKeyboardMarkup):
+    """Клавиатура, которая создается один раз при запуске.
+
+    Объекты Telegram неизменяемы, поэтому словарь для API (и JSON)
+    можно посчитать заранее, а не обходить кнопки при каждой отправке.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self._unfrozen():
+            self._cached_dict = super().to_dict()
+            self._cached_json = json.dumps(self._cached_dict, ensure_ascii=False)
+
+    def to_dict(self, recursive: bool = True) -> dict:
+        return self._cached_dict
+
+    def to_json(self, *args, **kwargs) -> str:
+        return self._cached_json
+
+MAIN_KEYBOARD = PrecomputedKeyboard([
+    [KeyboardButton("📊 Записать настроение"), KeyboardButton("🧘 Техники релаксации")],
+    [KeyboardButton("💫 Позитивные аффирмации"), KeyboardButton("📈 Моя статистика")],
+    [KeyboardButton("💬 Чат с ИИ-помощником"), KeyboardButton("🚨 Кризисная помощь")],
+    [KeyboardButton("ℹ️ Помощь")]
+], resize_keyboard=True)
+
+MOOD_KEYBOARD = PrecomputedKeyboard([
+    [KeyboardButton("1 😫"), KeyboardButton("2 😔"), KeyboardButton("3 😟")],
+    [KeyboardButton("4 😐"), KeyboardButton("5 🙂"), KeyboardButton("6 😊")],
+    [KeyboardButton("7 😄"), KeyboardButton("8 🤩"), KeyboardButton("9 🥰")],
+    [KeyboardButton("10 🎉"), KeyboardButton("↩️ Назад")]
+], resize_keyboard=True)
+
+CHAT_MODE_KEYBOARD = PrecomputedKeyboard([
+    [KeyboardButton("🔄 Новый вопрос"), KeyboardButton("🚨 Кризисная помощь")],
+    [KeyboardButton("↩️ В главное меню")]
+], resize_keyboard=True)
+
 def get_main_keyboard():
     """Основная клавиатура с кнопками"""
-    keyboard = [
-        [KeyboardButton("📊 Записать настроение"), KeyboardButton("🧘 Техники релаксации")],
-        [KeyboardButton("💫 Позитивные аффирмации"), KeyboardButton("📈 Моя статистика")],
-        [KeyboardButton("💬 Чат с ИИ-помощником"), KeyboardButton("🚨 Кризисная помощь")],
-        [KeyboardButton("ℹ️ Помощь")]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return MAIN_KEYBOARD
 
 def get_mood_keyboard():
     """Клавиатура для выбора настроения"""
-    keyboard = [
-        [KeyboardButton("1 😫"), KeyboardButton("2 😔"), KeyboardButton("3 😟")],
-        [KeyboardButton("4 😐"), KeyboardButton("5 🙂"), KeyboardButton("6 😊")],
-        [KeyboardButton("7 😄"), KeyboardButton("8 🤩"), KeyboardButton("9 🥰")],
-        [KeyboardButton("10 🎉"), KeyboardButton("↩️ Назад")]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return MOOD_KEYBOARD
 
 def get_chat_mode_keyboard():
     """Клавиатура в режиме чата"""
-    keyboard = [
-        [KeyboardButton("🔄 Новый вопрос"), KeyboardButton("🚨 Кризисная помощь")],
-        [KeyboardButton("↩️ В главное меню")]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return CHAT_MODE_KEYBOARD
 
 # Техники релаксации
 RELAXATION_TECHNIQUES = [
@@ -101,29 +180,10 @@ POSITIVE_AFFIRMATIONS = [
     "Маленькие шаги ведут к большим изменениям! 🐢"
 ]
 
-MOOD_EMOJIS = {
-    1: "😫", 2: "😔", 3: "😟", 4: "😐", 5: "🙂",
-    6: "😊", 7: "😄", 8: "🤩", 9: "🥰", 10: "🎉"
-}
-
-# ========== ОБРАБОТЧИКИ КОМАНД ==========
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Команда /start"""
-    user = update.effective_user
-    user_id = user.id
-    
-    # Инициализация пользователя
-    if user_id not in user_data:
-        user_data[user_id] = {
-            "mood_history": [],
-            "name": user.first_name,
-            "joined_date": datetime.now().isoformat(),
-            "in_chat_mode": False,
-            "chat_history": []
-        }
-    
-    welcome_text = f"""
-🤗 Привет, {user.first_name}! 
+# ========== ГОТОВЫЕ ТЕКСТЫ ==========
+# Собираются один раз при запуске; в ответ подставляется только имя (экранированное)
+START_TEMPLATE = """
+🤗 Привет, {name}! 
 
 Я — *MindMate*, твой персональный помощник для заботы о ментальном здоровье.
 
@@ -140,11 +200,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 *Важно:* Я - бот-помощник, а не медицинский специалист.
 В критических ситуациях обращайтесь к профессионалам.
 """
-    await update.message.reply_text(welcome_text, parse_mode='Markdown', reply_markup=get_main_keyboard())
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Команда /help"""
-    help_text = """
+HELP_TEXT = """
 📖 *Помощь по использованию MindMate*
 
 *Основные функции:*
@@ -165,30 +222,54 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 Если тебе очень тяжело, нажми "🚨 Кризисная помощь"
 для получения контактов специалистов.
 
+*Напоминания:* /remind — каждый день спрошу о настроении
+или пришлю аффирмацию в удобное тебе время.
+
 🤗 *Помни:* обращаться за помощью — это нормально!
 """
-    await update.message.reply_text(help_text, parse_mode='Markdown')
 
-async def mood_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Запись настроения"""
-    user_id = update.effective_user.id
-    user_data[user_id]["in_chat_mode"] = False
-    
-    await update.message.reply_text(
-        "📊 *Оцени свое настроение от 1 до 10:*\n\n"
-        "1 😫 - Очень плохо\n"
-        "10 🎉 - Отлично\n\n"
-        "Выбери цифру:",
-        parse_mode='Markdown',
-        reply_markup=get_mood_keyboard()
-    )
+MOOD_PROMPT_TEXT = (
+    "📊 *Оцени свое настроение от 1 до 10:*\n\n"
+    "1 😫 - Очень плохо\n"
+    "10 🎉 - Отлично\n\n"
+    "Выбери цифру:"
+)
 
-async def relax_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Техники релаксации"""
-    technique = random.choice(RELAXATION_TECHNIQUES)
+MOOD_REMINDER_TEXT = (
+    "🌤 *Как ты сегодня?*\n\n"
+    "Оцени свое настроение от 1 до 10 - это займет секунду:"
+)
+
+REMIND_HELP_TEXT = (
+    "⏰ *Ежедневные напоминания*\n\n"
+    "`/remind 09:00` - спросить о настроении в 9:00 по Москве\n"
+    "`/remind 09:00 +5` - то же по времени UTC+5\n"
+    "`/remind affirmation 20:00` - аффирмация в 20:00\n"
+    "`/remind off` - отключить все напоминания"
+)
+
+REMINDER_NAMES = {"mood": "спрашивать о настроении", "affirmation": "присылать аффирмацию"}
+
+CHAT_MODE_TEXT = (
+    "💬 *Чат с ИИ-помощником*\n\n"
+    "Напиши то, что тебя беспокоит, и я постараюсь помочь.\n"
+    "Я использую DeepSeek AI для умных ответов.\n\n"
+    "*Что можно спросить:*\n"
+    "• Как справиться с тревогой?\n"
+    "• Что делать при стрессе?\n"
+    "• Как улучшить настроение?\n"
+    "• Или просто поделиться переживаниями\n\n"
+    "Используй кнопки ниже для навигации:"
+)
+
+NEW_QUESTION_TEXT = (
+    "🔄 *Новый диалог*\n\n"
+    "Задай новый вопрос или поделись тем, что тебя беспокоит:"
+)
+
+def render_relaxation_technique(technique: dict) -> str:
     steps_text = "\n".join([f"• {step}" for step in technique["steps"]])
-    
-    technique_text = f"""
+    return f"""
 {technique['name']}
 
 *{technique['description']}*
@@ -198,27 +279,129 @@ async def relax_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 ⏱️ *Выполняй 5-10 минут*
 """
-    await update.message.reply_text(technique_text, parse_mode='Markdown')
 
+RELAXATION_TEXTS = [render_relaxation_technique(technique) for technique in RELAXATION_TECHNIQUES]
+AFFIRMATION_TEXTS = [f"💫 *Поддержка для тебя:*\n\n{affirmation}" for affirmation in POSITIVE_AFFIRMATIONS]
+
+MOOD_EMOJIS = {
+    1: "😫", 2: "😔", 3: "😟", 4: "😐", 5: "🙂",
+    6: "😊", 7: "😄", 8: "🤩", 9: "🥰", 10: "🎉"
+}
+
+def get_mood_series(data: dict) -> MoodSeries:
+    """Ряд настроений пользователя (запись в хранилище переводится в MoodSeries)"""
+    series = MoodSeries.from_data(data.get("mood_history"), data.get("joined_date"), data.get("utc_offset"))
+    data["mood_history"] = series
+    return series
+
+# ========== ОБРАБОТЧИКИ КОМАНД ==========
+@track_handler()
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /start"""
+    user = update.effective_user
+    user_id = user.id
+    
+    # Инициализация пользователя
+    await user_store.get_or_create(user_id, user.first_name)
+    
+    welcome_text = START_TEMPLATE.format(name=escape_markdown(user.first_name or ""))
+    await reply(update, welcome_text, parse_mode='Markdown', reply_markup=get_main_keyboard())
+
+@track_handler()
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /help"""
+    await reply(update, HELP_TEXT, parse_mode='Markdown')
+
+@track_handler()
+async def mood_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запись настроения"""
+    user = update.effective_user
+    data = await user_store.get_or_create(user.id, user.first_name)
+    await set_chat_mode(user.id, data, False)
+    
+    await reply(update, MOOD_PROMPT_TEXT, parse_mode='Markdown', reply_markup=get_mood_keyboard())
+
+@track_handler()
+async def relax_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Техники релаксации"""
+    await reply(update, random.choice(RELAXATION_TEXTS), parse_mode='Markdown')
+
+@track_handler()
 async def affirmation_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Позитивные аффирмации"""
-    affirmation = random.choice(POSITIVE_AFFIRMATIONS)
-    await update.message.reply_text(f"💫 *Поддержка для тебя:*\n\n{affirmation}", parse_mode='Markdown')
+    await reply(update, random.choice(AFFIRMATION_TEXTS), parse_mode='Markdown')
 
+@track_handler()
+async def remind_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /remind: ежедневные напоминания в местное время"""
+    if not reminder_scheduler:
+        await reply(update, "Напоминания сейчас недоступны 🙏")
+        return
+    user_id = update.effective_user.id
+    parsed = parse_remind_args(" ".join(context.args)) if context.args else None
+    if parsed is None:
+        lines = [REMIND_HELP_TEXT]
+        for reminder in await reminder_scheduler.for_user(user_id):
+            lines.append(f"✅ Сейчас: {REMINDER_NAMES[reminder.kind]} в {reminder.local_time} "
+                         f"(UTC{reminder.utc_offset:+g})")
+        await reply(update, "\n\n".join(lines), parse_mode='Markdown')
+        return
+    
+    kind, minute, utc_offset = parsed
+    if minute is None:
+        await reminder_scheduler.remove(user_id, kind)
+        await reply(update, "🔕 Напоминания отключены", reply_markup=get_main_keyboard())
+        return
+    reminder = await reminder_scheduler.set(user_id, update.effective_chat.id, kind, minute, utc_offset)
+    # Часовой пояс из /remind - и для дней и часов в статистике настроения
+    data = await user_store.get(user_id)
+    if data and data.get("utc_offset") != utc_offset:
+        # Ряд настроений берет пояс из этого поля при каждом чтении (get_mood_series)
+        data["utc_offset"] = utc_offset
+        await user_store.save(user_id, data, ("utc_offset",))
+    await reply(
+        update,
+        f"⏰ Договорились! Буду {REMINDER_NAMES[kind]} каждый день в {reminder.local_time} "
+        f"(UTC{utc_offset:+g})",
+        reply_markup=get_main_keyboard()
+    )
+
+async def deliver_reminder(reminder: Reminder):
+    """Отправка напоминания - в самой медленной полосе очереди исходящих"""
+    if reminder.kind == "mood":
+        text, markup = MOOD_REMINDER_TEXT, get_mood_keyboard()
+    else:
+        text, markup = random.choice(AFFIRMATION_TEXTS), None
+    await outbound.send(
+        reminder.chat_id,
+        lambda: bot_app.bot.send_message(reminder.chat_id, text, parse_mode='Markdown', reply_markup=markup),
+        BULK
+    )
+
+# Один файл расписания на все процессы: /remind меняет его в любом процессе,
+# а рассылает один владелец (см. ReminderScheduler)
+reminder_scheduler = None
+if bot_app and REMINDERS_ENABLED:
+    reminder_scheduler = ReminderScheduler(deliver_reminder, REMINDERS_PATH)
+
+@track_handler()
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Статистика настроения"""
     user_id = update.effective_user.id
+    data = await user_store.get(user_id)
+    series = get_mood_series(data) if data else None
     
-    if user_id not in user_data or not user_data[user_id]["mood_history"]:
-        await update.message.reply_text(
+    if not series:
+        await reply(
+            update,
             "📊 *У тебя пока нет записей настроения.*\n\n"
             "Используй кнопку \"📊 Записать настроение\" чтобы начать!",
             parse_mode='Markdown'
         )
         return
     
-    moods = user_data[user_id]["mood_history"]
-    avg_mood = sum(moods) / len(moods)
+    stats = analyze_mood(series)
+    avg_mood = stats["average"]
     
     # Анализ
     if avg_mood <= 4:
@@ -228,195 +411,319 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         analysis = "💚 Отлично! Ты хорошо справляешься."
     
+    window_text = ""
+    if stats["avg_7d"] is not None:
+        window_text += f"\n• 🗓 За 7 дней: *{stats['avg_7d']:.1f}/10*"
+    if stats["avg_30d"] is not None:
+        window_text += f"\n• 🗓 За 30 дней: *{stats['avg_30d']:.1f}/10*"
+    
+    trend_text = {
+        "up": "📈 Настроение улучшается последние две недели",
+        "down": "📉 Настроение снижается последние две недели",
+        "flat": "➖ Настроение стабильно последние две недели"
+    }.get(stats["trend"])
+    
+    patterns = []
+    if trend_text:
+        patterns.append(trend_text)
+    if stats["best_weekday"]:
+        patterns.append(f"🌤 Лучше всего {stats['best_weekday']}, тяжелее {stats['worst_weekday']}")
+    if stats["best_day_part"]:
+        patterns.append(f"🕐 Лучше всего {stats['best_day_part']}, тяжелее {stats['worst_day_part']}")
+    if stats["volatility_30d"] is not None:
+        stability = "заметно меняется" if stats["volatility_30d"] >= 2 else "довольно ровное"
+        patterns.append(f"🌊 От дня ко дню настроение {stability}")
+    if stats["streak"] > 1:
+        patterns.append(f"🔥 Записи {stats['streak']} дн. подряд (рекорд: {stats['best_streak']})")
+    patterns_text = ""
+    if patterns:
+        patterns_text = "\n*Закономерности:*\n" + "\n".join(f"• {line}" for line in patterns) + "\n"
+    
     stats_text = f"""
 📈 *Твоя статистика:*
 
-• 📊 Всего записей: *{len(moods)}*
-• 📅 Среднее настроение: *{avg_mood:.1f}/10*
-• 🎯 Последняя запись: *{moods[-1]}/10* {MOOD_EMOJIS.get(moods[-1], '')}
+• 📊 Всего записей: *{stats['count']}*
+• 📅 Среднее настроение: *{avg_mood:.1f}/10*{window_text}
+• 🎯 Последняя запись: *{stats['last']}/10* {MOOD_EMOJIS.get(stats['last'], '')}
 
+{patterns_text}
 *Анализ:*
 {analysis}
 
 Продолжай заботиться о себе! 🌟
 """
-    await update.message.reply_text(stats_text, parse_mode='Markdown')
+    await reply(update, stats_text, parse_mode='Markdown')
+    
+    if MOOD_CHART:
+        await send_mood_chart(update, user_id, series)
 
+async def send_mood_chart(update: Update, user_id: int, series: MoodSeries):
+    """График настроения: file_id из кеша, готовый PNG или рендер в пуле процессов"""
+    try:
+        png, file_id = await chart_renderer.get_chart(user_id, series)
+        chat_id = update.effective_chat.id
+        if file_id:
+            await outbound.send(chat_id, lambda: update.message.reply_photo(photo=file_id))
+            return
+        sent = await outbound.send(
+            chat_id, lambda: update.message.reply_photo(photo=png, caption="📉 Настроение за последние недели")
+        )
+        if sent.photo:
+            chart_renderer.remember_file_id(user_id, series.version, sent.photo[-1].file_id)
+    except Exception as e:
+        logger.error("Chart error: %s", e)
+
+@track_handler()
 async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Чат с ИИ-помощником"""
-    user_id = update.effective_user.id
-    user_data[user_id]["in_chat_mode"] = True
-    
-    await update.message.reply_text(
-        "💬 *Чат с ИИ-помощником*\n\n"
-        "Напиши то, что тебя беспокоит, и я постараюсь помочь.\n"
-        "Я использую DeepSeek AI для умных ответов.\n\n"
-        "*Что можно спросить:*\n"
-        "• Как справиться с тревогой?\n"
-        "• Что делать при стрессе?\n"
-        "• Как улучшить настроение?\n"
-        "• Или просто поделиться переживаниями\n\n"
-        "Используй кнопки ниже для навигации:",
-        parse_mode='Markdown',
-        reply_markup=get_chat_mode_keyboard()
-    )
+    user = update.effective_user
+    data = await user_store.get_or_create(user.id, user.first_name)
+    await set_chat_mode(user.id, data, True)
+    
+    await reply(update, CHAT_MODE_TEXT, parse_mode='Markdown', reply_markup=get_chat_mode_keyboard())
 
+@track_handler()
 async def crisis_help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Кризисная помощь"""
     response = crisis_handler.get_crisis_response()
-    await update.message.reply_text(response, parse_mode='Markdown')
+    # Просьба о помощи - в журнал с уровнем показанного ответа
+    crisis_handler.log_crisis_interaction(update.effective_user.id, update.message.text, 2,
+                                          update.effective_chat.id, "button")
+    await reply(update, response, CRISIS, parse_mode='Markdown')
 
+@track_handler()
 async def new_question_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Новый вопрос в чате"""
     user_id = update.effective_user.id
-    if user_id in user_data:
-        user_data[user_id]["chat_history"] = []
-    
-    await update.message.reply_text(
-        "🔄 *Новый диалог*\n\n"
-        "Задай новый вопрос или поделись тем, что тебя беспокоит:",
-        parse_mode='Markdown',
-        reply_markup=get_chat_mode_keyboard()
-    )
+    data = await user_store.get(user_id)
+    if data and data["chat_history"]:
+        data["chat_history"] = []
+        await user_store.save(user_id, data, ("chat_history",))
+    
+    await reply(update, NEW_QUESTION_TEXT, parse_mode='Markdown', reply_markup=get_chat_mode_keyboard())
+
+# ========== МАРШРУТЫ КНОПОК ==========
+async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки «Назад» и «В главное меню»"""
+    user = update.effective_user
+    data = await user_store.get_or_create(user.id, user.first_name)
+    await set_chat_mode(user.id, data, False)
+    await reply(update, "Возвращаю в главное меню! 🏠", reply_markup=get_main_keyboard())
+
+def mood_button(mood_score: int):
+    """Обработчик кнопки с оценкой настроения"""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await save_mood(update, mood_score)
+    return handler
+
+# Текст кнопки -> обработчик (новые кнопки добавляются сюда, а не в handle_message)
+router = MessageRouter()
+router.add_routes({
+    "📊 Записать настроение": mood_command,
+    "🧘 Техники релаксации": relax_command,
+    "💫 Позитивные аффирмации": affirmation_command,
+    "📈 Моя статистика": stats_command,
+    "💬 Чат с ИИ-помощником": chat_command,
+    "🚨 Кризисная помощь": crisis_help_command,
+    "ℹ️ Помощь": help_command,
+    "🔄 Новый вопрос": new_question_command,
+    "↩️ Назад": back_to_menu,
+    "↩️ В главное меню": back_to_menu,
+})
+router.add_routes({f"{score} {emoji}": mood_button(score) for score, emoji in MOOD_EMOJIS.items()})
+
+# Режим пользователя (чат с ИИ или меню) без чтения записи на каждое сообщение.
+# Только если режим меняется лишь в этом процессе: хранилище memory или процесс
+# пула (чат всегда в одном процессе). Воркеры uvicorn с общим sqlite/redis
+# читают режим из хранилища
+mode_cache = ModeCache(
+    USER_MODE_CACHE_SIZE if isinstance(user_store, MemoryUserStore) or os.getenv('SHARD_INDEX') else 0
+)
+
+async def set_chat_mode(user_id: int, data: dict, enabled: bool):
+    """Переключает режим чата с ИИ в записи пользователя и в кеше режимов"""
+    mode_cache.set(user_id, enabled)
+    if data["in_chat_mode"] != enabled:
+        data["in_chat_mode"] = enabled
+        await user_store.save(user_id, data, ("in_chat_mode",))
+
+NAVIGATION_HINTS = [
+    "Используй кнопки ниже для навигации! 🤗",
+    "Выбери нужную функцию из меню! 💫",
+    "Нажми на одну из кнопок, чтобы продолжить! ✨"
+]
 
 # ========== ОБРАБОТЧИКИ СООБЩЕНИЙ ==========
+@track_handler()
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текстовых сообщений и кнопок"""
     user_text = update.message.text
-    user_id = update.effective_user.id
     
-    # Инициализация пользователя
-    if user_id not in user_data:
-        user_data[user_id] = {
-            "mood_history": [],
-            "name": update.effective_user.first_name,
-            "joined_date": datetime.now().isoformat(),
-            "in_chat_mode": False,
-            "chat_history": []
-        }
-    
-    # Обработка кнопок главного меню
-    if user_text == "📊 Записать настроение":
-        await mood_command(update, context)
-        return
-    elif user_text == "🧘 Техники релаксации":
-        await relax_command(update, context)
-        return
-    elif user_text == "💫 Позитивные аффирмации":
-        await affirmation_command(update, context)
-        return
-    elif user_text == "📈 Моя статистика":
-        await stats_command(update, context)
-        return
-    elif user_text == "💬 Чат с ИИ-помощником":
-        await chat_command(update, context)
-        return
-    elif user_text == "🚨 Кризисная помощь":
-        await crisis_help_command(update, context)
-        return
-    elif user_text == "ℹ️ Помощь":
-        await help_command(update, context)
-        return
-    elif user_text == "🔄 Новый вопрос":
-        await new_question_command(update, context)
-        return
-    
-    # Навигация
-    if user_text == "↩️ Назад" or user_text == "↩️ В главное меню":
-        user_data[user_id]["in_chat_mode"] = False
-        await update.message.reply_text(
-            "Возвращаю в главное меню! 🏠",
-            reply_markup=get_main_keyboard()
-        )
+    # Кнопки меню, навигации и оценки настроения - одна проверка по таблице
+    route = router.match(user_text)
+    if route is not None:
+        await route(update, context)
         return
     
-    # Обработка настроения
-    if user_text.startswith(("1", "2", "3", "4", "5", "6", "7", "8", "9", "10")) and "�" in user_text:
-        mood_score = int(user_text.split()[0])
-        await save_mood(update, mood_score)
-        return
+    user = update.effective_user
+    in_chat_mode = mode_cache.get(user.id)
+    if in_chat_mode is None:
+        # Инициализация пользователя
+        data = await user_store.get_or_create(user.id, user.first_name)
+        in_chat_mode = data.get("in_chat_mode", False)
+        mode_cache.set(user.id, in_chat_mode)
     
     # Если пользователь в режиме чата с ИИ
-    if user_id in user_data and user_data[user_id].get("in_chat_mode", False):
-        await handle_ai_chat(update, user_text, user_id)
+    if in_chat_mode:
+        await handle_ai_chat(update, user_text, user.id)
         return
     
-    # Обработка цифр настроения (без эмодзи)
-    if user_text.isdigit() and 1 <= int(user_text) <= 10:
-        await save_mood(update, int(user_text))
+    # Оценка настроения числом (без кнопки)
+    mood_score = parse_mood_number(user_text)
+    if mood_score is not None:
+        await save_mood(update, mood_score)
         return
     
     # Обычные сообщения (не в режиме чата)
-    responses = [
-        "Используй кнопки ниже для навигации! 🤗",
-        "Выбери нужную функцию из меню! 💫",
-        "Нажми на одну из кнопок, чтобы продолжить! ✨"
-    ]
-    await update.message.reply_text(
-        random.choice(responses),
+    await reply(
+        update,
+        random.choice(NAVIGATION_HINTS),
         reply_markup=get_main_keyboard()
     )
 
 async def handle_ai_chat(update: Update, message: str, user_id: int):
-    """Обработка сообщений в чате с ИИ"""
-    # Показываем "печатает..."
-    await update.message.chat.send_action(action="typing")
-    
-    # Проверяем кризисный уровень
+    """Обработка сообщений в чате с ИИ: проверка на кризис сразу, ответ ИИ -
+    после паузы, на все быстро присланные подряд сообщения вместе"""
+    # Проверяем кризисный уровень каждого фрагмента сразу
     crisis_level, crisis_desc = crisis_handler.detect_crisis_level(message)
     
     # Если кризис 2 или 3 уровня - показываем помощь
     if crisis_level >= 2:
+        # Журнал для супервизоров: только постановка в буфер, ответ не ждет записи
+        crisis_handler.log_crisis_interaction(user_id, message, crisis_level, update.effective_chat.id)
         crisis_response = crisis_handler.get_crisis_response_by_level(crisis_level, message)
-        await update.message.reply_text(crisis_response, parse_mode='Markdown')
-        
-        # Добавляем запись о кризисе
-        if user_id in user_data:
-            if "crisis_log" not in user_data[user_id]:
-                user_data[user_id]["crisis_log"] = []
-            user_data[user_id]["crisis_log"].append({
-                "message": message[:100],
-                "level": crisis_level,
-                "time": datetime.now().isoformat()
-            })
+        await reply(update, crisis_response, CRISIS, parse_mode='Markdown')
+    
+    if message_coalescer.enabled:
+        # Кризисное сообщение отправляет накопленную пачку без ожидания
+        message_coalescer.add(update.effective_chat.id, (update, message, crisis_level),
+                              urgent=crisis_level >= 2)
+    else:
+        await reply_ai_chat(update, message, user_id, crisis_level)
+
+async def flush_chat_batch(chat_id: int, fragments: list):
+    """Один ответ ИИ на пачку сообщений чата (отвечаем на последнее)"""
+    update = fragments[-1][0]
+    message = "\n".join(text for _, text, _ in fragments)
+    crisis_level = max(level for _, _, level in fragments)
+    await reply_ai_chat(update, message, update.effective_user.id, crisis_level)
+
+message_coalescer = MessageCoalescer(flush_chat_batch)
+
+async def reply_ai_chat(update: Update, message: str, user_id: int, crisis_level: int):
+    """Ответ ИИ на сообщение (или склеенную серию сообщений)"""
+    # Показываем "печатает..." (повтор, пока виден предыдущий, не отправляется)
+    outbound.typing(update.effective_chat.id, lambda: update.message.chat.send_action(action="typing"))
+    
+    data = await user_store.get_or_create(user_id, update.effective_user.first_name)
+    
+    # Лимиты на обращения к ИИ (кризисные сообщения не ограничиваются)
+    ai_allowed = True
+    if crisis_level < 2:
+        exceeded = chat_rate_limiter.check(user_id, update.effective_chat.id)
+        for scope in exceeded:
+            metrics.RATE_LIMITED.inc(scope)
+        ai_allowed = not exceeded
     
     # Получаем контекст пользователя
     user_context = {
         'user_id': user_id,
-        'name': user_data[user_id].get('name', 'Пользователь'),
-        'mood_history': user_data[user_id].get('mood_history', []),
-        'is_crisis': crisis_level >= 2
+        'name': data.get('name', 'Пользователь'),
+        'mood_stats': analyze_mood(get_mood_series(data)),
+        'chat_history': data.get('chat_history', []),
+        'is_crisis': crisis_level >= 2,
+        'ai_allowed': ai_allowed
     }
     
     # Получаем ответ от ИИ
     try:
-        ai_response = await ai_service.get_ai_response(message, user_context)
-        await update.message.reply_text(f"🤖 *Помощник:*\n\n{ai_response}", parse_mode='Markdown')
+        if AI_STREAMING:
+            ai_response = await stream_ai_reply(update, message, user_context)
+        else:
+            ai_response = await ai_service.get_ai_response(message, user_context)
+            await reply(update, f"🤖 *Помощник:*\n\n{ai_response}", parse_mode='Markdown')
         
-        # Сохраняем историю чата
-        if user_id in user_data:
-            user_data[user_id]["chat_history"].append({
-                "user": message,
-                "ai": ai_response,
-                "time": datetime.now().isoformat()
-            })
-            # Ограничиваем историю последними 10 сообщениями
-            if len(user_data[user_id]["chat_history"]) > 10:
-                user_data[user_id]["chat_history"] = user_data[user_id]["chat_history"][-10:]
+        # Сохраняем историю чата (перечитываем запись - пока ждали ИИ, она могла измениться)
+        data = await user_store.get_or_create(user_id, update.effective_user.first_name)
+        data["chat_history"].append({
+            "user": message,
+            "ai": ai_response,
+            "time": datetime.now().isoformat()
+        })
+        # Ограничиваем историю последними CHAT_HISTORY_LIMIT сообщениями
+        if len(data["chat_history"]) > CHAT_HISTORY_LIMIT:
+            data["chat_history"] = data["chat_history"][-CHAT_HISTORY_LIMIT:]
+        await user_store.save(user_id, data, ("chat_history",))
                 
     except Exception as e:
-        logger.error(f"Error in AI chat: {e}")
-        await update.message.reply_text(
+        logger.error("Error in AI chat: %s", e)
+        await reply(
+            update,
             "😔 Извини, произошла ошибка при обработке запроса.\n"
             "Попробуй переформулировать вопрос или нажми '🔄 Новый вопрос'.",
             reply_markup=get_chat_mode_keyboard()
         )
 
+async def stream_ai_reply(update: Update, message: str, user_context: dict) -> str:
+    """Отправляет ответ ИИ по мере генерации: первое сообщение - с первыми токенами,
+    затем редактирования не чаще STREAM_EDIT_INTERVAL секунд"""
+    started = time.monotonic()
+    sent = None
+    text = ""
+    shown = ""
+    last_edit = 0.0
+    
+    async for piece in ai_service.get_ai_response_stream(message, user_context):
+        text += piece
+        now = time.monotonic()
+        
+        if sent is None:
+            # Промежуточные версии - без Markdown: незакрытая разметка ломает отправку
+            sent = await reply(update, f"🤖 Помощник:\n\n{text}")
+            shown, last_edit = text, now
+            logger.info("⚡ First AI reply sent in %.0f ms", (now - started) * 1000,
+                        extra={"event": "stream_first_reply"})
+        elif now - last_edit >= STREAM_EDIT_INTERVAL and len(text) - len(shown) >= STREAM_MIN_CHARS:
+            try:
+                # Промежуточная версия, не отправленная вовремя, уже не нужна
+                await outbound.send(update.effective_chat.id,
+                                    lambda body=f"🤖 Помощник:\n\n{text}": sent.edit_text(body),
+                                    ttl=STREAM_EDIT_INTERVAL, idempotent=True)
+                shown, last_edit = text, now
+            except BadRequest as e:
+                logger.warning("Stream edit skipped: %s", e)
+    
+    if sent is None:
+        return text
+    
+    # Финальная версия с разметкой (если разметка некорректна - без нее)
+    chat_id = update.effective_chat.id
+    try:
+        await outbound.send(chat_id, lambda: sent.edit_text(f"🤖 *Помощник:*\n\n{text}", parse_mode='Markdown'),
+                            idempotent=True)
+    except BadRequest:
+        if text != shown:
+            await outbound.send(chat_id, lambda: sent.edit_text(f"🤖 Помощник:\n\n{text}"), idempotent=True)
+    return text
+
 async def save_mood(update: Update, mood_score: int):
     """Сохранение настроения"""
-    user_id = update.effective_user.id
-    user_data[user_id]["mood_history"].append(mood_score)
-    user_data[user_id]["in_chat_mode"] = False
+    user = update.effective_user
+    data = await user_store.get_or_create(user.id, user.first_name)
+    get_mood_series(data).add(mood_score)
+    data["in_chat_mode"] = False
+    mode_cache.set(user.id, False)
+    await user_store.save(user.id, data, ("mood_history", "in_chat_mode"))
     
     emoji = MOOD_EMOJIS.get(mood_score, "")
     
@@ -427,49 +734,287 @@ async def save_mood(update: Update, mood_score: int):
     elif mood_score >= 8:
         response += "\n\nОтлично! Рад, что у тебя хороший день! ✨"
     
-    await update.message.reply_text(response, reply_markup=get_main_keyboard())
+    await reply(update, response, reply_markup=get_main_keyboard())
 
 # ========== WEBHOOK ENDPOINTS ==========
+# Показатели процесса по разделам. В режиме SHARD_WORKERS обработчики, ИИ, кеш
+# и отправка работают в процессах пула - эндпоинты отдают их показатели по процессам
+LOCAL_STATS = {
+    "outbound": lambda: outbound.stats(),
+    "audit": lambda: crisis_audit.stats(),
+    "cache": lambda: ai_service.cache.stats(),
+    "circuit": lambda: ai_service.stats(),
+    "limits": lambda: {**chat_rate_limiter.stats(), "in_flight": ai_service.in_flight.stats()},
+    "coalescer": lambda: {"enabled": message_coalescer.enabled, **message_coalescer.stats()},
+    "router": lambda: {"routes": len(router), "mode_cache": mode_cache.stats()},
+    "chart": lambda: chart_renderer.stats(),
+}
+
+async def section_stats(section: str) -> dict:
+    """Показатели раздела: этого процесса или {"shards": {номер: показатели}} процессов пула"""
+    if not shard_pool:
+        return LOCAL_STATS[section]()
+    shards = await shard_pool.collect_stats()
+    return {"shards": {index: stats.get(section) for index, stats in shards.items()}}
+
 @app.get("/")
 async def root():
     status = "MindMate Bot v2.0 is running! 🚀"
     if bot_app:
-        status += f" (Active users: {len(user_data)})"
-    return {"status": status, "features": ["AI Chat", "Crisis Help", "Mood Tracking"]}
+        status += f" (Active users: {await user_store.count()})"
+    result = {"status": status, "features": ["AI Chat", "Crisis Help", "Mood Tracking"]}
+    if update_queue:
+        result["queue"] = update_queue.stats()
+    return result
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    """Проверка готовности: 503, пока бот не инициализирован"""
+    ready = bot_ready or not bot_app
+    return JSONResponse(
+        {"status": "healthy" if ready else "starting", "ready": ready,
+         "timestamp": datetime.now().isoformat()},
+        status_code=200 if ready else 503
+    )
+
+@app.get("/queue")
+async def queue_stats():
+    """Показатели очереди входящих обновлений (в режиме SHARD_WORKERS - очереди процессов пула)"""
+    if shard_pool:
+        return {"enabled": True, **await section_stats("queue")}
+    if not update_queue:
+        return {"enabled": False}
+    return {"enabled": True, **update_queue.stats()}
+
+@app.get("/shards")
+async def shards_stats():
+    """Процессы-обработчики: распределение чатов, очереди, перезапуски"""
+    if not shard_pool:
+        return {"enabled": False}
+    return {"enabled": True, **shard_pool.stats()}
+
+@app.get("/reminders")
+async def reminders_stats():
+    """Напоминания: число в расписании, отправки, задержка относительно срока"""
+    if not reminder_scheduler:
+        return {"enabled": False}
+    return reminder_scheduler.stats()
+
+@app.get("/outbound")
+async def outbound_stats():
+    """Очередь исходящих сообщений: отправки, повторы, ожидание лимитов Telegram"""
+    return await section_stats("outbound")
+
+@app.get("/audit")
+async def audit_stats():
+    """Журнал кризисных событий: записано, в буфере, оповещения"""
+    return await section_stats("audit")
+
+@app.get("/crisis/events")
+async def crisis_events(user_id: int = None, level: int = None, min_level: int = None,
+                        since: str = None, until: str = None, limit: int = 100,
+                        x_audit_token: str = Header(default="")):
+    """Кризисные события для супервизоров (заголовок X-Audit-Token = CRISIS_AUDIT_TOKEN).
+    since/until - секунды Unix или дата ISO 8601"""
+    if not CRISIS_AUDIT_TOKEN or not hmac.compare_digest(x_audit_token, CRISIS_AUDIT_TOKEN):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    try:
+        since_ts, until_ts = parse_timestamp(since), parse_timestamp(until)
+    except ValueError:
+        return JSONResponse({"error": "since/until: Unix seconds or ISO 8601 expected"}, status_code=400)
+    events = await crisis_audit.query(user_id, level, min_level, since_ts, until_ts, min(limit, 1000))
+    return {"count": len(events), "events": events}
+
+def parse_timestamp(value):
+    """Секунды Unix из числа или даты ISO 8601 (без пояса - местное время)"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        return (parsed if parsed.tzinfo else parsed.astimezone()).timestamp()
+
+@app.get("/cache")
+async def cache_stats():
+    """Показатели кеша ответов ИИ (попадания = сэкономленные вызовы DeepSeek)"""
+    return await section_stats("cache")
+
+@app.get("/circuit")
+async def circuit_stats():
+    """Состояние предохранителя DeepSeek: ошибки, перцентили задержки, запасные ответы"""
+    return await section_stats("circuit")
+
+@app.get("/limits")
+async def limits_stats():
+    """Лимиты обращений к ИИ: по пользователям, по чатам и одновременные запросы к DeepSeek"""
+    return await section_stats("limits")
+
+@app.get("/coalescer")
+async def coalescer_stats():
+    """Склейка сообщений чата: фрагменты, пачки, сэкономленные вызовы ИИ и время ожидания"""
+    return await section_stats("coalescer")
+
+@app.get("/router")
+async def router_stats():
+    """Таблица маршрутов кнопок и кеш режимов пользователей"""
+    return await section_stats("router")
+
+@app.get("/chart")
+async def chart_stats():
+    """Показатели рендера графиков настроения"""
+    return await section_stats("chart")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus (метрики процессов пула - с меткой shard)"""
+    metrics.USERS_TOTAL.set(await user_store.count())
+    metrics.active_users.update_gauges()
+    shards = None
+    if shard_pool:
+        shards = {index: stats["metrics"] for index, stats in (await shard_pool.collect_stats()).items()
+                  if "metrics" in stats}
+    return metrics.registry.render(shards)
 
 @app.post("/webhook")
-async def webhook(request: dict):
-    """Endpoint для вебхука от Telegram"""
+async def webhook(request: Request):
+    """Endpoint для вебхука от Telegram (тело читается как есть, без разбора FastAPI)"""
+    started = time.perf_counter()
+    result = await process_webhook(await request.body())
+    metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - started, result["status"])
+    return result
+
+async def process_webhook(body) -> dict:
+    """Разбор обновления: обработка сразу или постановка в очередь.
+
+    body - тело запроса (bytes) или уже разобранный JSON (dict)
+    """
     if not bot_app:
         return {"status": "error", "message": "Bot not initialized"}
     
+    # Только тип, chat_id и текст; обновления без обработчика дальше не идут
     try:
-        # Инициализация обработчиков при первом запросе
-        if not bot_app.handlers:
-            bot_app.add_handler(CommandHandler("start", start))
-            bot_app.add_handler(CommandHandler("help", help_command))
-            bot_app.add_handler(CommandHandler("mood", mood_command))
-            bot_app.add_handler(CommandHandler("relax", relax_command))
-            bot_app.add_handler(CommandHandler("affirmation", affirmation_command))
-            bot_app.add_handler(CommandHandler("stats", stats_command))
-            bot_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-            await bot_app.initialize()
+        head = peek_update(body)
+    except ValueError:
+        return {"status": "error", "message": "Invalid JSON"}
+    if head is None or not head.handled:
+        metrics.WEBHOOK_IGNORED.inc(head.kind if head else "invalid")
+        return {"status": "ignored"}
+    
+    # Обычно бот готов еще при запуске; здесь - повтор, если тогда не удалось
+    if not bot_ready and not await ensure_bot_ready():
+        return {"status": "error", "message": "Bot not ready"}
+    
+    try:
+        if shard_pool:
+            # Полный разбор - в процессе чата
+            if not shard_pool.submit(head.chat_id, head.payload):
+                return {"status": "dropped"}
+            return {"status": "queued"}
         
-        update = Update.de_json(request, bot_app.bot)
-        await bot_app.process_update(update)
+        if update_queue:
+            # Ставим в очередь как есть - Update соберет воркер
+            if not update_queue.submit(head.chat_id, head.payload):
+                # Возвращаем 200, чтобы Telegram не повторял доставку при перегрузке
+                return {"status": "dropped"}
+            return {"status": "queued"}
+        
+        await process_raw_update(head.payload)
         return {"status": "ok"}
     except Exception as e:
-        logger.error(f"Webhook error: {e}")
+        logger.error("Webhook error: %s", e)
         return {"status": "error", "message": str(e)}
 
+def register_handlers(application: Application):
+    """Регистрирует обработчики команд и сообщений"""
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("mood", mood_command))
+    application.add_handler(CommandHandler("relax", relax_command))
+    application.add_handler(CommandHandler("affirmation", affirmation_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("remind", remind_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+
+async def ensure_bot_ready() -> bool:
+    """Регистрирует обработчики и инициализирует бота ровно один раз,
+    даже при одновременных вызовах. True - бот готов принимать обновления"""
+    global bot_ready
+    if bot_ready or not bot_app:
+        return bot_ready
+    async with bot_init_lock:
+        if bot_ready:
+            return True
+        started = time.perf_counter()
+        try:
+            if not bot_app.handlers:
+                register_handlers(bot_app)
+            await bot_app.initialize()
+        except Exception as e:
+            logger.error("❌ Bot initialization error: %s", e)
+            return False
+        bot_ready = True
+        logger.info("✅ Bot ready in %.2fs", time.perf_counter() - started)
+        # Рассылке нужен инициализированный бот
+        if reminder_scheduler:
+            reminder_scheduler.start()
+    return True
+
+async def start_services():
+    """Хранилище, фоновые задачи и очередь обновлений"""
+    await user_store.start()
+    metrics.loop_lag_monitor.start()
+    
+    if update_queue:
+        update_queue.start()
+    outbound.start()
+    crisis_audit.start()
+
+async def stop_services():
+    """Освобождение ресурсов (в обратном порядке)"""
+    if reminder_scheduler:
+        await reminder_scheduler.stop()
+    if update_queue:
+        await update_queue.stop()
+    await message_coalescer.stop()
+    await outbound.stop()
+    await crisis_audit.stop()
+    if bot_ready:
+        await bot_app.shutdown()
+    await ai_service.close()
+    await user_store.close()
+    chart_renderer.close()
+    await metrics.loop_lag_monitor.stop()
+    stop_logging()
+
+# Процесс пула (см. shard_pool): свои сервисы и бот, вебхук не трогаем
+async def start_shard():
+    await start_services()
+    if not await ensure_bot_ready():
+        raise RuntimeError("Bot initialization failed")
+
+async def process_shard_update(request: dict):
+    await process_raw_update(request)
+
+def shard_stats() -> dict:
+    """Показатели процесса пула для приемника (ShardPool.collect_stats)"""
+    metrics.active_users.update_gauges()
+    stats = {section: collect() for section, collect in LOCAL_STATS.items()}
+    stats["metrics"] = metrics.registry.snapshot()
+    return stats
+
+async def stop_shard():
+    await stop_services()
+
 @app.on_event("startup")
 async def on_startup():
-    """Настройка при запуске"""
-    if bot_app:
+    """Настройка при запуске: до первого вебхука бот уже готов"""
+    await start_services()
+    if shard_pool:
+        shard_pool.start()
+    
+    # Вебхук ставим после инициализации, чтобы Telegram не слал обновления раньше
+    if bot_app and await ensure_bot_ready():
         try:
             # Получаем URL из окружения (Railway автоматически устанавливает)
             webhook_url = os.getenv('RAILWAY_STATIC_URL', '') + "/webhook"
@@ -481,14 +1026,23 @@ async def on_startup():
             # Устанавливаем вебхук
             if webhook_url and webhook_url.startswith("http"):
                 await bot_app.bot.set_webhook(webhook_url)
-                logger.info(f"✅ Webhook установлен: {webhook_url}")
+                logger.info("✅ Webhook установлен: %s", webhook_url)
             else:
                 logger.warning("⚠️ Webhook URL not found or invalid")
                 
         except Exception as e:
-            logger.error(f"❌ Webhook setup error: {e}")
+            logger.error("❌ Webhook setup error: %s", e)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Освобождение ресурсов при остановке"""
+    if shard_pool:
+        await shard_pool.stop()
+    await stop_services()
 
 # Для локального запуска
 if __name__ == "__main__":
+    import uvicorn
+    
     port = int(os.getenv("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
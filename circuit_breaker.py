@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_WINDOW_SECONDS = float(os.getenv('CIRCUIT_WINDOW_SECONDS', 60))
+CIRCUIT_MIN_REQUESTS = int(os.getenv('CIRCUIT_MIN_REQUESTS', 10))
+CIRCUIT_ERROR_RATE = float(os.getenv('CIRCUIT_ERROR_RATE', 0.5))
+CIRCUIT_LATENCY_P95 = float(os.getenv('CIRCUIT_LATENCY_P95', 10))
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', 30))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv('CIRCUIT_HALF_OPEN_PROBES', 1))
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class CircuitBreaker:
+    """Предохранитель для внешнего API: closed -> open -> half-open -> closed.
+
+    В скользящем окне хранятся результаты и задержки последних вызовов.
+    Если доля ошибок или p95 задержки превышает порог, цепь размыкается и
+    вызовы сразу уходят в запасной путь. Через open_seconds пропускаются
+    пробные вызовы: успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str = "deepseek",
+                 window_seconds: float = CIRCUIT_WINDOW_SECONDS,
+                 min_requests: int = CIRCUIT_MIN_REQUESTS,
+                 error_rate_threshold: float = CIRCUIT_ERROR_RATE,
+                 latency_threshold: float = CIRCUIT_LATENCY_P95,
+                 open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 half_open_probes: int = CIRCUIT_HALF_OPEN_PROBES,
+                 max_samples: int = 1000):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_rate_threshold = error_rate_threshold
+        self.latency_threshold = latency_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        # (время, успех, задержка)
+        self._window: Deque[Tuple[float, bool, float]] = deque(maxlen=max_samples)
+
+        self.rejected = 0
+        self.opened_count = 0
+
+    def allow_request(self) -> bool:
+        """Можно ли сейчас вызывать API"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self._set_state(self.HALF_OPEN)
+            self._probes_in_flight = 0
+
+        if self.state == self.HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_probes:
+                self.rejected += 1
+                return False
+            self._probes_in_flight += 1
+
+        return True
+
+    def record_success(self, latency: float):
+        self._record(True, latency)
+
+    def record_failure(self, latency: float):
+        self._record(False, latency)
+
+    def record_cancelled(self):
+        """Вызов отменен до результата (хедж, прерванный поток): ничего не узнали,
+        но пробный слот освобождается - иначе цепь навсегда осталась бы полуоткрытой"""
+        if self.state == self.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def _record(self, ok: bool, latency: float):
+        now = time.monotonic()
+
+        if self.state == self.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if ok and latency < self.latency_threshold:
+                self._window.clear()
+                self._set_state(self.CLOSED)
+            else:
+                self._open(now)
+            return
+
+        self._window.append((now, ok, latency))
+        if self.state != self.CLOSED:
+            return
+
+        self._prune(now)
+        if len(self._window) < self.min_requests:
+            return
+        error_rate, p95 = self._error_rate_and_p95()
+        if error_rate >= self.error_rate_threshold or p95 >= self.latency_threshold:
+            logger.warning("🔌 Circuit '%s' opened: error rate %.0f%%, p95 %.1fs", self.name, error_rate * 100, p95)
+            self._open(now)
+
+    def _open(self, now: float):
+        self._opened_at = now
+        self.opened_count += 1
+        self._set_state(self.OPEN)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.info("🔌 Circuit '%s': %s -> %s", self.name, self.state, state)
+            self.state = state
+
+    def _prune(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._window and self._window[0][0] < cutoff:
+            self._window.popleft()
+
+    def _error_rate_and_p95(self) -> Tuple[float, float]:
+        if not self._window:
+            return 0.0, 0.0
+        errors = sum(1 for _, ok, _ in self._window if not ok)
+        latencies = sorted(latency for _, _, latency in self._window)
+        return errors / len(self._window), percentile(latencies, 0.95)
+
+    def stats(self) -> Dict:
+        self._prune(time.monotonic())
+        error_rate, p95 = self._error_rate_and_p95()
+        latencies = sorted(latency for _, _, latency in self._window)
+        return {
+            "state": self.state,
+            "window_requests": len(self._window),
+            "error_rate": round(error_rate, 3),
+            "latency_p50": round(percentile(latencies, 0.5), 3),
+            "latency_p95": round(p95, 3),
+            "latency_p99": round(percentile(latencies, 0.99), 3),
+            "rejected": self.rejected,
+            "opened_count": self.opened_count
+        }
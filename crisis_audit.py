@@ -0,0 +1,360 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import metrics
+from log_setup import scrub_pii
+
+logger = logging.getLogger(__name__)
+
+CRISIS_AUDIT_ENABLED = os.getenv('CRISIS_AUDIT_ENABLED', '1').lower() in ('1', 'true', 'yes')
+# Каталог сегментов журнала: один файл SQLite на календарный месяц (UTC)
+CRISIS_AUDIT_DIR = os.getenv('CRISIS_AUDIT_DIR', 'crisis_audit')
+# Сколько месяцев хранить (0 - все); старые сегменты удаляются при смене месяца
+CRISIS_AUDIT_KEEP_MONTHS = int(os.getenv('CRISIS_AUDIT_KEEP_MONTHS', 0))
+CRISIS_AUDIT_FLUSH_INTERVAL = float(os.getenv('CRISIS_AUDIT_FLUSH_INTERVAL', 1.0))
+CRISIS_AUDIT_BATCH_SIZE = int(os.getenv('CRISIS_AUDIT_BATCH_SIZE', 200))
+# Сколько событий может ждать записи; сверх этого новые теряются (и это видно в метриках)
+CRISIS_AUDIT_MAX_PENDING = int(os.getenv('CRISIS_AUDIT_MAX_PENDING', 100000))
+CRISIS_AUDIT_TEXT_LIMIT = int(os.getenv('CRISIS_AUDIT_TEXT_LIMIT', 500))
+# Доступ к событиям через /crisis/events (без токена эндпоинт выключен)
+CRISIS_AUDIT_TOKEN = os.getenv('CRISIS_AUDIT_TOKEN', '')
+# Куда отправлять оповещения об острых кризисах (уровень 3): POST с JSON события
+CRISIS_ALERT_URL = os.getenv('CRISIS_ALERT_URL', '')
+CRISIS_ALERT_TIMEOUT = float(os.getenv('CRISIS_ALERT_TIMEOUT', 5.0))
+
+SEGMENT_PREFIX = "crisis-"
+SEGMENT_SUFFIX = ".sqlite3"
+COLUMNS = ("id", "ts", "user_id", "chat_id", "level", "source", "text")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER,
+    level INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_user_ts ON events (user_id, ts);
+CREATE INDEX IF NOT EXISTS events_level_ts ON events (level, ts);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE TRIGGER IF NOT EXISTS events_no_update BEFORE UPDATE ON events
+    BEGIN SELECT RAISE(ABORT, 'crisis audit log is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS events_no_delete BEFORE DELETE ON events
+    BEGIN SELECT RAISE(ABORT, 'crisis audit log is append-only'); END;
+"""
+
+
+def segment_name(ts: float) -> str:
+    """Имя файла сегмента, в который попадает момент ts"""
+    return f"{SEGMENT_PREFIX}{datetime.fromtimestamp(ts, timezone.utc):%Y-%m}{SEGMENT_SUFFIX}"
+
+
+def _month_index(name: str) -> int:
+    year, month = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)].split("-")
+    return int(year) * 12 + int(month) - 1
+
+
+class CrisisAuditLog:
+    """Журнал кризисных событий для супервизоров.
+
+    record() только кладет событие в буфер - ответ пользователю его не ждет.
+    Фоновая задача пишет буфер пачками: одна транзакция (и один fsync)
+    на пачку, в сегмент текущего месяца. Таблица только дополняется:
+    UPDATE и DELETE запрещены триггерами, старые данные уходят целыми
+    сегментами (keep_months). Поиск - query() по пользователю, уровню и
+    периоду, по индексам и только в сегментах нужных месяцев.
+
+    События уровня 3 дополнительно отправляются на alert_url (отдельной
+    задачей, чтобы медленный получатель не задерживал запись).
+    """
+
+    def __init__(self, directory: str = CRISIS_AUDIT_DIR, keep_months: int = CRISIS_AUDIT_KEEP_MONTHS,
+                 flush_interval: float = CRISIS_AUDIT_FLUSH_INTERVAL, batch_size: int = CRISIS_AUDIT_BATCH_SIZE,
+                 max_pending: int = CRISIS_AUDIT_MAX_PENDING, alert_url: str = CRISIS_ALERT_URL,
+                 enabled: bool = CRISIS_AUDIT_ENABLED):
+        self.directory = directory
+        self.keep_months = keep_months
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.max_pending = max(1, max_pending)
+        self.alert_url = alert_url
+        self.enabled = enabled
+
+        self._pending: List[Dict] = []
+        self._alerts: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        # Пачки пишутся по очереди, в порядке записи событий
+        self._flush_lock = asyncio.Lock()
+        self._client = None
+        # Соединение с сегментом текущего месяца (только в потоке записи)
+        self._conn = None
+        self._segment: Optional[str] = None
+        self._lock = threading.Lock()
+
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.alerts_sent = 0
+        self.alerts_failed = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Запускает фоновую запись (вызывается из работающего event loop)"""
+        if self._tasks or not self.enabled:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._flush_loop())]
+        if self.alert_url:
+            self._alerts = asyncio.Queue()
+            self._tasks.append(asyncio.create_task(self._alert_loop()))
+        logger.info("🗂 Crisis audit log: %s", self.directory, extra={"alerts": bool(self.alert_url)})
+
+    async def stop(self):
+        """Дописывает буфер, отправляет оставшиеся оповещения и закрывает сегмент"""
+        if self._alerts is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._alerts.join(), CRISIS_ALERT_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.error("🗂 %s crisis alerts not sent on shutdown", self._alerts.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = self._segment = None
+
+    def record(self, user_id: int, level: int, text: str, chat_id: Optional[int] = None,
+               source: str = "message") -> Optional[Dict]:
+        """Фиксирует кризисное событие без ожидания записи на диск"""
+        if not self.enabled:
+            return None
+        event = {"ts": time.time(), "user_id": user_id, "chat_id": chat_id, "level": level,
+                 "source": source, "text": text or ""}
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            metrics.CRISIS_AUDIT_EVENTS.inc("dropped")
+            logger.error("🗂 Crisis audit buffer full, event dropped",
+                         extra={"event": "crisis_audit_drop", "always": True, "user_id": user_id})
+            return None
+        self.recorded += 1
+        self._pending.append(event)
+        if self._wakeup is None:
+            return event
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        if level >= 3 and self._alerts is not None:
+            self._alerts.put_nowait(event)
+        return event
+
+    async def flush(self):
+        """Записывает накопленные события одной транзакцией"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                failed = await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                logger.error("🗂 Crisis audit write error: %s", e)
+                failed = batch
+            if failed:
+                self.failed_batches += 1
+                # События не теряем: вернутся в буфер и запишутся следующей пачкой.
+                # Только незаписанные - записанные сегменты не должны получить дубли
+                self._pending[:0] = failed[-self.max_pending:]
+            written = len(batch) - len(failed)
+            if written:
+                self.written += written
+                metrics.CRISIS_AUDIT_EVENTS.inc("written", amount=written)
+
+    async def query(self, user_id: Optional[int] = None, level: Optional[int] = None,
+                    min_level: Optional[int] = None, since: Optional[float] = None,
+                    until: Optional[float] = None, limit: int = 100) -> List[Dict]:
+        """События по пользователю, уровню (точному или не ниже min_level)
+        и периоду [since, until) в секундах Unix, новые первыми"""
+        await self.flush()
+        return await asyncio.to_thread(self._query, user_id, level, min_level, since, until, max(1, limit))
+
+    # ---------- запись (в потоке) ----------
+    def _write_batch(self, batch: List[Dict]) -> List[Dict]:
+        """Записывает пачку, по транзакции на сегмент; возвращает события,
+        чьи сегменты записать не удалось"""
+        # Пачка может пересечь границу месяца - каждое событие в свой сегмент
+        by_segment: Dict[str, List[Dict]] = {}
+        for event in batch:
+            by_segment.setdefault(segment_name(event["ts"]), []).append(event)
+        failed: List[Dict] = []
+        with self._lock:
+            # От старых к новым: текущим остается сегмент последнего месяца
+            for name, events in sorted(by_segment.items()):
+                rows = [(event["ts"], event["user_id"], event["chat_id"], event["level"], event["source"],
+                         scrub_pii(event["text"])[:CRISIS_AUDIT_TEXT_LIMIT]) for event in events]
+                try:
+                    conn = self._open_segment(name)
+                    conn.execute("BEGIN")
+                    try:
+                        conn.executemany(
+                            "INSERT INTO events (ts, user_id, chat_id, level, source, text) VALUES (?, ?, ?, ?, ?, ?)",
+                            rows
+                        )
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+                except Exception as e:
+                    logger.error("🗂 Crisis audit write error in %s: %s", name, e)
+                    failed.extend(events)
+        return failed
+
+    def _open_segment(self, name: str):
+        if name == self._segment:
+            return self._conn
+        import sqlite3  # только при первой записи - не замедляет запуск
+
+        os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.directory, name), check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # FULL: fsync на каждый COMMIT, то есть на пачку
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        if self._conn is not None:
+            self._conn.close()
+        rotated = self._segment is not None
+        self._conn, self._segment = conn, name
+        if rotated:
+            logger.info("🗂 Crisis audit rotated to %s", name)
+            self._prune(name)
+        return conn
+
+    def _prune(self, current: str):
+        if self.keep_months <= 0:
+            return
+        oldest = _month_index(current) - self.keep_months + 1
+        for name in self._segments():
+            if _month_index(name) < oldest:
+                for suffix in ("", "-wal", "-shm"):
+                    path = os.path.join(self.directory, name + suffix)
+                    if os.path.exists(path):
+                        os.remove(path)
+                logger.info("🗂 Crisis audit segment %s removed (retention %s months)", name, self.keep_months)
+
+    def _segments(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+    # ---------- поиск (в потоке) ----------
+    def _query(self, user_id, level, min_level, since, until, limit) -> List[Dict]:
+        import sqlite3
+
+        conditions, params = [], []
+        for clause, value in (("user_id = ?", user_id), ("level = ?", level), ("level >= ?", min_level),
+                              ("ts >= ?", since), ("ts < ?", until)):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT {', '.join(COLUMNS)} FROM events{where} ORDER BY ts DESC LIMIT ?"
+
+        first = _month_index(segment_name(since)) if since is not None else None
+        last = _month_index(segment_name(until)) if until is not None else None
+        result: List[Dict] = []
+        # Сегменты от новых к старым, пока не наберется limit
+        for name in reversed(self._segments()):
+            month = _month_index(name)
+            if (last is not None and month > last) or (first is not None and month < first):
+                continue
+            conn = sqlite3.connect(f"file:{os.path.join(self.directory, name)}?mode=ro", uri=True)
+            try:
+                rows = conn.execute(sql, (*params, limit - len(result))).fetchall()
+            finally:
+                conn.close()
+            result.extend(dict(zip(COLUMNS, row)) for row in rows)
+            if len(result) >= limit:
+                break
+        for event in result:
+            event["segment"] = segment_name(event["ts"])
+        return result
+
+    # ---------- фоновые задачи ----------
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def _alert_loop(self):
+        while True:
+            event = await self._alerts.get()
+            try:
+                await self._send_alert(event)
+            finally:
+                self._alerts.task_done()
+
+    async def _send_alert(self, event: Dict):
+        payload = {"event": "crisis", **event, "text": scrub_pii(event["text"])[:CRISIS_AUDIT_TEXT_LIMIT],
+                   "time": datetime.fromtimestamp(event["ts"], timezone.utc).isoformat()}
+        for attempt in range(2):
+            try:
+                response = await self._get_client().post(self.alert_url, json=payload)
+                response.raise_for_status()
+            except Exception as e:
+                if attempt == 0:
+                    await asyncio.sleep(1.0)
+                    continue
+                self.alerts_failed += 1
+                metrics.CRISIS_ALERTS.inc("failed")
+                logger.error("🚨 Crisis alert failed: %s", e,
+                             extra={"event": "crisis_alert_failed", "always": True, "user_id": event["user_id"]})
+                return
+            self.alerts_sent += 1
+            metrics.CRISIS_ALERTS.inc("sent")
+            return
+
+    def _get_client(self) -> Any:
+        if self._client is None:
+            import httpx  # нужен только при заданном CRISIS_ALERT_URL
+
+            self._client = httpx.AsyncClient(timeout=CRISIS_ALERT_TIMEOUT)
+        return self._client
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "segment": self._segment,
+            "segments": len(self._segments()),
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_batches": self.failed_batches,
+            "alerts": {"url_set": bool(self.alert_url), "sent": self.alerts_sent, "failed": self.alerts_failed,
+                       "queued": self._alerts.qsize() if self._alerts else 0}
+        }
+
+
+crisis_audit = CrisisAuditLog()
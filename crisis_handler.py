@@ -1,16 +1,107 @@
-import os
+import re
 import logging
 import random
-from typing import Tuple, Dict, List
-from datetime import datetime
+import time
+from typing import Tuple, Dict, List, Optional
+
+from crisis_audit import crisis_audit
+from keyword_matcher import KeywordMatch, PhraseIndex
+from log_setup import scrub_pii
+import metrics
 
 logger = logging.getLogger(__name__)
 
+# Ключевые слова кризисных состояний по уровням
+CRISIS_KEYWORDS = {
+    # Уровень 3: Острая угроза (самоповреждение)
+    3: [
+        'суицид', 'самоубийство', 'умру', 'покончить', 'покончу',
+        'повешусь', 'вешаться', 'выброшусь', 'выбрасываться',
+        'отравлюсь', 'отравиться', 'порежусь', 'резать',
+        'зарежусь', 'застрелюсь',
+        # Самоповреждение: глагол без "-ся" плюс "себя", "вены", "руки"
+        'порезать себя', 'порежу себя', 'резать себя', 'режу себя',
+        'порезать вены', 'перерезать вены', 'перережу вены', 'резать вены', 'режу вены',
+        'вскрыть вены', 'вскрою вены', 'вскрыла вены', 'вскрывать вены', 'порезать руки', 'режу руки'
+    ],
+    # Уровень 2: Серьезный кризис
+    2: [
+        'не хочу жить', 'не хочу больше жить', 'надоело жить',
+        'все бессмысленно', 'безнадежно', 'все кончено',
+        'больше не могу', 'не выдерживаю', 'сломаюсь',
+        'конец', 'все пропало'
+    ],
+    # Уровень 1: Эмоциональное напряжение
+    1: [
+        'хочу умереть', 'лучше бы умер', 'не вижу смысла',
+        'все плохо', 'все ужасно', 'нет сил',
+        'депрессия', 'тяжело', 'невыносимо',
+        'паника', 'сильная тревога', 'страх'
+    ]
+}
+
+CRISIS_LEVEL_DESCRIPTIONS = {
+    0: "Без кризиса",
+    1: "Эмоциональное напряжение",
+    2: "Серьезный кризис",
+    3: "Острая угроза"
+}
+
+# Словоформы, которые стеммер сводит к кризисным основам, но кризисом не являются
+CRISIS_EXCLUSIONS = ['режим', 'сломалась', 'сломался', 'сломалось', 'сломались']
+
+# Корни, кризисные вместе с производными словами: суицидальный, самоубийца
+CRISIS_ROOTS = {
+    3: ['суицид', 'самоубий']
+}
+
+# Слова, кризисные только в этой форме: "бесполезная кнопка" - не кризис
+CRISIS_EXACT = {
+    2: ['бесполезно']
+}
+
+# Индекс строится один раз при импорте и используется всеми детекторами
+crisis_index = PhraseIndex(
+    ((keyword, level) for level, keywords in CRISIS_KEYWORDS.items() for keyword in keywords),
+    exclude=CRISIS_EXCLUSIONS,
+    prefixes=((root, level) for level, roots in CRISIS_ROOTS.items() for root in roots),
+    exact=((word, level) for level, words in CRISIS_EXACT.items() for word in words)
+)
+
+def escape_markdown(text: str) -> str:
+    """Экранирует служебные символы parse_mode='Markdown' (_ * ` [) в подставляемых значениях"""
+    return re.sub(r'([_*`\[])', r'\\\1', text)
+
+
+QUICK_HELP_TEXT = """
+🚨 *Быстрая помощь:*
+
+📞 *Главные номера:*
+• 8-800-2000-122 - Телефон доверия
+• 112 - Экстренная помощь
+• 103 - Скорая помощь
+
+💬 *Чат-помощь:*
+• @psyhelpbot в Telegram
+• https://помощьрядом.рф
+
+*Не ждите, обращайтесь за помощью сразу!* 🤗
+"""
+
+
 class CrisisHandler:
     """Обработчик кризисных ситуаций"""
     
     def __init__(self):
         self.crisis_resources = self._load_resources()
+        # Ответы не зависят от сообщения: собираем их один раз для каждого уровня
+        # (для уровня 1 - по варианту на каждую технику самопомощи)
+        techniques = self.crisis_resources["self_help_techniques"]
+        self._responses: Dict[int, List[str]] = {
+            1: [self._render_response(1, technique) for technique in techniques],
+            2: [self._render_response(2)],
+            3: [self._render_response(3)]
+        }
         logger.info("🚨 Crisis Handler initialized")
     
     def _load_resources(self) -> Dict:
@@ -116,6 +207,21 @@ class CrisisHandler:
             }
         }
     
+    def scan(self, message: str) -> Tuple[int, List[KeywordMatch]]:
+        """
+        Находит все кризисные ключевые слова за один проход по сообщению
+        (с учетом словоформ, "ё", латинских двойников и разбивки слов)
+        
+        Returns:
+            Tuple[int, List[KeywordMatch]]: (максимальный уровень 0-3, совпадения с позициями)
+        """
+        if not message:
+            return 0, []
+        
+        matches = crisis_index.find_all(message)
+        level = max((match.value for match in matches), default=0)
+        return level, matches
+    
     def detect_crisis_level(self, message: str) -> Tuple[int, str]:
         """
         Определяет уровень кризиса по сообщению
@@ -126,47 +232,25 @@ class CrisisHandler:
         if not message:
             return 0, "Нет сообщения"
         
-        message_lower = message.lower()
-        
-        # Уровень 3: Острая угроза (самоповреждение)
-        acute_keywords = [
-            'суицид', 'самоубийство', 'умру', 'покончить', 'покончу',
-            'повешусь', 'вешаться', 'выброшусь', 'выбрасываться',
-            'отравлюсь', 'отравиться', 'порежусь', 'резать',
-            'зарежусь', 'застрелюсь'
-        ]
-        
-        for keyword in acute_keywords:
-            if keyword in message_lower:
-                logger.warning(f"🚨 Acute crisis detected: {message[:50]}...")
-                return 3, "Острая угроза"
-        
-        # Уровень 2: Серьезный кризис
-        crisis_keywords = [
-            'не хочу жить', 'не хочу больше жить', 'надоело жить',
-            'все бессмысленно', 'безнадежно', 'все кончено',
-            'больше не могу', 'не выдерживаю', 'сломаюсь',
-            'конец', 'все пропало'
-        ]
+        started = time.perf_counter()
+        level, matches = self.scan(message)
+        metrics.CRISIS_DETECT_SECONDS.observe(time.perf_counter() - started)
+        metrics.CRISIS_DETECTIONS.inc(str(level))
         
-        for keyword in crisis_keywords:
-            if keyword in message_lower:
-                logger.warning(f"⚠️ Serious crisis detected: {message[:50]}...")
-                return 2, "Серьезный кризис"
-        
-        # Уровень 1: Эмоциональное напряжение
-        tension_keywords = [
-            'хочу умереть', 'лучше бы умер', 'не вижу смысла',
-            'все плохо', 'все ужасно', 'нет сил',
-            'депрессия', 'тяжело', 'невыносимо',
-            'паника', 'сильная тревога', 'страх'
-        ]
-        
-        for keyword in tension_keywords:
-            if keyword in message_lower:
-                return 1, "Эмоциональное напряжение"
+        if level >= 2:
+            # Кризисные события пишутся всегда и целиком, но без контактов и номеров
+            logger.warning(
+                "🚨 Acute crisis detected" if level == 3 else "⚠️ Serious crisis detected",
+                extra={
+                    "event": "crisis_detected",
+                    "always": True,
+                    "crisis_level": level,
+                    "keywords": sorted({match.keyword for match in matches}),
+                    "text": scrub_pii(message)
+                }
+            )
         
-        return 0, "Без кризиса"
+        return level, CRISIS_LEVEL_DESCRIPTIONS[level]
     
     def get_crisis_response(self) -> str:
         """Основной ответ для кнопки 'Кризисная помощь'"""
@@ -177,11 +261,12 @@ class CrisisHandler:
         return self._generate_response(level, message)
     
     def _generate_response(self, level: int, message: str = "") -> str:
-        """Генерирует полный кризисный ответ"""
-        
-        if level == 0:
-            return ""
-        
+        """Полный кризисный ответ (готовый текст, собранный при запуске)"""
+        variants = self._responses.get(level)
+        return random.choice(variants) if variants else ""
+    
+    def _render_response(self, level: int, technique: Optional[Dict] = None) -> str:
+        """Собирает текст кризисного ответа с уже экранированной разметкой"""
         response_parts = []
         
         # Заголовок в зависимости от уровня
@@ -203,9 +288,9 @@ class CrisisHandler:
         # Телефоны экстренной помощи
         response_parts.append("📞 *Экстренные телефоны:*")
         for hotline in self.crisis_resources["hotlines"][:3]:  # Только первые 3
-            response_parts.append(f"• *{hotline['name']}*: `{hotline['number']}`")
+            response_parts.append(f"• *{escape_markdown(hotline['name'])}*: `{hotline['number']}`")
             if hotline['description']:
-                response_parts.append(f"  {hotline['description']}")
+                response_parts.append(f"  {escape_markdown(hotline['description'])}")
         response_parts.append("")
         
         # Что делать в кризисе
@@ -220,24 +305,23 @@ class CrisisHandler:
         # Онлайн-ресурсы
         response_parts.append("💬 *Онлайн-помощь:*")
         for resource in self.crisis_resources["online_resources"]:
-            response_parts.append(f"• *{resource['name']}*: {resource['url']}")
+            response_parts.append(f"• *{escape_markdown(resource['name'])}*: {escape_markdown(resource['url'])}")
             if resource['description']:
-                response_parts.append(f"  {resource['description']}")
+                response_parts.append(f"  {escape_markdown(resource['description'])}")
         response_parts.append("")
         
         # Телеграм ресурсы
         response_parts.append("📱 *Telegram-боты:*")
         for bot in self.crisis_resources["telegram_resources"]:
-            response_parts.append(f"• *{bot['name']}*: {bot['username']}")
+            response_parts.append(f"• *{escape_markdown(bot['name'])}*: {escape_markdown(bot['username'])}")
         response_parts.append("")
         
         # Техники самопомощи (только для уровня 1)
-        if level == 1:
+        if level == 1 and technique:
             response_parts.append("🧘 *Техники для снятия напряжения:*")
-            technique = random.choice(self.crisis_resources["self_help_techniques"])
-            response_parts.append(f"*{technique['name']}:*")
+            response_parts.append(f"*{escape_markdown(technique['name'])}:*")
             for i, step in enumerate(technique['steps'], 1):
-                response_parts.append(f"{i}. {step}")
+                response_parts.append(f"{i}. {escape_markdown(step)}")
             response_parts.append("")
         
         # Завершающее сообщение
@@ -252,37 +336,17 @@ class CrisisHandler:
     
     def get_quick_help(self) -> str:
         """Краткая справка по кризисной помощи"""
-        return """
-🚨 *Быстрая помощь:*
-
-📞 *Главные номера:*
-• 8-800-2000-122 - Телефон доверия
-• 112 - Экстренная помощь
-• 103 - Скорая помощь
-
-💬 *Чат-помощь:*
-• @psyhelpbot в Telegram
-• https://помощьрядом.рф
-
-*Не ждите, обращайтесь за помощью сразу!* 🤗
-"""
+        return QUICK_HELP_TEXT
     
-    def log_crisis_interaction(self, user_id: int, message: str, level: int):
-        """Логирует кризисное взаимодействие (для мониторинга)"""
-        log_entry = {
-            "user_id": user_id,
-            "message_preview": message[:100],
-            "crisis_level": level,
-            "timestamp": datetime.now().isoformat(),
-            "resources_provided": True
-        }
-        
-        logger.warning(f"🚨 Crisis logged: User {user_id}, Level {level}, Message: {message[:50]}...")
-        
-        # Здесь можно добавить сохранение в базу данных
-        # или отправку уведомления администратору
-        
-        return log_entry
+    def log_crisis_interaction(self, user_id: int, message: str, level: int,
+                               chat_id: Optional[int] = None, source: str = "message") -> Optional[Dict]:
+        """Записывает кризисное взаимодействие в журнал для супервизоров.
+
+        Только ставит событие в буфер crisis_audit (запись на диск, очистка
+        от контактов и оповещение об уровне 3 - в фоне), поэтому вызывается
+        прямо в обработчике, не задерживая кризисный ответ.
+        """
+        return crisis_audit.record(user_id, level, message, chat_id, source)
 
 # Создаем глобальный экземпляр обработчика
 crisis_handler = CrisisHandler()
@@ -0,0 +1,85 @@
+import os
+import math
+from typing import Dict, List, Optional, Tuple
+
+AI_HISTORY_TOKEN_BUDGET = int(os.getenv('AI_HISTORY_TOKEN_BUDGET', 1200))
+AI_SUMMARY_TOKEN_BUDGET = int(os.getenv('AI_SUMMARY_TOKEN_BUDGET', 150))
+
+# Служебные токены на каждое сообщение в запросе (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_SNIPPET_CHARS = 80
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая локальная оценка числа токенов без обращения к токенизатору.
+
+    Латиница и цифры - около 4 символов на токен, кириллица и прочие
+    символы - около 2.5. Оценка намеренно с запасом.
+    """
+    if not text:
+        return 0
+    chars = len(text)
+    # Для кириллицы UTF-8 дает 2 байта на символ: разница байтов и символов ~ число не-ASCII символов
+    non_ascii = min(chars, len(text.encode('utf-8')) - chars)
+    return math.ceil((chars - non_ascii) / 4 + non_ascii / 2.5)
+
+
+def message_tokens(message: Dict) -> int:
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _snippet(text: str) -> str:
+    text = ' '.join(text.split())
+    if len(text) <= SUMMARY_SNIPPET_CHARS:
+        return text
+    return text[:SUMMARY_SNIPPET_CHARS].rsplit(' ', 1)[0] + "…"
+
+
+def summarize_turns(turns: List[Dict], budget: int) -> Optional[str]:
+    """Краткая сводка вытесненных реплик: начала сообщений пользователя,
+    самые свежие в приоритете, в пределах budget токенов"""
+    if not turns or budget <= 0:
+        return None
+    header = "Ранее в разговоре пользователь писал:"
+    used = estimate_tokens(header) + MESSAGE_OVERHEAD_TOKENS
+    lines: List[str] = []
+    for turn in reversed(turns):
+        line = f"• {_snippet(turn.get('user', ''))}"
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return None
+    return "\n".join([header] + lines[::-1])
+
+
+def pack_history(history: List[Dict], budget: int = AI_HISTORY_TOKEN_BUDGET,
+                 summary_budget: int = AI_SUMMARY_TOKEN_BUDGET) -> Tuple[List[Dict], Optional[str]]:
+    """Упаковывает историю диалога в бюджет токенов.
+
+    Берет самые свежие пары "пользователь - помощник", пока они помещаются
+    в budget. Более старые реплики сворачиваются в короткую сводку
+    (не больше summary_budget токенов) или отбрасываются.
+
+    Returns:
+        (сообщения для API в хронологическом порядке, сводка или None)
+    """
+    packed: List[Dict] = []
+    used = 0
+    kept = 0
+    for turn in reversed(history or []):
+        pair = [
+            {"role": "user", "content": turn.get("user", "")},
+            {"role": "assistant", "content": turn.get("ai", "")}
+        ]
+        cost = sum(message_tokens(message) for message in pair)
+        if used + cost > budget:
+            break
+        packed[:0] = pair
+        used += cost
+        kept += 1
+
+    dropped = history[:len(history) - kept] if history else []
+    return packed, summarize_turns(dropped, summary_budget)
@@ -0,0 +1,176 @@
+from collections import deque
+from itertools import product
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+
+from text_normalizer import is_reflexive, normalize, stem, stem_variants, tokenize
+
+# Минимальная длина фразы (в буквах), которая ищется внутри слова, набранного по буквам
+SPELLED_MIN_LENGTH = 5
+
+
+class KeywordMatch(NamedTuple):
+    """Найденное ключевое слово и его позиция в тексте"""
+    keyword: Any
+    value: Any
+    start: int
+    end: int
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик для поиска множества шаблонов за один проход.
+
+    Шаблоны - любые последовательности хешируемых символов: строки
+    (поиск по буквам) или кортежи (например, поиск по токенам). Время поиска
+    линейно по длине текста плюс число совпадений и не зависит от размера
+    словаря, поэтому новые ключевые слова не замедляют проверку.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[Sequence[Hashable], Any]]):
+        self._goto: List[Dict[Hashable, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, Any, Any]]] = [[]]
+        self.size = 0
+
+        for pattern, value in patterns:
+            if not pattern:
+                continue
+            self._add(pattern, value)
+        self._build()
+
+    def _add(self, pattern: Sequence[Hashable], value: Any):
+        state = 0
+        for symbol in pattern:
+            next_state = self._goto[state].get(symbol)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][symbol] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append((len(pattern), pattern, value))
+        self.size += 1
+
+    def _build(self):
+        """Строит суффиксные ссылки обходом в ширину"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and symbol not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(symbol, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                # Совпадения по суффиксной ссылке тоже заканчиваются в этом состоянии
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def iter_matches(self, text: Sequence[Hashable]) -> Iterator[KeywordMatch]:
+        """Перечисляет все вхождения шаблонов (включая перекрывающиеся)"""
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        state = 0
+        for index, symbol in enumerate(text):
+            while state and symbol not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(symbol, 0)
+            if out[state]:
+                end = index + 1
+                for length, pattern, value in out[state]:
+                    yield KeywordMatch(pattern, value, end - length, end)
+
+    def find_all(self, text: Sequence[Hashable]) -> List[KeywordMatch]:
+        """Список всех вхождений в порядке их окончания в тексте"""
+        return list(self.iter_matches(text))
+
+
+class PhraseIndex:
+    """Морфологический индекс ключевых фраз.
+
+    При построении каждая фраза нормализуется, разбивается на слова и
+    приводится к основам, после чего компилируется в автомат Ахо-Корасик над
+    последовательностями основ. Поиск выполняет только нормализацию и
+    стемминг сообщения и один проход автомата - линейно по длине сообщения.
+
+    Дополнительно:
+    - варианты с чередованием согласных (повешусь -> повеситься) совпадают
+      только с возвратными формами: "повесить картину" - не кризис;
+    - prefixes - корни, которые ищутся в начале слова вместе с производными
+      ("суицид" -> "суицидальные");
+    - exact - фразы, которые совпадают только в указанной форме, без
+      стемминга: "бесполезно" - кризис, "бесполезная кнопка" - нет;
+    - слова, набранные по буквам через пробел ("н е х о ч у ж и т ь"),
+      склеиваются в одно и проверяются по буквам на склеенные фразы.
+
+    Позиции совпадений указываются в нормализованном тексте.
+    """
+
+    def __init__(self, phrases: Iterable[Tuple[str, Any]], exclude: Iterable[str] = (),
+                 prefixes: Iterable[Tuple[str, Any]] = (), exact: Iterable[Tuple[str, Any]] = ()):
+        # Словоформы, которые стеммер ошибочно сводит к ключевой основе ("режим" -> "реж")
+        self.exclude = frozenset(normalize(word) for word in exclude)
+        self.prefixes = tuple((normalize(prefix), value) for prefix, value in prefixes)
+        self._prefix_starts = tuple(prefix for prefix, _ in self.prefixes)
+
+        patterns = {}
+        spelled = {}
+        for phrase, value in phrases:
+            words = [word for word, _, _ in tokenize(normalize(phrase))]
+            if not words:
+                continue
+            options = []
+            for word in words:
+                word_stem = stem(word)
+                # (основа, нужна ли возвратная форма в сообщении)
+                variants = [(word_stem, False)]
+                if is_reflexive(word):
+                    variants += [(variant, True) for variant in stem_variants(word_stem)[1:]]
+                options.append(variants)
+            for combination in product(*options):
+                variant = tuple(word_stem for word_stem, _ in combination)
+                reflexive = tuple(i for i, (_, needed) in enumerate(combination) if needed)
+                patterns.setdefault((variant, phrase), (value, reflexive))
+            # Для набора по буквам: слова целиком, последнее - основой (любое окончание).
+            # Короткие ("рез") нашлись бы внутри случайных слов; их ловит обычный поиск
+            key = ''.join(words[:-1]) + stem(words[-1])
+            if len(key) >= SPELLED_MIN_LENGTH:
+                spelled[key] = (phrase, value)
+
+        self._matcher = AhoCorasick(
+            (variant, (phrase, value, reflexive)) for (variant, phrase), (value, reflexive) in patterns.items()
+        )
+        self._spelled = AhoCorasick(spelled.items())
+        self._exact = AhoCorasick(
+            (tuple(word for word, _, _ in tokenize(normalize(phrase))), (phrase, value)) for phrase, value in exact
+        )
+        self.size = self._matcher.size + len(self.prefixes) + self._exact.size
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        """Все ключевые фразы в тексте с позициями в нормализованном тексте"""
+        tokens = tokenize(normalize(text))
+        if not tokens:
+            return []
+        stems = [None if word in self.exclude else stem(word) for word, _, _ in tokens]
+        matches = []
+        for match in self._matcher.iter_matches(stems):
+            phrase, value, reflexive = match.value
+            if any(not is_reflexive(tokens[match.start + i][0]) for i in reflexive):
+                continue
+            matches.append(KeywordMatch(phrase, value, tokens[match.start][1], tokens[match.end - 1][2]))
+        for match in self._exact.iter_matches([word for word, _, _ in tokens]):
+            phrase, value = match.value
+            matches.append(KeywordMatch(phrase, value, tokens[match.start][1], tokens[match.end - 1][2]))
+
+        for (word, start, end), word_stem in zip(tokens, stems):
+            if word_stem is None:
+                continue
+            if self._prefix_starts and word.startswith(self._prefix_starts):
+                matches.extend(KeywordMatch(prefix, value, start, end)
+                               for prefix, value in self.prefixes if word.startswith(prefix))
+            if end - start > len(word):
+                # Слово склеено из букв через пробел - ищем фразы внутри по буквам
+                found = {match.value for match in self._spelled.iter_matches(word)}
+                matches.extend(KeywordMatch(phrase, value, start, end) for phrase, value in found)
+        return matches
@@ -0,0 +1,92 @@
+import os
+import json
+import random
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from keyword_matcher import AhoCorasick
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_BASE_PATH = os.getenv(
+    'KNOWLEDGE_BASE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge_base.json')
+)
+
+
+@lru_cache(maxsize=4096)
+def personalize(response: str, name: str) -> str:
+    """Добавляет обращение по имени (варианты создаются по требованию и кешируются)"""
+    return response.replace("тебе", f"{name}, тебе")
+
+
+class KnowledgeBase:
+    """База запасных ответов с индексом "основа слова -> тема".
+
+    Загружается из JSON один раз. Все основы тем компилируются в один автомат,
+    поэтому поиск тем в сообщении - один проход по тексту, а сообщение,
+    затрагивающее несколько тем, получает ответ по теме с наибольшим числом
+    совпадений.
+    """
+
+    def __init__(self, data: Dict):
+        self.topics: List[Dict] = data["topics"]
+        self.general_responses: List[str] = data["general_responses"]
+        self.low_mood_response: str = data["low_mood_response"]
+        self.high_mood_response: str = data["high_mood_response"]
+        self.empty_message_response: str = data["empty_message_response"]
+
+        self._index = AhoCorasick(
+            (topic_stem, topic_id)
+            for topic_id, topic in enumerate(self.topics)
+            for topic_stem in topic["stems"]
+        )
+
+    @classmethod
+    def load(cls, path: str = KNOWLEDGE_BASE_PATH) -> "KnowledgeBase":
+        with open(path, encoding='utf-8') as f:
+            knowledge_base = cls(json.load(f))
+        logger.info("📚 Knowledge base loaded: %s topics", len(knowledge_base.topics))
+        return knowledge_base
+
+    def match_topic(self, message_lower: str) -> Optional[Dict]:
+        """Тема с наибольшим числом совпадений (при равенстве - первая в базе)"""
+        scores: Dict[int, int] = {}
+        for match in self._index.iter_matches(message_lower):
+            scores[match.value] = scores.get(match.value, 0) + 1
+        if not scores:
+            return None
+        best = min(scores, key=lambda topic_id: (-scores[topic_id], topic_id))
+        return self.topics[best]
+
+    def get_response(self, message: str, context: Optional[Dict] = None) -> str:
+        """Подбирает ответ по теме сообщения или общий поддерживающий ответ"""
+        if not message:
+            return self.empty_message_response
+
+        name = context.get('name') if context else None
+
+        topic = self.match_topic(message.lower())
+        if topic:
+            response = random.choice(topic["responses"])
+            return personalize(response, name) if name else response
+
+        responses = self.general_responses
+        mood_stats = context.get('mood_stats') if context else None
+        if mood_stats and mood_stats['count']:
+            last_mood = mood_stats['last']
+            if last_mood <= 4:
+                responses = responses + [self.low_mood_response.format(mood=last_mood)]
+            elif last_mood >= 8:
+                responses = responses + [self.high_mood_response.format(mood=last_mood)]
+
+        response = random.choice(responses)
+        # С именем половина вариантов - персонализированные, как и раньше
+        if name and random.random() < 0.5:
+            return personalize(response, name)
+        return response
+
+
+# База загружается один раз при импорте
+knowledge_base = KnowledgeBase.load()
@@ -0,0 +1,164 @@
+import os
+import re
+import sys
+import json
+import queue
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# text - как раньше, json - одна JSON-запись на строку
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+# Запись в stdout из отдельного потока, чтобы не блокировать event loop
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# Доля сохраняемых INFO-событий с полем event: общая и по событиям ("deepseek_request=0.1,...")
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1.0))
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Атрибуты, которые есть у любой записи - все остальное пришло через extra=
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_PII_PATTERNS = [
+    (re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+'), '<email>'),
+    (re.compile(r'(?:https?://|www\.)\S+', re.IGNORECASE), '<url>'),
+    (re.compile(r'(?<!\w)@\w{3,}'), '<username>'),
+    (re.compile(r'\+?\d[\d\s()-]{6,}\d'), '<number>'),
+]
+
+
+def scrub_pii(text: str) -> str:
+    """Убирает из текста контакты и номера: e-mail, ссылки, @username, телефоны и карты"""
+    for pattern, replacement in _PII_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _parse_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in value.split(','):
+        name, _, rate = item.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def _extra_fields(record: logging.LogRecord) -> Dict:
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRS}
+
+
+class SamplingFilter(logging.Filter):
+    """Прореживает частые INFO-события (записи с extra={"event": ...}).
+
+    Предупреждения, ошибки и записи с extra={"always": True} (кризисные
+    события) проходят всегда.
+    """
+
+    def __init__(self, default_rate: float = LOG_SAMPLE_RATE, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = rates if rates is not None else _parse_rates(LOG_SAMPLE_RATES)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or getattr(record, 'always', False):
+            return True
+        event = getattr(record, 'event', None)
+        if event is None:
+            return True
+        rate = self.rates.get(event, self.default_rate)
+        return rate >= 1 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Структурированная запись: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат; поля из extra дописываются как key=value"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _extra_fields(record)
+        fields.pop('always', None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не форматирует запись в вызывающем потоке.
+
+    Сообщение собирается (record.getMessage) уже в потоке QueueListener,
+    поэтому на event loop остается только постановка в очередь.
+    Если очередь переполнена, запись отбрасывается, а не блокирует цикл
+    (кроме записей с always=True - они ждут места в очереди).
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if getattr(record, 'always', False):
+                self.queue.put(record)
+            else:
+                self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging():
+    """Настраивает корневой логгер по LOG_FORMAT / LOG_ASYNC / LOG_SAMPLE_*"""
+    global _listener
+
+    formatter = JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter(TEXT_FORMAT)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if LOG_ASYNC:
+        queue_handler = _DeferredQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        queue_handler.addFilter(SamplingFilter())
+        root.addHandler(queue_handler)
+        stop_logging()
+        _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+        _listener.start()
+    else:
+        stream_handler.addFilter(SamplingFilter())
+        root.addHandler(stream_handler)
+
+
+def stop_logging():
+    """Дописывает очередь логов перед остановкой процесса"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Пауза после последнего фрагмента, по истечении которой пачка уходит в ИИ (0 - без склейки).
+# Первое сообщение спокойного чата не ждет: пауза только для догоняющих фрагментов
+CHAT_COALESCE_WINDOW = float(os.getenv('CHAT_COALESCE_WINDOW', 0.4))
+# Максимальное ожидание с первого фрагмента и размер пачки
+CHAT_COALESCE_MAX_WAIT = float(os.getenv('CHAT_COALESCE_MAX_WAIT', 5))
+CHAT_COALESCE_MAX_MESSAGES = int(os.getenv('CHAT_COALESCE_MAX_MESSAGES', 5))
+
+
+class _Batch:
+    __slots__ = ('items', 'started', 'deadline', 'wake')
+
+    def __init__(self, now: float):
+        self.items: List[Any] = []
+        self.started = now
+        self.deadline = now
+        self.wake = asyncio.Event()
+
+
+class MessageCoalescer:
+    """Склейка быстрых серий сообщений одного чата в один вызов flush.
+
+    Фрагмент чата, у которого ничего не обрабатывается, уходит в flush
+    сразу - без задержки. Фрагмент, пришедший, пока чат еще ждет ответа на
+    предыдущую пачку, открывает новую пачку: каждый следующий продлевает
+    ожидание на window секунд (но не дольше max_wait с первого фрагмента).
+    Когда чат замолкает, набирается max_messages фрагментов или пришел
+    срочный фрагмент, вызывается flush(key, items).
+
+    add() не ждет: ожидание идет в фоновой задаче, поэтому очередь
+    обновлений чата не блокируется и следующие фрагменты доходят до пачки.
+    Пачки одного чата обрабатываются строго по очереди.
+    """
+
+    def __init__(self, flush: Callable[[Hashable, List[Any]], Awaitable],
+                 window: float = CHAT_COALESCE_WINDOW,
+                 max_wait: float = CHAT_COALESCE_MAX_WAIT,
+                 max_messages: int = CHAT_COALESCE_MAX_MESSAGES):
+        self.flush = flush
+        self.window = window
+        self.max_wait = max_wait
+        self.max_messages = max_messages
+        self._batches: Dict[Hashable, _Batch] = {}
+        # Последняя задача чата - следующая пачка ждет ее завершения
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+        self.fragments = 0
+        self.batches = 0
+        self.wait_total = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def add(self, key: Hashable, item: Any, urgent: bool = False):
+        """Добавляет фрагмент; urgent - отправить пачку сразу (например, кризис)"""
+        now = time.monotonic()
+        batch = self._batches.get(key)
+        if batch is None:
+            previous = self._tasks.get(key)
+            # Чат свободен - второго сообщения ждать не из-за чего
+            urgent = urgent or previous is None
+            batch = self._batches[key] = _Batch(now)
+            task = asyncio.create_task(self._run(key, batch, previous))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        batch.items.append(item)
+        batch.deadline = min(now + self.window, batch.started + self.max_wait)
+        self.fragments += 1
+        if urgent or len(batch.items) >= self.max_messages:
+            batch.wake.set()
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    async def _run(self, key: Hashable, batch: _Batch, previous: Optional[asyncio.Task]):
+        while not batch.wake.is_set():
+            delay = batch.deadline - time.monotonic()
+            if delay <= 0:
+                break
+            try:
+                await asyncio.wait_for(batch.wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+        # Пачка закрыта: новые фрагменты откроют следующую
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+
+        waited = time.monotonic() - batch.started
+        self.batches += 1
+        self.wait_total += waited
+        metrics.COALESCE_WAIT_SECONDS.observe(waited)
+        metrics.COALESCED_FRAGMENTS.observe(len(batch.items))
+
+        if previous is not None:
+            # Ответы чата уходят в порядке сообщений
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await self.flush(key, batch.items)
+        except Exception as e:
+            logger.error("💬 Coalesced batch error: %s", e)
+
+    async def stop(self, timeout: float = 10.0):
+        """Отправляет открытые пачки сразу и ждет их обработки"""
+        for batch in self._batches.values():
+            batch.wake.set()
+        tasks = list(self._tasks.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def stats(self) -> Dict:
+        return {
+            "window": self.window,
+            "max_wait": self.max_wait,
+            "open_batches": len(self._batches),
+            "fragments": self.fragments,
+            "batches": self.batches,
+            "ai_calls_saved": max(0, self.fragments - self.batches - sum(len(b.items) for b in self._batches.values())),
+            "fragments_per_batch": round(self.fragments / self.batches, 2) if self.batches else 0.0,
+            "wait_avg_ms": round(self.wait_total / self.batches * 1000, 1) if self.batches else 0.0
+        }
@@ -0,0 +1,103 @@
+import os
+import re
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+USER_MODE_CACHE_SIZE = int(os.getenv('USER_MODE_CACHE_SIZE', 100000))
+
+# Оценка настроения числом 1-10 (без кнопки)
+MOOD_NUMBER = re.compile(r'\s*(10|[1-9])\s*')
+
+Handler = Callable[..., Awaitable]
+
+
+class MessageRouter:
+    """Таблица маршрутов для текстов кнопок: точное совпадение -> обработчик.
+
+    Маршруты регистрируются декларативно (словарем или декоратором),
+    поиск - одно обращение к dict, сколько бы кнопок ни было.
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, Handler] = {}
+
+    def add(self, label: str, handler: Handler):
+        if label in self._routes:
+            raise ValueError(f"Route already registered: {label}")
+        self._routes[label] = handler
+
+    def add_routes(self, routes: Dict[str, Handler]):
+        for label, handler in routes.items():
+            self.add(label, handler)
+
+    def button(self, *labels: str):
+        """Декоратор: обработчик для одной или нескольких кнопок"""
+        def decorator(handler: Handler) -> Handler:
+            for label in labels:
+                self.add(label, handler)
+            return handler
+        return decorator
+
+    def match(self, text: str) -> Optional[Handler]:
+        return self._routes.get(text)
+
+    def __contains__(self, text: str) -> bool:
+        return text in self._routes
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+
+def parse_mood_number(text: str) -> Optional[int]:
+    """Оценка 1-10 из сообщения, состоящего только из числа"""
+    match = MOOD_NUMBER.fullmatch(text)
+    return int(match.group(1)) if match else None
+
+
+class ModeCache:
+    """Кеш режима пользователя (в чате с ИИ или нет), чтобы не читать запись
+    из хранилища на каждое сообщение. Обновляется при каждой смене режима.
+
+    Кеш свой у каждого процесса и не видит смену режима в другом процессе,
+    поэтому включать его можно, только если все сообщения пользователя
+    обрабатывает один процесс (maxsize=0 - выключен).
+    """
+
+    def __init__(self, maxsize: int = USER_MODE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._modes: "OrderedDict[int, bool]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, user_id: int) -> Optional[bool]:
+        if not self.enabled:
+            return None
+        mode = self._modes.get(user_id)
+        if mode is None:
+            self.misses += 1
+            return None
+        self._modes.move_to_end(user_id)
+        self.hits += 1
+        return mode
+
+    def set(self, user_id: int, in_chat_mode: bool):
+        if self.maxsize <= 0:
+            return
+        self._modes[user_id] = in_chat_mode
+        self._modes.move_to_end(user_id)
+        if len(self._modes) > self.maxsize:
+            self._modes.popitem(last=False)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._modes),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
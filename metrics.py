@@ -0,0 +1,267 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_LOOP_LAG_INTERVAL = float(os.getenv('METRICS_LOOP_LAG_INTERVAL', 0.5))
+# Сколько пользователей помнить для счетчика активных (ограничение памяти)
+METRICS_ACTIVE_USERS_MAX = int(os.getenv('METRICS_ACTIVE_USERS_MAX', 100000))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], *extra: str) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(pair for pair in extra if pair)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счетчик (значения по наборам меток)"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self) -> Dict[Tuple, float]:
+        return dict(self._values)
+
+    def samples(self, values: Optional[Dict[Tuple, float]] = None, shard: str = "") -> Iterable[str]:
+        """Строки экспозиции: свои значения или снимок values (shard - метка процесса пула)"""
+        for labels, value in (self._values if values is None else values).items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels, shard)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """Текущее значение (может уменьшаться)"""
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами.
+
+    observe() - один бинарный поиск и два сложения; накопительные суммы
+    для формата Prometheus считаются только при выгрузке.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики корзин (+Inf последней), сумма]
+        self._series: Dict[Tuple, List] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def snapshot(self) -> Dict[Tuple, List]:
+        return {labels: [list(counts), total] for labels, (counts, total) in self._series.items()}
+
+    def samples(self, series: Optional[Dict[Tuple, List]] = None, shard: str = "") -> Iterable[str]:
+        for labels, (counts, total) in (self._series if series is None else series).items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, shard, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            suffix = _format_labels(self.labelnames, labels, shard)
+            yield f"{self.name}_sum{suffix} {_format_value(total)}"
+            yield f"{self.name}_count{suffix} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Значения всех метрик (для передачи из процесса пула в приемник)"""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render(self, shards: Optional[Dict] = None) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4.
+
+        shards - снимки snapshot() процессов пула: их значения выводятся
+        в тех же метриках с меткой shard="номер".
+        """
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+            for shard, snapshot in (shards or {}).items():
+                values = snapshot.get(metric.name)
+                if values:
+                    lines.extend(metric.samples(values, f'shard="{_escape(shard)}"'))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+WEBHOOK_SECONDS = registry.register(Histogram(
+    "mindmate_webhook_seconds", "Webhook request handling time", ["status"]))
+WEBHOOK_IGNORED = registry.register(Counter(
+    "mindmate_webhook_ignored_total", "Updates dropped before parsing because no handler takes them", ["type"]))
+HANDLER_SECONDS = registry.register(Histogram(
+    "mindmate_handler_seconds", "Telegram handler execution time", ["handler"]))
+HANDLER_ERRORS = registry.register(Counter(
+    "mindmate_handler_errors_total", "Exceptions raised by Telegram handlers", ["handler"]))
+DEEPSEEK_SECONDS = registry.register(Histogram(
+    "mindmate_deepseek_seconds", "DeepSeek API call time", ["outcome"]))
+FALLBACK_SECONDS = registry.register(Histogram(
+    "mindmate_fallback_seconds", "Fallback knowledge base response time", buckets=FAST_BUCKETS))
+REPLIES = registry.register(Counter(
+    "mindmate_replies_total", "Replies in chat mode by source (ai, cache, fallback, crisis)", ["source"]))
+RATE_LIMITED = registry.register(Counter(
+    "mindmate_rate_limited_total", "Chat messages answered without DeepSeek due to rate limits", ["scope"]))
+COALESCED_FRAGMENTS = registry.register(Histogram(
+    "mindmate_coalesced_fragments", "Chat messages merged into one AI call", buckets=(1, 2, 3, 4, 5, 8)))
+COALESCE_WAIT_SECONDS = registry.register(Histogram(
+    "mindmate_coalesce_wait_seconds", "Time from the first fragment to the AI call",
+    buckets=(0.1, 0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)))
+OUTBOUND_WAIT_SECONDS = registry.register(Histogram(
+    "mindmate_outbound_wait_seconds", "Time an outgoing message waited in the send pipeline", ["lane"]))
+OUTBOUND_MESSAGES = registry.register(Counter(
+    "mindmate_outbound_messages_total", "Outgoing Telegram calls by lane and outcome", ["lane", "outcome"]))
+OUTBOUND_RETRIES = registry.register(Counter(
+    "mindmate_outbound_retries_total", "Send retries by reason (retry_after, network)", ["reason"]))
+REMINDER_LAG_SECONDS = registry.register(Histogram(
+    "mindmate_reminder_lag_seconds", "Delay between a reminder's scheduled time and its delivery",
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 3600.0)))
+REMINDERS_SENT = registry.register(Counter(
+    "mindmate_reminders_total", "Reminder deliveries by kind and outcome (sent, dry_run, failed, blocked)",
+    ["kind", "outcome"]))
+REMINDERS_SCHEDULED = registry.register(Gauge(
+    "mindmate_reminders_scheduled", "Daily reminders in the schedule"))
+CRISIS_DETECT_SECONDS = registry.register(Histogram(
+    "mindmate_crisis_detect_seconds", "Crisis detection time", buckets=FAST_BUCKETS))
+CRISIS_DETECTIONS = registry.register(Counter(
+    "mindmate_crisis_detections_total", "Crisis detection results by level", ["level"]))
+CRISIS_AUDIT_EVENTS = registry.register(Counter(
+    "mindmate_crisis_audit_events_total", "Crisis audit log events by outcome (written, dropped)", ["outcome"]))
+CRISIS_ALERTS = registry.register(Counter(
+    "mindmate_crisis_alerts_total", "Level 3 crisis alerts by outcome (sent, failed)", ["outcome"]))
+LOOP_LAG_SECONDS = registry.register(Histogram(
+    "mindmate_event_loop_lag_seconds", "Event loop scheduling delay", buckets=LAG_BUCKETS))
+ACTIVE_USERS = registry.register(Gauge(
+    "mindmate_active_users", "Users seen within the window", ["window"]))
+USERS_TOTAL = registry.register(Gauge(
+    "mindmate_users_total", "Users in the user store"))
+
+
+def track_handler(name: Optional[str] = None) -> Callable:
+    """Декоратор для обработчиков Telegram: время, ошибки и активные пользователи"""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(update, *args, **kwargs):
+            user = getattr(update, 'effective_user', None)
+            if user is not None:
+                active_users.seen(user.id)
+            started = time.perf_counter()
+            try:
+                return await func(update, *args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(label)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, label)
+        return wrapper
+    return decorator
+
+
+class ActiveUsers:
+    """Время последней активности пользователей (не больше max_users записей)"""
+
+    WINDOWS = (("5m", 300), ("1h", 3600), ("24h", 86400))
+
+    def __init__(self, max_users: int = METRICS_ACTIVE_USERS_MAX):
+        self.max_users = max_users
+        self._last_seen: Dict[int, float] = {}
+
+    def seen(self, user_id: int):
+        # Повторная вставка переносит пользователя в конец (порядок = давность)
+        self._last_seen.pop(user_id, None)
+        self._last_seen[user_id] = time.monotonic()
+        if len(self._last_seen) > self.max_users:
+            del self._last_seen[next(iter(self._last_seen))]
+
+    def update_gauges(self):
+        now = time.monotonic()
+        longest = self.WINDOWS[-1][1]
+        # Записи упорядочены по времени: удаляем устаревшие с начала
+        while self._last_seen:
+            user_id = next(iter(self._last_seen))
+            if now - self._last_seen[user_id] <= longest:
+                break
+            del self._last_seen[user_id]
+        for window, seconds in self.WINDOWS:
+            ACTIVE_USERS.set(sum(1 for seen in self._last_seen.values() if now - seen <= seconds), window)
+
+
+class LoopLagMonitor:
+    """Фоновая задача: насколько позже запланированного просыпается event loop"""
+
+    def __init__(self, interval: float = METRICS_LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - started - self.interval))
+
+
+active_users = ActiveUsers()
+loop_lag_monitor = LoopLagMonitor()
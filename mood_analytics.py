@@ -0,0 +1,134 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from mood_series import MoodSeries
+
+# Сколько оценок нужно, чтобы день недели или время суток учитывались в профиле
+MIN_PROFILE_COUNT = 3
+# Изменение средней за неделю, ниже которого тренд считается ровным
+TREND_FLAT_PER_WEEK = 0.3
+TREND_DAYS = 14
+
+# Формы с предлогом, чтобы подставлять во фразы "хуже всего ..."
+WEEKDAY_NAMES = ["в понедельник", "во вторник", "в среду", "в четверг", "в пятницу", "в субботу", "в воскресенье"]
+# Время суток: название и часы (начало, конец)
+DAY_PARTS = [("ночью", 0, 6), ("утром", 6, 12), ("днем", 12, 18), ("вечером", 18, 24)]
+
+
+def _slope(points: Sequence[Tuple[int, float]]) -> Optional[float]:
+    """Наклон прямой методом наименьших квадратов (изменение за единицу x)"""
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+def _stddev(values: Sequence[float]) -> Optional[float]:
+    if len(values) < 2:
+        return None
+    mean = sum(values) / len(values)
+    return (sum((value - mean) ** 2 for value in values) / len(values)) ** 0.5
+
+
+def _profile(sums: Sequence[int], counts: Sequence[int]) -> List[Optional[float]]:
+    return [total / count if count >= MIN_PROFILE_COUNT else None
+            for total, count in zip(sums, counts)]
+
+
+def _extremes(profile: Sequence[Optional[float]], names: Sequence[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Лучший и худший элементы профиля (None, если сравнивать не с чем)"""
+    known = [(value, name) for value, name in zip(profile, names) if value is not None]
+    if len(known) < 2:
+        return None, None
+    best, worst = max(known), min(known)
+    if best[0] == worst[0]:
+        return None, None
+    return best[1], worst[1]
+
+
+def analyze(series: MoodSeries, now: Optional[float] = None) -> Dict:
+    """Аналитика настроения поверх MoodSeries.
+
+    Все величины берутся из счетчиков ряда или из кольца дневных средних
+    (не больше 30 дней), поэтому стоимость не зависит от длины истории.
+    Словарь включает ключи series.summary().
+    """
+    stats = series.summary(now)
+
+    recent_days = series.daily_window(TREND_DAYS, now)
+    slope = _slope(recent_days)
+    trend = None
+    if slope is not None:
+        per_week = slope * 7
+        trend = "up" if per_week >= TREND_FLAT_PER_WEEK else "down" if per_week <= -TREND_FLAT_PER_WEEK else "flat"
+
+    daily_30d = [avg for _, avg in series.daily_window(30, now)]
+
+    weekday_avg = _profile(series.weekday_sums, series.weekday_counts)
+    part_sums = [sum(series.hour_sums[start:end]) for _, start, end in DAY_PARTS]
+    part_counts = [sum(series.hour_counts[start:end]) for _, start, end in DAY_PARTS]
+    day_part_avg = _profile(part_sums, part_counts)
+
+    best_weekday, worst_weekday = _extremes(weekday_avg, WEEKDAY_NAMES)
+    best_day_part, worst_day_part = _extremes(day_part_avg, [name for name, _, _ in DAY_PARTS])
+
+    stats.update({
+        "ewma": series.ewma,
+        "volatility": series.stddev,
+        "volatility_30d": _stddev(daily_30d),
+        "trend_per_week": slope * 7 if slope is not None else None,
+        "trend": trend,
+        "weekday_avg": weekday_avg,
+        "day_part_avg": day_part_avg,
+        "best_weekday": best_weekday,
+        "worst_weekday": worst_weekday,
+        "best_day_part": best_day_part,
+        "worst_day_part": worst_day_part,
+        "streak": series.current_streak(now),
+        "best_streak": series.best_streak
+    })
+    return stats
+
+
+def describe(stats: Dict) -> List[str]:
+    """Короткое описание для промпта ИИ: не больше пяти строк независимо от длины истории"""
+    if not stats or not stats['count']:
+        return []
+
+    avg_mood = stats['average']
+    mood_line = f"История настроений пользователя: среднее {avg_mood:.1f}/10"
+    if avg_mood < 5:
+        mood_line += " (пользователь часто чувствует себя плохо)"
+    elif avg_mood > 7:
+        mood_line += " (пользователь обычно в хорошем настроении)"
+    lines = [mood_line]
+
+    recent = []
+    if stats.get('avg_7d') is not None:
+        recent.append(f"за 7 дней {stats['avg_7d']:.1f}/10")
+    recent.append(f"последняя оценка {stats['last']}/10")
+    lines.append("Недавно: " + ", ".join(recent))
+
+    trend = stats.get('trend')
+    if trend == "up":
+        lines.append("Тренд: настроение улучшается последние две недели")
+    elif trend == "down":
+        lines.append("Тренд: настроение ухудшается последние две недели")
+
+    volatility = stats.get('volatility_30d')
+    if volatility is not None and volatility >= 2:
+        lines.append("Настроение сильно колеблется день ото дня")
+
+    if stats.get('worst_weekday') or stats.get('worst_day_part'):
+        pattern = []
+        if stats.get('worst_weekday'):
+            pattern.append(f"хуже всего {stats['worst_weekday']}")
+        if stats.get('worst_day_part'):
+            pattern.append(f"труднее {stats['worst_day_part']}")
+        lines.append("Закономерности: " + ", ".join(pattern))
+
+    return lines
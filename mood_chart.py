@@ -0,0 +1,275 @@
+import os
+import time
+import zlib
+import struct
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+MOOD_CHART = os.getenv('MOOD_CHART', 'true').lower() in ('1', 'true', 'yes')
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', 2))
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', 1000))
+CHART_DAYS = int(os.getenv('CHART_DAYS', 90))
+
+CHART_WIDTH = 640
+CHART_HEIGHT = 320
+MARGIN_LEFT, MARGIN_RIGHT, MARGIN_TOP, MARGIN_BOTTOM = 30, 14, 14, 14
+
+BACKGROUND = (255, 255, 255)
+GRID = (232, 232, 238)
+WEEK_GRID = (244, 244, 248)
+AXIS = (150, 150, 160)
+LINE = (88, 101, 242)
+
+# Цифры 3x5 для подписей шкалы (шрифты не нужны)
+DIGITS = {
+    "0": ("111", "101", "101", "101", "111"),
+    "1": ("010", "110", "010", "010", "111"),
+    "2": ("111", "001", "111", "100", "111"),
+    "3": ("111", "001", "111", "001", "111"),
+    "4": ("101", "101", "111", "001", "001"),
+    "5": ("111", "100", "111", "001", "111"),
+    "6": ("111", "100", "111", "101", "111"),
+    "7": ("111", "001", "001", "001", "001"),
+    "8": ("111", "101", "111", "101", "111"),
+    "9": ("111", "101", "111", "001", "111"),
+}
+
+
+def _score_color(score: float) -> Tuple[int, int, int]:
+    """Цвет точки: красный (1) -> желтый (5.5) -> зеленый (10)"""
+    t = max(0.0, min(1.0, (score - 1) / 9))
+    if t < 0.5:
+        return 230, int(80 + 300 * t), 70
+    return int(230 - 360 * (t - 0.5)), 200, 70
+
+
+class _Canvas:
+    """Простейший RGB-растр с кодированием в PNG"""
+
+    def __init__(self, width: int, height: int, background: Tuple[int, int, int]):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(bytes(background) * (width * height))
+
+    def set(self, x: int, y: int, color: Tuple[int, int, int]):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            offset = (y * self.width + x) * 3
+            self.pixels[offset:offset + 3] = bytes(color)
+
+    def hline(self, x0: int, x1: int, y: int, color: Tuple[int, int, int]):
+        if 0 <= y < self.height:
+            x0, x1 = max(0, x0), min(self.width - 1, x1)
+            if x0 <= x1:
+                offset = (y * self.width + x0) * 3
+                self.pixels[offset:offset + (x1 - x0 + 1) * 3] = bytes(color) * (x1 - x0 + 1)
+
+    def vline(self, x: int, y0: int, y1: int, color: Tuple[int, int, int]):
+        for y in range(max(0, y0), min(self.height - 1, y1) + 1):
+            self.set(x, y, color)
+
+    def line(self, x0: int, y0: int, x1: int, y1: int, color: Tuple[int, int, int], thickness: int = 2):
+        """Отрезок по Брезенхэму толщиной thickness пикселей"""
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+        err = dx + dy
+        while True:
+            for ox in range(thickness):
+                for oy in range(thickness):
+                    self.set(x0 + ox, y0 + oy, color)
+            if x0 == x1 and y0 == y1:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+
+    def dot(self, cx: int, cy: int, radius: int, color: Tuple[int, int, int]):
+        for y in range(cy - radius, cy + radius + 1):
+            for x in range(cx - radius, cx + radius + 1):
+                if (x - cx) ** 2 + (y - cy) ** 2 <= radius * radius:
+                    self.set(x, y, color)
+
+    def text(self, x: int, y: int, value: str, color: Tuple[int, int, int], scale: int = 2):
+        for char in value:
+            for row, bits in enumerate(DIGITS.get(char, ())):
+                for col, bit in enumerate(bits):
+                    if bit == "1":
+                        for oy in range(scale):
+                            for ox in range(scale):
+                                self.set(x + col * scale + ox, y + row * scale + oy, color)
+            x += 4 * scale
+
+    def to_png(self) -> bytes:
+        stride = self.width * 3
+        raw = b"".join(
+            b"\x00" + bytes(self.pixels[row * stride:(row + 1) * stride])
+            for row in range(self.height)
+        )
+
+        def chunk(kind: bytes, data: bytes) -> bytes:
+            return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+        header = struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0)
+        return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+                + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b""))
+
+
+def render_chart(points: Sequence[Tuple[int, float]], width: int = CHART_WIDTH,
+                 height: int = CHART_HEIGHT) -> bytes:
+    """Рисует график настроения (оценки 1-10 по времени) и возвращает PNG.
+
+    Чистая функция без внешних зависимостей - выполняется в отдельном процессе.
+    """
+    canvas = _Canvas(width, height, BACKGROUND)
+    left, right = MARGIN_LEFT, width - MARGIN_RIGHT
+    top, bottom = MARGIN_TOP, height - MARGIN_BOTTOM
+
+    def y_of(score: float) -> int:
+        return int(round(bottom - (score - 1) / 9 * (bottom - top)))
+
+    for score in range(1, 11):
+        y = y_of(score)
+        canvas.hline(left, right, y, GRID)
+        label = str(score)
+        canvas.text(left - 6 - len(label) * 8 + 2, y - 5, label, AXIS)
+
+    if points:
+        start, end = points[0][0], points[-1][0]
+        span = max(end - start, 1)
+
+        def x_of(timestamp: int) -> int:
+            if end == start:
+                return (left + right) // 2
+            return int(round(left + (timestamp - start) / span * (right - left)))
+
+        # Недельная сетка от последней точки назад
+        week = 7 * 86400
+        tick = end - week
+        while tick > start:
+            canvas.vline(x_of(tick), top, bottom, WEEK_GRID)
+            tick -= week
+
+        coords = [(x_of(timestamp), y_of(score), score) for timestamp, score in points]
+        for (x0, y0, _), (x1, y1, _) in zip(coords, coords[1:]):
+            canvas.line(x0, y0, x1, y1, LINE)
+        radius = 4 if len(coords) <= 60 else 2
+        for x, y, score in coords:
+            canvas.dot(x, y, radius, _score_color(score))
+
+    canvas.vline(left, top, bottom, AXIS)
+    canvas.hline(left, right, bottom, AXIS)
+    return canvas.to_png()
+
+
+class ChartRenderer:
+    """Рендер графиков в пуле процессов с кешем по пользователю и версии данных.
+
+    В кеше хранится последний график пользователя: PNG и file_id, который
+    Telegram вернул после первой отправки. Пока версия ряда не изменилась,
+    повторный /stats отправляет file_id (или готовые байты) без рендера.
+    Одновременные запросы одного графика ждут один и тот же рендер.
+    """
+
+    def __init__(self, workers: int = CHART_WORKERS, maxsize: int = CHART_CACHE_SIZE,
+                 days: int = CHART_DAYS):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.days = days
+        self._executor: Optional[Executor] = None
+        # user_id -> (версия, PNG, file_id)
+        self._cache: "OrderedDict[int, Tuple[int, bytes, Optional[str]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, int], asyncio.Future] = {}
+
+        self.renders = 0
+        self.hits = 0
+        self.render_time_total = 0.0
+
+    def _get_executor(self) -> Optional[Executor]:
+        if self.workers <= 0:
+            return None  # потоки по умолчанию
+        if self._executor is None:
+            # Пул процессов нужен только с первым графиком - не импортируем при запуске
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # spawn: дочерние процессы не наследуют потоки и сокеты event loop
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _points(self, series) -> List[Tuple[int, float]]:
+        cutoff = int(time.time()) - self.days * 86400
+        return [(int(timestamp), float(score)) for timestamp, score in series.points()
+                if timestamp >= cutoff]
+
+    def cached(self, user_id: int, version: int) -> Optional[Tuple[bytes, Optional[str]]]:
+        entry = self._cache.get(user_id)
+        if entry is None or entry[0] != version:
+            return None
+        self._cache.move_to_end(user_id)
+        return entry[1], entry[2]
+
+    async def get_chart(self, user_id: int, series) -> Tuple[bytes, Optional[str]]:
+        """PNG и известный file_id (или None) для текущей версии ряда"""
+        version = series.version
+        cached = self.cached(user_id, version)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        key = (user_id, version)
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._render(user_id, version, self._points(series)))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.hits += 1
+        return await asyncio.shield(future), None
+
+    async def _render(self, user_id: int, version: int, points: List[Tuple[int, float]]) -> bytes:
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(self._get_executor(), render_chart, points)
+        self.renders += 1
+        self.render_time_total += time.perf_counter() - started
+
+        if self.maxsize > 0:
+            self._cache[user_id] = (version, png, None)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return png
+
+    def remember_file_id(self, user_id: int, version: int, file_id: str):
+        """Запоминает file_id отправленного графика для повторной отправки без загрузки"""
+        entry = self._cache.get(user_id)
+        if entry is not None and entry[0] == version:
+            self._cache[user_id] = (version, entry[1], file_id)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": MOOD_CHART,
+            "workers": self.workers,
+            "cached": len(self._cache),
+            "renders": self.renders,
+            "hits": self.hits,
+            "render_avg_ms": round(self.render_time_total / self.renders * 1000, 1) if self.renders else 0.0
+        }
+
+
+chart_renderer = ChartRenderer()
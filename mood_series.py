@@ -0,0 +1,305 @@
+import os
+import sys
+import time
+import base64
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+SECONDS_PER_DAY = 86400
+# Часовой пояс дней и профилей, если у пользователя нет своего - тот же, что у /remind (UTC+3 - Москва)
+MOOD_UTC_OFFSET = float(os.getenv('REMINDER_DEFAULT_UTC_OFFSET', 3))
+# Последние записи хранятся как есть, более старые сворачиваются в средние по дням
+RAW_CAPACITY = 256
+DAILY_CAPACITY = 730
+# Сколько самых старых сырых записей сворачивать за раз при переполнении
+FOLD_CHUNK = RAW_CAPACITY // 4
+# Кольцо дневных сумм для скользящих окон (покрывает самое длинное окно)
+RING_DAYS = 30
+# Коэффициент экспоненциального скользящего среднего (вес новой записи)
+EWMA_ALPHA = 0.3
+
+
+def _pack(values: array) -> str:
+    values = array(values.typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def _unpack(typecode: str, encoded: str) -> array:
+    values = array(typecode)
+    values.frombytes(base64.b64decode(encoded))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class MoodSeries:
+    """Компактный временной ряд оценок настроения одного пользователя.
+
+    Каждая запись - метка времени (uint32) и оценка (1 байт) в массивах.
+    Последние RAW_CAPACITY записей хранятся целиком, более старые
+    сворачиваются в средние по дням (не больше DAILY_CAPACITY дней), поэтому
+    объем памяти на пользователя ограничен (~7 КБ).
+
+    Общие счетчики (число, сумма, сумма квадратов, минимум, максимум,
+    последняя оценка, скользящее среднее), профили по дням недели и часам,
+    серия дней подряд и дневные суммы для окон 7 и 30 дней обновляются при
+    записи, так что статистика читается за O(1). Границы дней, дни недели
+    и часы считаются в одном часовом поясе пользователя utc_offset (часы
+    от UTC); новый пояс применяется к следующим записям.
+    """
+
+    def __init__(self, utc_offset: Optional[float] = None):
+        self.utc_offset = MOOD_UTC_OFFSET if utc_offset is None else utc_offset
+        self.timestamps = array('I')
+        self.scores = array('B')
+        # Свернутые старые данные: день, средняя оценка x10, число записей
+        self.daily_days = array('I')
+        self.daily_avg10 = array('B')
+        self.daily_counts = array('H')
+
+        self.count = 0
+        self.total = 0
+        self.total_squares = 0
+        self.ewma = 0.0
+        self.min = 0
+        self.max = 0
+        self.last = 0
+        self.last_ts = 0
+        # Номер записи - меняется при каждом добавлении (версия данных)
+        self.version = 0
+
+        # Профили: суммы и число оценок по дням недели (пн=0) и часам
+        self.weekday_sums = array('I', [0] * 7)
+        self.weekday_counts = array('I', [0] * 7)
+        self.hour_sums = array('I', [0] * 24)
+        self.hour_counts = array('I', [0] * 24)
+
+        # Серия дней подряд с записями: текущая и лучшая
+        self.streak = 0
+        self.best_streak = 0
+        self._streak_day = 0
+
+        self._ring_days = array('I', [0] * RING_DAYS)
+        self._ring_sums = array('I', [0] * RING_DAYS)
+        self._ring_counts = array('H', [0] * RING_DAYS)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __bool__(self) -> bool:
+        return self.count > 0
+
+    def add(self, score: int, timestamp: Optional[float] = None):
+        """Добавляет оценку 1-10 (по умолчанию - с текущим временем)"""
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        score = max(1, min(10, int(score)))
+
+        self.timestamps.append(timestamp)
+        self.scores.append(score)
+        if len(self.scores) > RAW_CAPACITY:
+            self._fold_oldest(FOLD_CHUNK)
+
+        self.min = score if not self.count else min(self.min, score)
+        self.max = max(self.max, score)
+        self.ewma = score if not self.count else self.ewma + EWMA_ALPHA * (score - self.ewma)
+        self.count += 1
+        self.total += score
+        self.total_squares += score * score
+        self.version += 1
+        if timestamp >= self.last_ts:
+            self.last, self.last_ts = score, timestamp
+
+        self._add_to_profiles(timestamp, score, 1)
+        day = self._day(timestamp)
+        self._extend_streak(day)
+        slot = day % RING_DAYS
+        if self._ring_days[slot] != day:
+            if self._ring_days[slot] > day:
+                return  # запись старше окна
+            self._ring_days[slot] = day
+            self._ring_sums[slot] = 0
+            self._ring_counts[slot] = 0
+        self._ring_sums[slot] += score
+        self._ring_counts[slot] = min(self._ring_counts[slot] + 1, 0xFFFF)
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def stddev(self) -> float:
+        """Стандартное отклонение всех оценок"""
+        if not self.count:
+            return 0.0
+        variance = self.total_squares / self.count - self.average ** 2
+        return max(variance, 0.0) ** 0.5
+
+    def current_streak(self, now: Optional[float] = None) -> int:
+        """Дней подряд с записями (серия прерывается, если вчера и сегодня записей нет)"""
+        today = self._day(time.time() if now is None else now)
+        return self.streak if self._streak_day >= today - 1 else 0
+
+    def daily_window(self, days: int, now: Optional[float] = None) -> List[Tuple[int, float]]:
+        """Средние по дням за последние days дней (days <= 30): [(день, среднее)] по возрастанию"""
+        today = self._day(time.time() if now is None else now)
+        first_day = today - min(days, RING_DAYS) + 1
+        return sorted(
+            (self._ring_days[slot], self._ring_sums[slot] / self._ring_counts[slot])
+            for slot in range(RING_DAYS)
+            if first_day <= self._ring_days[slot] <= today and self._ring_counts[slot]
+        )
+
+    def window_average(self, days: int, now: Optional[float] = None) -> Optional[float]:
+        """Средняя оценка за последние days дней (days <= 30), None - если записей нет"""
+        today = self._day(time.time() if now is None else now)
+        first_day = today - min(days, RING_DAYS) + 1
+        total = count = 0
+        for slot in range(RING_DAYS):
+            if first_day <= self._ring_days[slot] <= today:
+                total += self._ring_sums[slot]
+                count += self._ring_counts[slot]
+        return total / count if count else None
+
+    def summary(self, now: Optional[float] = None) -> Dict:
+        """Сводка для статистики и промпта (без обхода истории)"""
+        return {
+            "count": self.count,
+            "average": self.average,
+            "min": self.min,
+            "max": self.max,
+            "last": self.last,
+            "last_time": self.last_ts,
+            "avg_7d": self.window_average(7, now),
+            "avg_30d": self.window_average(30, now)
+        }
+
+    def points(self) -> List[Tuple[int, float]]:
+        """Все точки по времени: свернутые дни (местный полдень) и сырые записи"""
+        noon = SECONDS_PER_DAY // 2 - self._offset_seconds()
+        folded = [(day * SECONDS_PER_DAY + noon, avg10 / 10)
+                  for day, avg10 in zip(self.daily_days, self.daily_avg10)]
+        return folded + list(zip(self.timestamps, self.scores))
+
+    def _offset_seconds(self) -> int:
+        return int(self.utc_offset * 3600)
+
+    def _day(self, timestamp: float) -> int:
+        """Номер дня по местному времени пользователя"""
+        return (int(timestamp) + self._offset_seconds()) // SECONDS_PER_DAY
+
+    def _add_to_profiles(self, timestamp: int, score: float, weight: int):
+        local = time.gmtime(timestamp + self._offset_seconds())
+        self.weekday_sums[local.tm_wday] += int(round(score * weight))
+        self.weekday_counts[local.tm_wday] += weight
+        self.hour_sums[local.tm_hour] += int(round(score * weight))
+        self.hour_counts[local.tm_hour] += weight
+
+    def _extend_streak(self, day: int):
+        if day == self._streak_day or day < self._streak_day:
+            return  # тот же день или запись задним числом
+        self.streak = self.streak + 1 if day == self._streak_day + 1 else 1
+        self._streak_day = day
+        self.best_streak = max(self.best_streak, self.streak)
+
+    def _fold_oldest(self, chunk: int):
+        """Сворачивает chunk самых старых сырых записей в средние по дням"""
+        for timestamp, score in zip(self.timestamps[:chunk], self.scores[:chunk]):
+            day = self._day(timestamp)
+            if self.daily_days and self.daily_days[-1] == day:
+                count = self.daily_counts[-1]
+                merged = (self.daily_avg10[-1] * count + score * 10) / (count + 1)
+                self.daily_avg10[-1] = int(round(merged))
+                self.daily_counts[-1] = min(count + 1, 0xFFFF)
+            else:
+                self.daily_days.append(day)
+                self.daily_avg10.append(score * 10)
+                self.daily_counts.append(1)
+        del self.timestamps[:chunk]
+        del self.scores[:chunk]
+
+        overflow = len(self.daily_days) - DAILY_CAPACITY
+        if overflow > 0:
+            del self.daily_days[:overflow]
+            del self.daily_avg10[:overflow]
+            del self.daily_counts[:overflow]
+
+    # ========== СЕРИАЛИЗАЦИЯ ==========
+    def to_data(self) -> Dict:
+        """Компактное JSON-совместимое представление для хранилища"""
+        return {
+            "v": 2,
+            "utc_offset": self.utc_offset,
+            "ts": _pack(self.timestamps),
+            "scores": _pack(self.scores),
+            "daily_days": _pack(self.daily_days),
+            "daily_avg10": _pack(self.daily_avg10),
+            "daily_counts": _pack(self.daily_counts),
+            "count": self.count,
+            "total": self.total,
+            "total_squares": self.total_squares,
+            "ewma": self.ewma,
+            "min": self.min,
+            "max": self.max,
+            "last": self.last,
+            "last_ts": self.last_ts,
+            "version": self.version,
+            "profiles": [_pack(self.weekday_sums), _pack(self.weekday_counts),
+                         _pack(self.hour_sums), _pack(self.hour_counts)],
+            "streak": [self.streak, self.best_streak, self._streak_day],
+            "ring": [_pack(self._ring_days), _pack(self._ring_sums), _pack(self._ring_counts)]
+        }
+
+    @classmethod
+    def from_data(cls, data, legacy_time: Optional[str] = None,
+                  utc_offset: Optional[float] = None) -> "MoodSeries":
+        """Восстанавливает ряд из хранилища.
+
+        Принимает готовый MoodSeries, словарь из to_data() или старый формат -
+        список оценок без времени (им присваивается время legacy_time).
+        utc_offset - часовой пояс пользователя, если он известен.
+        """
+        if isinstance(data, cls):
+            if utc_offset is not None:
+                data.utc_offset = utc_offset
+            return data
+        if not data:
+            return cls(utc_offset)
+        series = cls(data.get("utc_offset") if isinstance(data, dict) else None)
+        if utc_offset is not None:
+            series.utc_offset = utc_offset
+        if isinstance(data, list):
+            timestamp = _parse_time(legacy_time)
+            for score in data:
+                series.add(score, timestamp)
+            return series
+
+        series.timestamps = _unpack('I', data["ts"])
+        series.scores = _unpack('B', data["scores"])
+        series.daily_days = _unpack('I', data["daily_days"])
+        series.daily_avg10 = _unpack('B', data["daily_avg10"])
+        series.daily_counts = _unpack('H', data["daily_counts"])
+        for name in ("count", "total", "min", "max", "last", "last_ts", "version"):
+            setattr(series, name, data[name])
+        ring_days, ring_sums, ring_counts = data["ring"]
+        series._ring_days = _unpack('I', ring_days)
+        series._ring_sums = _unpack('I', ring_sums)
+        series._ring_counts = _unpack('H', ring_counts)
+        series.total_squares = data["total_squares"]
+        series.ewma = data["ewma"]
+        weekday_sums, weekday_counts, hour_sums, hour_counts = data["profiles"]
+        series.weekday_sums = _unpack('I', weekday_sums)
+        series.weekday_counts = _unpack('I', weekday_counts)
+        series.hour_sums = _unpack('I', hour_sums)
+        series.hour_counts = _unpack('I', hour_counts)
+        series.streak, series.best_streak, series._streak_day = data["streak"]
+        return series
+
+
+def _parse_time(value: Optional[str]) -> int:
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return int(time.time())
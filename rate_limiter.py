@@ -0,0 +1,195 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+RATE_LIMIT_USER_BURST = int(os.getenv('RATE_LIMIT_USER_BURST', 5))
+RATE_LIMIT_USER_PER_MINUTE = float(os.getenv('RATE_LIMIT_USER_PER_MINUTE', 10))
+RATE_LIMIT_CHAT_BURST = int(os.getenv('RATE_LIMIT_CHAT_BURST', 10))
+RATE_LIMIT_CHAT_PER_MINUTE = float(os.getenv('RATE_LIMIT_CHAT_PER_MINUTE', 20))
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv('RATE_LIMIT_MAX_BUCKETS', 100000))
+AI_MAX_IN_FLIGHT = int(os.getenv('AI_MAX_IN_FLIGHT', 50))
+# Лимиты Telegram на исходящие сообщения: всего в секунду и в один чат
+TELEGRAM_SEND_PER_SECOND = float(os.getenv('TELEGRAM_SEND_PER_SECOND', 25))
+TELEGRAM_CHAT_SEND_PER_MINUTE = float(os.getenv('TELEGRAM_CHAT_SEND_PER_MINUTE', 60))
+TELEGRAM_CHAT_SEND_BURST = int(os.getenv('TELEGRAM_CHAT_SEND_BURST', 3))
+
+
+class TokenBucket:
+    """Корзина токенов: вмещает capacity токенов, пополняется rate токенов в секунду"""
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+
+    def try_take(self, capacity: float, rate: float, now: float) -> bool:
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, capacity: float, rate: float, now: float, need: float = 1) -> float:
+        """Через сколько секунд в корзине будет need токенов (не забирая их)"""
+        tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        return 0.0 if tokens >= need else (need - tokens) / rate
+
+
+class RateLimiter:
+    """Набор корзин токенов по ключам (пользователь, чат) с ограничением памяти.
+
+    Корзины упорядочены по последнему обращению. Корзина, простоявшая
+    дольше времени полного пополнения, ничем не отличается от новой и
+    удаляется; при превышении max_buckets удаляются самые давние.
+    Нулевой запас или нулевое пополнение - лимит выключен.
+    """
+
+    def __init__(self, burst: int, per_minute: float, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.capacity = float(max(0, burst))
+        self.rate = max(0.0, per_minute / 60)
+        self.max_buckets = max_buckets
+        self.idle_seconds = self.capacity / self.rate if self.enabled else float("inf")
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+        self.allowed = 0
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0 and self.rate > 0
+
+    def allow(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """Забирает токен для key. False - лимит исчерпан"""
+        if not self.enabled:
+            return True
+        now = time.monotonic() if now is None else now
+        self._evict_idle(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.capacity, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+
+        if bucket.try_take(self.capacity, self.rate, now):
+            self.allowed += 1
+            return True
+        self.limited += 1
+        return False
+
+    def wait_time(self, key: Hashable, now: Optional[float] = None, need: float = 1) -> float:
+        """Через сколько секунд в корзине key будет need токенов (0 - уже есть)"""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return 0.0 if self.capacity >= need else (need - self.capacity) / self.rate
+        return bucket.wait_time(self.capacity, self.rate, now, need)
+
+    def _evict_idle(self, now: float):
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket.updated < self.idle_seconds:
+                break
+            del self._buckets[key]
+
+    def stats(self) -> Dict:
+        return {
+            "buckets": len(self._buckets),
+            "burst": self.capacity,
+            "per_minute": self.rate * 60,
+            "allowed": self.allowed,
+            "limited": self.limited
+        }
+
+
+class InFlightLimiter:
+    """Неблокирующий счетчик одновременных запросов: занять слот или сразу отказ"""
+
+    def __init__(self, limit: int = AI_MAX_IN_FLIGHT):
+        self.limit = limit
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        if self.limit > 0 and self.in_flight >= self.limit:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return True
+
+    def release(self):
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def stats(self) -> Dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rejected": self.rejected
+        }
+
+
+class SendShaper:
+    """Выравнивание исходящих сообщений под лимиты Telegram.
+
+    В отличие от RateLimiter не отказывает, а ждет, пока появятся токены
+    и в общей корзине, и в корзине чата. reserve - сколько общих токенов
+    оставить другим (фоновые рассылки не выбирают запас, нужный ответам).
+    """
+
+    def __init__(self, per_second: float = TELEGRAM_SEND_PER_SECOND,
+                 chat_per_minute: float = TELEGRAM_CHAT_SEND_PER_MINUTE,
+                 chat_burst: int = TELEGRAM_CHAT_SEND_BURST):
+        # Запас общей корзины - секунда отправок, не меньше одного (0 - без общего лимита)
+        self.total = RateLimiter(max(1, int(per_second)) if per_second > 0 else 0, per_second * 60, max_buckets=1)
+        self.chats = RateLimiter(chat_burst, chat_per_minute)
+        self.waited = 0.0
+
+    async def acquire(self, chat_id: Hashable, reserve: float = 0):
+        while True:
+            now = time.monotonic()
+            delay = max(self.total.wait_time(None, now, 1 + min(reserve, self.total.capacity - 1)),
+                        self.chats.wait_time(chat_id, now))
+            if delay <= 0:
+                # Между проверкой и взятием нет await - токены не успеют забрать
+                self.total.allow(None, now)
+                self.chats.allow(chat_id, now)
+                return
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict:
+        return {"total": self.total.stats(), "chat": self.chats.stats(), "waited_seconds": round(self.waited, 2)}
+
+
+class ChatRateLimiter:
+    """Лимиты сообщений к ИИ: по пользователю и по чату"""
+
+    def __init__(self):
+        self.users = RateLimiter(RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_PER_MINUTE)
+        self.chats = RateLimiter(RATE_LIMIT_CHAT_BURST, RATE_LIMIT_CHAT_PER_MINUTE)
+
+    def check(self, user_id: int, chat_id: int) -> List[str]:
+        """Пустой список - можно звать ИИ; иначе - какие лимиты превышены"""
+        exceeded = []
+        if not self.users.allow(user_id):
+            exceeded.append("user")
+        if not self.chats.allow(chat_id):
+            exceeded.append("chat")
+        return exceeded
+
+    def stats(self) -> Dict:
+        return {"user": self.users.stats(), "chat": self.chats.stats()}
+
+
+chat_rate_limiter = ChatRateLimiter()
@@ -0,0 +1,456 @@
+import os
+import re
+import json
+import time
+import heapq
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # не POSIX: блокировок нет, рассылает каждый процесс (запуск в одном процессе)
+    fcntl = None
+
+from telegram.error import Forbidden
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Напоминания: файл расписания (общий для процессов, переживает перезапуск), пробный режим без отправки
+REMINDERS_ENABLED = os.getenv('REMINDERS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+REMINDERS_PATH = os.getenv('REMINDERS_PATH', 'reminders.json')
+REMINDERS_DRY_RUN = os.getenv('REMINDERS_DRY_RUN', '').lower() in ('1', 'true', 'yes')
+# Часовой пояс по умолчанию для /remind без смещения (UTC+3 - Москва)
+REMINDER_DEFAULT_UTC_OFFSET = float(os.getenv('REMINDER_DEFAULT_UTC_OFFSET', 3))
+# Сколько напоминаний забирать за раз и сколько отправлять одновременно
+REMINDER_BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', 500))
+REMINDER_CONCURRENCY = int(os.getenv('REMINDER_CONCURRENCY', 20))
+# Напоминание, опоздавшее сильнее (например, бот был выключен), переносится на завтра
+REMINDER_MAX_LATE = float(os.getenv('REMINDER_MAX_LATE', 3600))
+# Как часто сохранять сроки, перечитывать файл после других процессов и проверять, жив ли владелец
+REMINDER_SYNC_INTERVAL = float(os.getenv('REMINDER_SYNC_INTERVAL', 2))
+
+KINDS = ("mood", "affirmation")
+DAY = 86400
+
+# Аргументы /remind: [mood|affirmation] ЧЧ:ММ [+N], [mood|affirmation] off
+REMIND_ARGS = re.compile(
+    r'\s*(?:(mood|affirmation|настроение|аффирмации?)\s+)?'
+    r'(?:(off|выкл)|([01]?\d|2[0-3])[:.]([0-5]\d)(?:\s+(?:utc|gmt|мск)?\s*([+-]\d{1,2})(?::?([0-5]\d))?)?)\s*',
+    re.IGNORECASE
+)
+KIND_ALIASES = {"настроение": "mood", "аффирмации": "affirmation", "аффирмация": "affirmation"}
+
+
+def parse_remind_args(text: str) -> Optional[Tuple[Optional[str], Optional[int], float]]:
+    """(вид или None, минута суток или None для off, смещение UTC в часах); None - не разобрано"""
+    match = REMIND_ARGS.fullmatch(text)
+    if not match:
+        return None
+    kind, off, hours, minutes, offset_hours, offset_minutes = match.groups()
+    if kind:
+        kind = kind.lower()
+        kind = KIND_ALIASES.get(kind, kind)
+    if off:
+        return kind, None, 0.0
+    offset = REMINDER_DEFAULT_UTC_OFFSET
+    if offset_hours:
+        sign = -1 if offset_hours.startswith('-') else 1
+        offset = int(offset_hours) + sign * int(offset_minutes or 0) / 60
+        if not -12 <= offset <= 14:
+            return None
+    return kind or "mood", int(hours) * 60 + int(minutes), offset
+
+
+def next_occurrence(minute: int, utc_offset: float, now: float) -> float:
+    """Ближайший момент (unix time) после now, когда у пользователя minute минут от полуночи"""
+    offset = utc_offset * 3600
+    local_now = now + offset
+    local_midnight = local_now - local_now % DAY
+    at = local_midnight + minute * 60
+    if at <= local_now:
+        at += DAY
+    return at - offset
+
+
+class Reminder:
+    """Ежедневное напоминание пользователю в его местное время"""
+
+    __slots__ = ('user_id', 'chat_id', 'kind', 'minute', 'utc_offset', 'next_at')
+
+    def __init__(self, user_id: int, chat_id: int, kind: str, minute: int,
+                 utc_offset: float, next_at: float):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.kind = kind
+        self.minute = minute
+        self.utc_offset = utc_offset
+        self.next_at = next_at
+
+    @property
+    def key(self) -> Tuple[int, str]:
+        return self.user_id, self.kind
+
+    @property
+    def local_time(self) -> str:
+        return f"{self.minute // 60:02d}:{self.minute % 60:02d}"
+
+    def to_data(self) -> List:
+        return [self.user_id, self.chat_id, self.kind, self.minute, self.utc_offset, self.next_at]
+
+    @classmethod
+    def from_data(cls, data: List) -> "Reminder":
+        """Напоминание из строки файла; ValueError - строка повреждена"""
+        try:
+            user_id, chat_id, kind, minute, utc_offset, next_at = data
+            reminder = cls(int(user_id), int(chat_id), kind, int(minute), float(utc_offset), float(next_at))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"bad reminder {data!r}") from e
+        if kind not in KINDS or not 0 <= reminder.minute < DAY // 60:
+            raise ValueError(f"bad reminder {data!r}")
+        return reminder
+
+
+class ReminderSchedule:
+    """Расписание на куче по времени следующей отправки.
+
+    Изменение или удаление не трогает кучу: старая запись остается и
+    пропускается при извлечении (сверяется с актуальным next_at).
+    """
+
+    def __init__(self):
+        self._reminders: Dict[Tuple[int, str], Reminder] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._reminders)
+
+    def set(self, reminder: Reminder):
+        self._reminders[reminder.key] = reminder
+        heapq.heappush(self._heap, (reminder.next_at, reminder.user_id, reminder.kind))
+
+    def remove(self, user_id: int, kind: str) -> bool:
+        return self._reminders.pop((user_id, kind), None) is not None
+
+    def for_user(self, user_id: int) -> List[Reminder]:
+        return [reminder for kind in KINDS
+                if (reminder := self._reminders.get((user_id, kind))) is not None]
+
+    def items(self) -> Iterable[Tuple[Tuple[int, str], Reminder]]:
+        return self._reminders.items()
+
+    def _skip_stale(self):
+        heap = self._heap
+        while heap:
+            at, user_id, kind = heap[0]
+            reminder = self._reminders.get((user_id, kind))
+            if reminder is not None and reminder.next_at == at:
+                return
+            heapq.heappop(heap)
+        if len(heap) > 2 * len(self._reminders) + 1024:
+            self._compact()
+
+    def _compact(self):
+        self._heap = [(r.next_at, r.user_id, r.kind) for r in self._reminders.values()]
+        heapq.heapify(self._heap)
+
+    def next_at(self) -> Optional[float]:
+        self._skip_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float, limit: int) -> List[Tuple[Reminder, float]]:
+        """Напоминания со сроком <= now: (напоминание, срок). Следующий срок - через сутки"""
+        due = []
+        while len(due) < limit:
+            self._skip_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            at, user_id, kind = heapq.heappop(self._heap)
+            reminder = self._reminders[(user_id, kind)]
+            reminder.next_at = next_occurrence(reminder.minute, reminder.utc_offset, max(now, at))
+            heapq.heappush(self._heap, (reminder.next_at, user_id, kind))
+            due.append((reminder, at))
+        return due
+
+    def to_data(self) -> List[List]:
+        return [reminder.to_data() for reminder in self._reminders.values()]
+
+    def load(self, data: List[List], now: float, known: Optional[Dict[Tuple[int, str], Reminder]] = None):
+        """Загружает сохраненное расписание; пропущенные давно напоминания - на завтра.
+        known - напоминания в памяти: если время то же, а срок в памяти позже,
+        напоминание уже отправлено и срок берется из памяти"""
+        for item in data:
+            try:
+                reminder = Reminder.from_data(item)
+            except ValueError as e:
+                # Испорченная строка не должна останавливать чтение остальных
+                logger.warning("⏰ Skipping reminder: %s", e, extra={"event": "reminder_bad_row"})
+                continue
+            previous = known.get(reminder.key) if known else None
+            if (previous is not None and previous.next_at > reminder.next_at
+                    and (previous.minute, previous.utc_offset) == (reminder.minute, reminder.utc_offset)):
+                reminder.next_at = previous.next_at
+            if reminder.next_at < now - REMINDER_MAX_LATE:
+                reminder.next_at = next_occurrence(reminder.minute, reminder.utc_offset, now)
+            self.set(reminder)
+
+
+class ReminderScheduler:
+    """Фоновая рассылка ежедневных напоминаний.
+
+    Расписание - один файл path на все процессы (воркеры uvicorn, процессы
+    пула SHARD_WORKERS). Рассылает только владелец - процесс, который
+    держит блокировку {path}.owner; если он завершился, блокировку
+    забирает другой. Любой процесс меняет расписание (set, remove) прямо
+    в файле под блокировкой {path}.lock, поэтому /remind off действует,
+    в каком бы процессе ни обработалось сообщение. Владелец перечитывает
+    файл, когда его изменил другой процесс (не реже sync_interval).
+
+    Задача владельца спит до ближайшего срока, забирает пачку наступивших
+    напоминаний и рассылает ее параллельно (не больше concurrency
+    одновременно). Заблокировавшим бота пользователям напоминания отключаются.
+
+    deliver(reminder) формирует и отправляет сообщение (лимиты Telegram и
+    повторы - на стороне отправки, см. send_pipeline); в пробном режиме
+    (dry_run) не вызывается - только журнал и метрики.
+    """
+
+    def __init__(self, deliver: Callable[[Reminder], Awaitable], path: str = REMINDERS_PATH,
+                 dry_run: bool = REMINDERS_DRY_RUN, batch_size: int = REMINDER_BATCH_SIZE,
+                 concurrency: int = REMINDER_CONCURRENCY, sync_interval: float = REMINDER_SYNC_INTERVAL):
+        self.deliver = deliver
+        self.path = path
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.schedule = ReminderSchedule()
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._task: Optional[asyncio.Task] = None
+        self._syncer: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        # Изменения файла в этом процессе - по одному
+        self._edit_lock = asyncio.Lock()
+        # Файл блокировки владельца (None - рассылает другой процесс)
+        self._owner_file = None
+        # Версия файла, с которой совпадает schedule
+        self._file_version = None
+        self._dirty = False
+
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    @property
+    def owner(self) -> bool:
+        return self._owner_file is not None
+
+    def start(self):
+        """Загружает расписание и запускает рассылку (из работающего event loop)"""
+        if self._syncer is not None:
+            return
+        self._reload(self._read())
+        self._wake = asyncio.Event()
+        self._try_own()
+        self._syncer = asyncio.create_task(self._sync_loop())
+        logger.info("⏰ Reminder scheduler started: %s reminders", len(self.schedule),
+                    extra={"dry_run": self.dry_run, "owner": self.owner})
+
+    async def stop(self):
+        if self._syncer is None:
+            return
+        for task in (self._task, self._syncer):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = self._syncer = None
+        if self.owner:
+            if self._dirty:
+                await self._edit(lambda: None)
+            self._owner_file.close()
+            self._owner_file = None
+
+    async def set(self, user_id: int, chat_id: int, kind: str, minute: int, utc_offset: float) -> Reminder:
+        reminder = Reminder(user_id, chat_id, kind, minute, utc_offset,
+                            next_occurrence(minute, utc_offset, time.time()))
+        await self._edit(lambda: self.schedule.set(reminder))
+        return reminder
+
+    async def remove(self, user_id: int, kind: Optional[str] = None) -> int:
+        return await self._edit(
+            lambda: sum(self.schedule.remove(user_id, k) for k in ((kind,) if kind else KINDS))
+        )
+
+    async def for_user(self, user_id: int) -> List[Reminder]:
+        await self._sync()
+        return self.schedule.for_user(user_id)
+
+    # ---------- общий файл ----------
+    async def _edit(self, change: Callable[[], Any]) -> Any:
+        """Изменение расписания: под блокировкой файла перечитать его, изменить и записать"""
+        async with self._edit_lock:
+            lock = await asyncio.to_thread(self._lock_file)
+            try:
+                self._reload(await asyncio.to_thread(self._read, self._file_version))
+                result = change()
+                self._dirty = False
+                self._file_version = await asyncio.to_thread(self._write, self.schedule.to_data())
+            finally:
+                lock.close()  # закрытие файла снимает блокировку
+        self._changed()
+        return result
+
+    async def _sync(self):
+        """Перечитывает файл, если его изменил другой процесс"""
+        async with self._edit_lock:
+            self._reload(await asyncio.to_thread(self._read, self._file_version))
+
+    def _reload(self, loaded: Optional[Tuple[Any, List[List]]]):
+        if loaded is None:
+            return
+        self._file_version, data = loaded
+        # Уже отправленное владельцем не должно уйти снова (срок в файле мог еще не обновиться)
+        known = dict(self.schedule.items())
+        self.schedule = ReminderSchedule()
+        self.schedule.load(data, time.time(), known)
+        self._changed()
+
+    def _read(self, known_version=None) -> Optional[Tuple[Any, List[List]]]:
+        """(версия, данные) файла; None - файл не менялся с known_version"""
+        version = _file_version(self.path)
+        if version is not None and version == known_version:
+            return None
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return version, json.load(f)
+        except FileNotFoundError:
+            return version, []
+        except (OSError, ValueError, TypeError) as e:
+            logger.error("⏰ Failed to load reminders from %s: %s", self.path, e)
+            return None
+
+    def _write(self, data: List[List]):
+        """Атомарная запись: временный файл и переименование. Возвращает новую версию файла"""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self._dirty = True
+            logger.error("⏰ Failed to save reminders: %s", e)
+            return self._file_version
+        return _file_version(self.path)
+
+    def _lock_file(self):
+        """Открывает {path}.lock и ждет исключительной блокировки"""
+        lock = open(f"{self.path}.lock", 'a')
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _try_own(self) -> bool:
+        """Пытается стать владельцем рассылки (без ожидания)"""
+        if self.owner:
+            return True
+        owner_file = open(f"{self.path}.owner", 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(owner_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                owner_file.close()
+                return False
+        self._owner_file = owner_file
+        self._task = asyncio.create_task(self._run())
+        logger.info("⏰ Reminder scheduler owns delivery", extra={"pid": os.getpid()})
+        return True
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                if not self._try_own():
+                    await self._sync()
+                elif self._dirty:
+                    # Сроки после отправки - в файл (вместе с изменениями других процессов)
+                    await self._edit(lambda: None)
+                else:
+                    await self._sync()
+            except Exception:
+                # Любая ошибка - до следующей попытки: остановка цикла остановила бы и рассылку
+                logger.exception("⏰ Reminder sync error")
+
+    def _changed(self):
+        metrics.REMINDERS_SCHEDULED.set(len(self.schedule))
+        if self._wake is not None:
+            self._wake.set()
+
+    # ---------- рассылка (только владелец) ----------
+    async def _run(self):
+        while True:
+            next_at = self.schedule.next_at()
+            timeout = None if next_at is None else max(0.0, next_at - time.time())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            batch = self.schedule.pop_due(time.time(), self.batch_size)
+            if batch:
+                self._dirty = True
+                await asyncio.gather(*(self._send(reminder, due) for reminder, due in batch))
+
+    async def _send(self, reminder: Reminder, due: float):
+        async with self._semaphore:
+            outcome = await self._deliver(reminder)
+            if outcome == "sent" or outcome == "dry_run":
+                lag = max(0.0, time.time() - due)
+                self.sent += 1
+                self.lag_total += lag
+                self.lag_max = max(self.lag_max, lag)
+                metrics.REMINDER_LAG_SECONDS.observe(lag)
+            metrics.REMINDERS_SENT.inc(reminder.kind, outcome)
+
+    async def _deliver(self, reminder: Reminder) -> str:
+        if self.dry_run:
+            logger.info("⏰ Reminder (dry run)",
+                        extra={"event": "reminder_dry_run", "kind": reminder.kind, "chat_id": reminder.chat_id})
+            return "dry_run"
+        try:
+            await self.deliver(reminder)
+            return "sent"
+        except Forbidden:
+            # Пользователь заблокировал бота - больше не пишем
+            self.blocked += 1
+            await self.remove(reminder.user_id)
+            return "blocked"
+        except Exception as e:
+            logger.warning("⏰ Reminder not delivered: %s", e, extra={"event": "reminder_failed"})
+            self.failed += 1
+            return "failed"
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self._syncer is not None,
+            "owner": self.owner,
+            "dry_run": self.dry_run,
+            "scheduled": len(self.schedule),
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "lag_avg_s": round(self.lag_total / self.sent, 3) if self.sent else 0.0,
+            "lag_max_s": round(self.lag_max, 3)
+        }
+
+
+def _file_version(path: str):
+    """Версия файла: запись идет через переименование, поэтому меняется inode"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,147 @@
+import os
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from history_packer import pack_history
+from text_normalizer import normalize, tokenize
+
+AI_CACHE_SIZE = int(os.getenv('AI_CACHE_SIZE', 2000))
+AI_CACHE_TTL = float(os.getenv('AI_CACHE_TTL', 3600))
+AI_CACHE_MAX_MESSAGE_CHARS = int(os.getenv('AI_CACHE_MAX_MESSAGE_CHARS', 200))
+
+# Метка на месте имени пользователя в закешированном ответе
+NAME_PLACEHOLDER = "{{name}}"
+
+
+class ResponseCache:
+    """Ограниченный LRU-кеш с временем жизни записей"""
+
+    def __init__(self, maxsize: int = AI_CACHE_SIZE, ttl: float = AI_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, str]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: str):
+        if not self.enabled:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+def mood_bucket(mood_stats: Optional[Dict]) -> Optional[str]:
+    """Грубая оценка настроения - те же пороги, что и в _build_context_prompt"""
+    if not mood_stats or not mood_stats['count']:
+        return None
+    avg_mood = mood_stats['average']
+    if avg_mood < 5:
+        return "low"
+    if avg_mood > 7:
+        return "high"
+    return "mid"
+
+
+def history_fingerprint(history: Optional[List[Dict]], name: Optional[str] = None) -> Optional[str]:
+    """Отпечаток той части истории, которая уходит в запрос (pack_history).
+
+    Имя пользователя заменяется меткой, поэтому одинаковые диалоги разных
+    пользователей дают один отпечаток. "" - истории нет; None - имя не
+    удается надежно убрать (такой запрос не кешируется).
+    """
+    if not history:
+        return ""
+    packed, summary = pack_history(history)
+    text = "\x1f".join([summary or ""] + [message["content"] for message in packed])
+    text = depersonalize(text, name)
+    if text is None:
+        return None
+    return hashlib.blake2b(normalize(text).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def make_cache_key(message: str, context: Optional[Dict] = None) -> Optional[Tuple]:
+    """Ключ кеша: нормализованное сообщение, грубый срез контекста и
+    отпечаток упакованной истории диалога.
+
+    Ответ из кеша выдается только на тот же запрос к DeepSeek: продолжение
+    диалога совпадает лишь при той же недавней истории (например, у
+    типовых начал разговора). Возвращает None для сообщений, которые нельзя
+    кешировать (кризисные, пустые, слишком длинные).
+    """
+    if not message or len(message) > AI_CACHE_MAX_MESSAGE_CHARS:
+        return None
+    context = context or {}
+    if context.get('is_crisis'):
+        return None
+    words = tuple(word for word, _, _ in tokenize(normalize(message)))
+    if not words:
+        return None
+    history = history_fingerprint(context.get('chat_history'), context.get('name'))
+    if history is None:
+        return None
+    return words, bool(context.get('name')), mood_bucket(context.get('mood_stats')), history
+
+
+def depersonalize(response: str, name: Optional[str]) -> Optional[str]:
+    """Заменяет имя пользователя меткой перед сохранением в кеш.
+
+    Возвращает None, если имя нельзя надежно убрать (слишком короткое или
+    встречается в другой форме: "Ане" при имени "Аня") - такой ответ не кешируется,
+    чтобы чужое имя не попало другим пользователям.
+    """
+    if not name:
+        return response
+    if len(name) < 3:
+        return None
+    template = response.replace(name, NAME_PLACEHOLDER)
+    if name[:-1].lower() in template.lower():
+        return None
+    return template
+
+
+def personalize(response: str, name: Optional[str]) -> str:
+    """Подставляет имя пользователя в ответ из кеша"""
+    return response.replace(NAME_PLACEHOLDER, name or "")
@@ -0,0 +1,276 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+from itertools import count
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import httpx
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import metrics
+from rate_limiter import SendShaper
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', 32))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 3))
+# "печатает..." показывается около 5 секунд - чаще повторять незачем
+OUTBOUND_TYPING_INTERVAL = float(os.getenv('OUTBOUND_TYPING_INTERVAL', 4.5))
+# Доля общего лимита, которую рассылки оставляют ответам пользователям
+OUTBOUND_BULK_RESERVE = float(os.getenv('OUTBOUND_BULK_RESERVE', 0.3))
+
+# Полосы приоритета: меньше - раньше
+CRISIS, REPLY, BULK = 0, 1, 2
+LANES = {CRISIS: "crisis", REPLY: "reply", BULK: "bulk"}
+
+# Ошибки httpx, при которых запрос не ушел в Telegram (нет соединения или свободного слота пула)
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class _Job:
+    __slots__ = ('chat_id', 'call', 'lane', 'idempotent', 'future', 'enqueued', 'expires', 'resumed')
+
+    def __init__(self, chat_id: Hashable, call: Callable[[], Awaitable], lane: str, idempotent: bool,
+                 future: asyncio.Future, ttl: Optional[float]):
+        self.chat_id = chat_id
+        self.call = call
+        self.lane = lane
+        self.idempotent = idempotent
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.expires = self.enqueued + ttl if ttl is not None else None
+        # Следующее сообщение занятого чата (чат уже закреплен за ним)
+        self.resumed = False
+
+
+class OutboundPipeline:
+    """Единая очередь исходящих сообщений в Telegram.
+
+    - приоритеты: кризисные ответы уходят раньше обычных, рассылки - последними;
+    - сообщения одного чата отправляются строго по очереди, в порядке
+      приоритета, а разные чаты - параллельно (workers одновременных отправок);
+      воркер отправляет одно сообщение чата и возвращает следующее в общую
+      очередь, поэтому длинная очередь одного чата не задерживает остальных;
+    - общий и початовый лимиты Telegram (SendShaper): отправка ждет токен,
+      рассылки не трогают запас общего лимита (bulk_reserve);
+    - RetryAfter приостанавливает все отправки на указанное время, сетевые
+      ошибки повторяются с нарастающей паузой; BadRequest и Forbidden
+      возвращаются вызывающему сразу;
+    - новое сообщение повторяется, только если запрос точно не ушел (ошибка
+      соединения до отправки): после TimedOut Telegram мог его уже доставить.
+      Идемпотентные вызовы (правка сообщения, "печатает...") повторяются
+      при любой сетевой ошибке;
+    - "печатает..." не отправляется повторно, пока предыдущий еще виден.
+
+    send() возвращает результат вызова (например, отправленное Message).
+    Пока пайплайн не запущен, вызов выполняется сразу, с теми же лимитами и повторами.
+    """
+
+    def __init__(self, workers: int = OUTBOUND_WORKERS, max_retries: int = OUTBOUND_MAX_RETRIES,
+                 shaper: Optional[SendShaper] = None, typing_interval: float = OUTBOUND_TYPING_INTERVAL,
+                 bulk_reserve: float = OUTBOUND_BULK_RESERVE):
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.shaper = shaper or SendShaper()
+        self.typing_interval = typing_interval
+        self.bulk_reserve = bulk_reserve * self.shaper.total.capacity
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._seq = count()
+        # Чаты, в которые сейчас идет отправка -> отложенные сообщения этих чатов
+        self._active: Dict[Hashable, List[Tuple[int, int, _Job]]] = {}
+        self._typing_until: Dict[Hashable, float] = {}
+        self._paused_until = 0.0
+
+        self.sent = 0
+        self.failed = 0
+        self.expired = 0
+        self.retries = 0
+        self.typing_skipped = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Запускает воркеры (вызывается из работающего event loop)"""
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info("📤 Outbound pipeline started: %s workers", self.workers)
+
+    async def stop(self, timeout: float = 10.0):
+        """Дожидается отправки очереди (не дольше timeout) и останавливает воркеры"""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        while (not self._queue.empty() or self._active) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        # Неотправленное - ошибка для ожидающих, а не вечное ожидание
+        left = [item[2] for parked in self._active.values() for item in parked]
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        while not self._queue.empty():
+            left.append(self._queue.get_nowait()[2])
+        for job in left:
+            if not job.future.done():
+                job.future.set_exception(RuntimeError("Outbound pipeline stopped"))
+        self._active.clear()
+        logger.info("📤 Outbound pipeline stopped (%s messages not sent)", len(left))
+
+    async def send(self, chat_id: Hashable, call: Callable[[], Awaitable], priority: int = REPLY,
+                   ttl: Optional[float] = None, idempotent: bool = False) -> Any:
+        """Отправка call() в чат chat_id. ttl - через сколько секунд сообщение
+        устаревает и выбрасывается без отправки (результат None); idempotent -
+        повтор вызова безопасен (например, edit_text), его можно повторять после таймаута"""
+        return await self._submit(chat_id, call, priority, LANES[priority], ttl, idempotent)
+
+    def typing(self, chat_id: Hashable, call: Callable[[], Awaitable]):
+        """Показать "печатает..." (без ожидания; повторы в течение интервала пропускаются)"""
+        now = time.monotonic()
+        if self._typing_until.get(chat_id, 0.0) > now:
+            self.typing_skipped += 1
+            metrics.OUTBOUND_MESSAGES.inc("typing", "skipped")
+            return
+        if len(self._typing_until) > 10000:
+            self._typing_until = {chat: until for chat, until in self._typing_until.items() if until > now}
+        self._typing_until[chat_id] = now + self.typing_interval
+
+        task = asyncio.ensure_future(self._submit(chat_id, call, REPLY, "typing", self.typing_interval / 2, True))
+        task.add_done_callback(_ignore_result)
+
+    def _submit(self, chat_id: Hashable, call: Callable[[], Awaitable], priority: int, lane: str,
+                ttl: Optional[float], idempotent: bool) -> Awaitable:
+        loop = asyncio.get_running_loop()
+        job = _Job(chat_id, call, lane, idempotent, loop.create_future(), ttl)
+        if not self._tasks:
+            return self._run_now(job)
+        self._queue.put_nowait((priority, next(self._seq), job))
+        return job.future
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            job = item[2]
+            parked = self._active.get(job.chat_id)
+            if not job.resumed:
+                if parked is not None:
+                    # В чат уже идет отправка - сообщение подождет своей очереди
+                    heapq.heappush(parked, item)
+                    continue
+                parked = self._active[job.chat_id] = []
+            try:
+                await self._run(job)
+            finally:
+                if parked:
+                    following = heapq.heappop(parked)
+                    following[2].resumed = True
+                    self._queue.put_nowait(following)
+                else:
+                    del self._active[job.chat_id]
+
+    async def _run_now(self, job: _Job) -> Any:
+        await self._run(job)
+        return await job.future
+
+    async def _run(self, job: _Job):
+        """Отправляет сообщение и передает результат (или ошибку) в job.future"""
+        metrics.OUTBOUND_WAIT_SECONDS.observe(time.monotonic() - job.enqueued, job.lane)
+        try:
+            result = await self._attempt(job)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            self.failed += 1
+            metrics.OUTBOUND_MESSAGES.inc(job.lane, "failed")
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        if not job.future.done():
+            job.future.set_result(result)
+
+    async def _attempt(self, job: _Job) -> Any:
+        retried_network = False
+        for attempt in range(self.max_retries + 1):
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0:
+                    break
+                await asyncio.sleep(pause)
+            if job.expires is not None and time.monotonic() > job.expires:
+                self.expired += 1
+                metrics.OUTBOUND_MESSAGES.inc(job.lane, "expired")
+                return None
+
+            await self.shaper.acquire(job.chat_id, self.bulk_reserve if job.lane == "bulk" else 0)
+            try:
+                result = await job.call()
+            except RetryAfter as e:
+                # Флуд-контроль Telegram: ждут все отправки, а не только эта
+                delay = _seconds(e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                reason = "retry_after"
+                if attempt == self.max_retries:
+                    raise
+            except BadRequest as e:
+                if retried_network and "not modified" in str(e).lower():
+                    # Правка после таймаута уже дошла с первой попытки
+                    return None
+                raise
+            except Forbidden:
+                raise
+            except NetworkError as e:
+                if not job.idempotent and not isinstance(e.__cause__, _NOT_SENT_ERRORS):
+                    # Запрос мог дойти до Telegram - повтор продублировал бы сообщение
+                    raise
+                delay = min(30.0, 2 ** attempt * 0.5 + random.random() * 0.5)
+                reason = "network"
+                retried_network = True
+                if attempt == self.max_retries:
+                    raise
+            else:
+                self.sent += 1
+                metrics.OUTBOUND_MESSAGES.inc(job.lane, "sent")
+                if job.lane != "typing":
+                    # Сообщение скрывает "печатает..." - следующее можно показать сразу
+                    self._typing_until.pop(job.chat_id, None)
+                return result
+
+            self.retries += 1
+            metrics.OUTBOUND_RETRIES.inc(reason)
+            logger.warning("📤 Send retry in %.1fs (%s)", delay, reason,
+                           extra={"event": "outbound_retry", "lane": job.lane})
+            if reason == "network":
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "active_chats": len(self._active),
+            "parked": sum(len(parked) for parked in self._active.values()),
+            "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            "sent": self.sent,
+            "failed": self.failed,
+            "expired": self.expired,
+            "retries": self.retries,
+            "typing_skipped": self.typing_skipped,
+            "shaper": self.shaper.stats()
+        }
+
+
+def _seconds(retry_after) -> float:
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+def _ignore_result(task: asyncio.Future):
+    if not task.cancelled():
+        task.exception()
@@ -0,0 +1,360 @@
+import os
+import time
+import queue
+import asyncio
+import hashlib
+import logging
+import importlib
+import threading
+import multiprocessing
+from bisect import bisect, insort
+from itertools import count
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from update_queue import UpdateQueue
+
+logger = logging.getLogger(__name__)
+
+# Виртуальных узлов на процесс: больше - ровнее распределение чатов
+SHARD_VNODES = int(os.getenv('SHARD_VNODES', 160))
+# Сколько необработанных обновлений может висеть на одном процессе
+SHARD_MAX_PENDING = int(os.getenv('SHARD_MAX_PENDING', 1000))
+# Асинхронных воркеров внутри процесса (чаты процесса обрабатываются параллельно)
+SHARD_CONCURRENCY = int(os.getenv('SHARD_CONCURRENCY', os.getenv('UPDATE_QUEUE_WORKERS', 8)))
+SHARD_CHECK_INTERVAL = float(os.getenv('SHARD_CHECK_INTERVAL', 1.0))
+# Сколько ждать показателей процессов для /metrics и статистики
+SHARD_STATS_TIMEOUT = float(os.getenv('SHARD_STATS_TIMEOUT', 2.0))
+
+# Служебное сообщение в очереди процесса: запрос показателей (вместо chat_id)
+_STATS = "__shard_stats__"
+
+
+class HashRing:
+    """Консистентное хеширование: ключ -> узел.
+
+    Каждый узел занимает vnodes точек на кольце; ключ принадлежит первой
+    точке по часовой стрелке. При добавлении или удалении узла переезжает
+    только ~1/N ключей, остальные чаты остаются на своих процессах.
+    """
+
+    def __init__(self, nodes: Iterable[Hashable] = (), vnodes: int = SHARD_VNODES):
+        self.vnodes = max(1, vnodes)
+        self._points: List[Tuple[int, Hashable]] = []
+        self._hashes: List[int] = []
+        self._nodes: List[Hashable] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key) -> int:
+        return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'big')
+
+    @property
+    def nodes(self) -> List[Hashable]:
+        return list(self._nodes)
+
+    def add(self, node: Hashable):
+        if node in self._nodes:
+            return
+        self._nodes.append(node)
+        for replica in range(self.vnodes):
+            insort(self._points, (self._hash(f"{node}#{replica}"), node))
+        self._hashes = [point for point, _ in self._points]
+
+    def remove(self, node: Hashable):
+        if node not in self._nodes:
+            return
+        self._nodes.remove(node)
+        self._points = [point for point in self._points if point[1] != node]
+        self._hashes = [point for point, _ in self._points]
+
+    def node_for(self, key: Hashable) -> Hashable:
+        if not self._points:
+            raise LookupError("Hash ring is empty")
+        index = bisect(self._hashes, self._hash(key)) % len(self._points)
+        return self._points[index][1]
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+
+class _Worker:
+    __slots__ = ('index', 'process', 'inbox', 'pending', 'processed', 'restarts')
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.inbox = None
+        self.pending = 0
+        self.processed = 0
+        self.restarts = 0
+
+
+class ShardPool:
+    """Распределение обновлений по процессам по chat_id.
+
+    Чат всегда попадает в один и тот же процесс (консистентное хеширование),
+    поэтому состояние пользователя и порядок его сообщений остаются в одном
+    месте, а кризисный анализ и вызовы ИИ разных чатов идут на разных ядрах.
+
+    Процесс-обработчик импортирует app_module и вызывает его функции
+    start_shard(), process_shard_update(update), shard_stats() и stop_shard().
+    Обработка идет в процессах пула, поэтому и их показатели там:
+    collect_stats() собирает shard_stats() всех процессов через те же очереди.
+
+    Число процессов задается при создании и не меняется: хранилище memory
+    у каждого процесса свое, и переезд чата на другой процесс потерял бы
+    его состояние. Упавший процесс перезапускается под тем же номером.
+    """
+
+    def __init__(self, app_module: str, workers: int,
+                 max_pending: int = SHARD_MAX_PENDING, concurrency: int = SHARD_CONCURRENCY,
+                 vnodes: int = SHARD_VNODES):
+        self.app_module = app_module
+        self.size = max(1, workers)
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+        self.ring = HashRing(vnodes=vnodes)
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: Dict[int, _Worker] = {}
+        self._acks = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ack_thread: Optional[threading.Thread] = None
+        self._supervisor: Optional[asyncio.Task] = None
+        # Запрос показателей -> (ответы по процессам, сколько ждем, событие "все ответили")
+        self._stats_requests: Dict[int, Tuple[Dict[int, Any], int, asyncio.Event]] = {}
+        self._request_ids = count()
+
+        # chat_id -> [процесс, необработанные обновления]
+        self._chats: Dict[Hashable, List[int]] = {}
+
+        self.submitted = 0
+        self.dropped = 0
+        self.lost = 0
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    def start(self):
+        """Запускает процессы (вызывается из работающего event loop)"""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._acks = self._context.Queue()
+        self._ack_thread = threading.Thread(target=self._read_acks, name="shard-acks", daemon=True)
+        self._ack_thread.start()
+        for index in range(self.size):
+            self._spawn(index)
+            self.ring.add(index)
+        self._supervisor = asyncio.create_task(self._supervise())
+        logger.info("🧩 Shard pool started: %s processes", self.size)
+
+    def _spawn(self, index: int):
+        worker = self._workers.get(index) or _Worker(index)
+        worker.inbox = self._context.Queue()
+        worker.process = self._context.Process(
+            target=_worker_main, name=f"shard-{index}", daemon=True,
+            args=(self.app_module, index, worker.inbox, self._acks, self.concurrency)
+        )
+        worker.process.start()
+        self._workers[index] = worker
+
+    def submit(self, chat_id: Hashable, update: Any) -> bool:
+        """Отправляет обновление процессу чата. False - процесс перегружен"""
+        owner = self.ring.node_for(chat_id)
+        worker = self._workers[owner]
+        if worker.pending >= self.max_pending:
+            self.dropped += 1
+            logger.warning("🧩 Shard overloaded, dropping update",
+                           extra={"event": "shard_drop", "shard": owner, "chat_id": chat_id})
+            return False
+
+        self.submitted += 1
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = [owner, 0]
+        chat[1] += 1
+        worker.pending += 1
+        worker.inbox.put((chat_id, update))
+        return True
+
+    def _read_acks(self):
+        while True:
+            ack = self._acks.get()
+            loop = self._loop
+            if ack is None or loop is None:
+                return
+            handler = self._stats_reply if ack[1] == _STATS else self._done
+            try:
+                loop.call_soon_threadsafe(handler, *ack)
+            except RuntimeError:
+                return  # event loop уже закрыт
+
+    async def collect_stats(self, timeout: float = SHARD_STATS_TIMEOUT) -> Dict[int, Any]:
+        """Показатели процессов пула: номер -> shard_stats() процесса.
+        Процессы, не ответившие за timeout, в результат не попадают"""
+        if self._loop is None:
+            return {}
+        workers = [worker for worker in self._workers.values() if worker.process.is_alive()]
+        if not workers:
+            return {}
+        request_id = next(self._request_ids)
+        replies: Dict[int, Any] = {}
+        answered = asyncio.Event()
+        self._stats_requests[request_id] = (replies, len(workers), answered)
+        try:
+            for worker in workers:
+                worker.inbox.put((_STATS, request_id))
+            await asyncio.wait_for(answered.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("🧩 Shard stats timed out", extra={"event": "shard_stats_timeout",
+                                                               "answered": len(replies), "expected": len(workers)})
+        finally:
+            del self._stats_requests[request_id]
+        return dict(sorted(replies.items()))
+
+    def _stats_reply(self, index: int, _: str, request_id: int, stats: Any):
+        request = self._stats_requests.get(request_id)
+        if request is None:
+            return  # ответ опоздал
+        replies, expected, answered = request
+        replies[index] = stats
+        if len(replies) >= expected:
+            answered.set()
+
+    def _done(self, index: int, chat_id: Hashable):
+        worker = self._workers.get(index)
+        if worker is not None:
+            worker.pending = max(0, worker.pending - 1)
+            worker.processed += 1
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            return
+        chat[1] -= 1
+        if chat[1] <= 0:
+            del self._chats[chat_id]
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(SHARD_CHECK_INTERVAL)
+            for worker in list(self._workers.values()):
+                if worker.process.is_alive():
+                    continue
+                logger.error("🧩 Shard %s died (exit code %s), restarting", worker.index, worker.process.exitcode)
+                worker.restarts += 1
+                self._spawn(worker.index)
+                self._forget_worker(worker.index)
+
+    def _forget_worker(self, index: int):
+        """Процесс завершился: его необработанные обновления потеряны"""
+        worker = self._workers.get(index)
+        if worker is not None:
+            worker.pending = 0
+        for chat_id in [chat_id for chat_id, (owner, _) in self._chats.items() if owner == index]:
+            self.lost += self._chats.pop(chat_id)[1]
+
+    async def wait_idle(self, timeout: float = 10.0) -> bool:
+        """Ждет, пока все отправленные обновления будут обработаны"""
+        deadline = time.monotonic() + timeout
+        while self._chats and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+        return not self._chats
+
+    async def stop(self, timeout: float = 10.0):
+        """Дожидается обработки отправленных обновлений и останавливает процессы"""
+        if self._loop is None:
+            return
+        await self.wait_idle(timeout)
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+        for worker in self._workers.values():
+            worker.inbox.put(None)
+        for worker in self._workers.values():
+            await asyncio.to_thread(worker.process.join, timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        # Поток подтверждений завершается до сброса _loop - иначе он может обратиться к None
+        self._acks.put(None)
+        await asyncio.to_thread(self._ack_thread.join, timeout)
+        self._loop = None
+        logger.info("🧩 Shard pool stopped (%s updates left unprocessed)", sum(c[1] for c in self._chats.values()))
+
+    def stats(self) -> Dict:
+        return {
+            "processes": self.size,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "lost": self.lost,
+            "active_chats": len(self._chats),
+            "shards": {
+                index: {
+                    "pid": worker.process.pid if worker.process else None,
+                    "pending": worker.pending,
+                    "processed": worker.processed,
+                    "restarts": worker.restarts
+                }
+                for index, worker in sorted(self._workers.items())
+            }
+        }
+
+
+def _worker_main(app_module: str, index: int, inbox, acks, concurrency: int):
+    """Точка входа процесса-обработчика"""
+    # Процесс-обработчик сам не шардирует
+    os.environ['SHARD_WORKERS'] = '0'
+    os.environ['SHARD_INDEX'] = str(index)
+    app = importlib.import_module(app_module)
+    asyncio.run(_serve(app, index, inbox, acks, concurrency))
+
+
+async def _serve(app, index: int, inbox, acks, concurrency: int):
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+
+    async def process(item):
+        chat_id, update = item
+        try:
+            await app.process_shard_update(update)
+        finally:
+            acks.put((index, chat_id))
+
+    # Пул ограничивает нагрузку сам (max_pending), здесь очередь только упорядочивает чаты
+    updates = UpdateQueue(process, concurrency, maxsize=10 ** 9)
+
+    def enqueue(item):
+        updates.submit(item[0], item)
+
+    def report(request_id: int):
+        # Показатели отвечают сразу, не дожидаясь очереди обновлений
+        try:
+            stats = app.shard_stats()
+        except Exception as e:
+            logger.error("🧩 Shard %s stats error: %s", index, e)
+            stats = {"error": str(e)}
+        stats["queue"] = updates.stats()
+        acks.put((index, _STATS, request_id, stats))
+
+    def read_inbox():
+        while True:
+            try:
+                item = inbox.get()
+            except (EOFError, OSError, queue.Empty):
+                item = None
+            if item is None:
+                loop.call_soon_threadsafe(stopped.set)
+                return
+            if item[0] == _STATS:
+                loop.call_soon_threadsafe(report, item[1])
+                continue
+            loop.call_soon_threadsafe(enqueue, item)
+
+    await app.start_shard()
+    updates.start()
+    threading.Thread(target=read_inbox, name="shard-inbox", daemon=True).start()
+    logger.info("🧩 Shard %s ready (pid %s)", index, os.getpid())
+
+    await stopped.wait()
+    await updates.stop(timeout=30.0)
+    await app.stop_shard()
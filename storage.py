@@ -0,0 +1,309 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'memory').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'mindmate.db')
+SQLITE_FLUSH_INTERVAL = float(os.getenv('SQLITE_FLUSH_INTERVAL', 0.5))
+SQLITE_BATCH_SIZE = int(os.getenv('SQLITE_BATCH_SIZE', 200))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_PREFIX = os.getenv('REDIS_PREFIX', 'mindmate')
+
+
+def _json_default(value):
+    """Сериализация объектов с методом to_data() (например, MoodSeries)"""
+    if hasattr(value, 'to_data'):
+        return value.to_data()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False, default=_json_default)
+
+
+def new_user_record(name: Optional[str]) -> Dict:
+    """Создает запись нового пользователя"""
+    return {
+        "mood_history": [],
+        "name": name,
+        "joined_date": datetime.now().isoformat(),
+        "in_chat_mode": False,
+        "chat_history": []
+    }
+
+
+class UserStore:
+    """Базовое хранилище состояния пользователей.
+
+    Обработчики читают запись через get/get_or_create, изменяют ее
+    и сохраняют обратно через save, перечисляя измененные поля.
+
+    Запись хранится по полям: save пишет только переданные поля, create
+    не трогает уже существующую запись. Поэтому несколько процессов
+    (воркеры uvicorn с общим sqlite/redis) могут менять одного
+    пользователя одновременно: изменения разных полей не затирают друг
+    друга, при изменении одного поля остается последнее.
+    """
+
+    async def get(self, user_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def save(self, user_id: int, data: Dict, fields: Optional[Iterable[str]] = None):
+        """Сохраняет поля fields записи data (None - все поля записи)"""
+        raise NotImplementedError
+
+    async def create(self, user_id: int, data: Dict):
+        """Сохраняет новую запись, если записи пользователя еще нет"""
+        raise NotImplementedError
+
+    async def count(self) -> int:
+        raise NotImplementedError
+
+    async def get_or_create(self, user_id: int, name: Optional[str] = None) -> Dict:
+        """Возвращает запись пользователя, создавая ее при первом обращении"""
+        data = await self.get(user_id)
+        if data is None:
+            data = new_user_record(name)
+            await self.create(user_id, data)
+        return data
+
+    async def start(self):
+        """Запуск фоновых задач бэкенда (если есть)"""
+
+    async def close(self):
+        """Сохранение несохраненных данных и освобождение ресурсов"""
+
+
+class MemoryUserStore(UserStore):
+    """Хранилище в памяти процесса (данные теряются при перезапуске)"""
+
+    def __init__(self):
+        self._data: Dict[int, Dict] = {}
+
+    async def get(self, user_id: int) -> Optional[Dict]:
+        return self._data.get(user_id)
+
+    async def save(self, user_id: int, data: Dict, fields: Optional[Iterable[str]] = None):
+        self._data[user_id] = data
+
+    async def create(self, user_id: int, data: Dict):
+        self._data.setdefault(user_id, data)
+
+    async def count(self) -> int:
+        return len(self._data)
+
+
+class SQLiteUserStore(UserStore):
+    """Хранилище на диске в SQLite (режим WAL, пакетная запись).
+
+    Запись пользователя - JSON в одной строке; сохранение меняет в нем
+    только измененные поля (json_set в UPSERT), поэтому процессы с общим
+    файлом не затирают поля друг друга. Изменения копятся в буфере и
+    записываются одной транзакцией раз в flush_interval секунд или при
+    накоплении batch_size записей. Чтение накладывает на строку из базы
+    буфер и записываемую пачку, поэтому несохраненные изменения сразу
+    видны, в том числе пока идет запись.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH, flush_interval: float = SQLITE_FLUSH_INTERVAL,
+                 batch_size: int = SQLITE_BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        import sqlite3  # только для этого бэкенда - не замедляет запуск остальных
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+        # Новые записи (user_id -> JSON) и измененные поля (user_id -> поле -> JSON значения)
+        self._new: Dict[int, str] = {}
+        self._dirty: Dict[int, Dict[str, str]] = {}
+        # Пачка, которая сейчас пишется в потоке (до COMMIT в базе еще старые данные)
+        self._inflight: Tuple[Dict[int, str], Dict[int, Dict[str, str]]] = ({}, {})
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        logger.info("💾 SQLite user store: %s", path)
+
+    async def start(self):
+        if self._flush_task is None:
+            self._wakeup = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def get(self, user_id: int) -> Optional[Dict]:
+        # Буферы - до чтения: пачка, записанная во время чтения, уже в снимке
+        inflight_new, inflight_fields = self._inflight
+        new = self._new.get(user_id) or inflight_new.get(user_id)
+        fields = {**inflight_fields.get(user_id, {}), **self._dirty.get(user_id, {})}
+        raw = await asyncio.to_thread(self._read, user_id)
+        if raw is None:
+            raw = new
+        if raw is None and not fields:
+            return None
+        data = json.loads(raw) if raw is not None else {}
+        data.update((field, json.loads(value)) for field, value in fields.items())
+        return data
+
+    async def save(self, user_id: int, data: Dict, fields: Optional[Iterable[str]] = None):
+        changed = self._dirty.setdefault(user_id, {})
+        for field in data if fields is None else fields:
+            changed[field] = dumps(data.get(field))
+        await self._written()
+
+    async def create(self, user_id: int, data: Dict):
+        self._new.setdefault(user_id, dumps(data))
+        await self._written()
+
+    async def _written(self):
+        if self._flush_task is None:
+            # Фоновая запись не запущена - пишем сразу
+            await self.flush()
+        elif len(self._new) + len(self._dirty) >= self.batch_size:
+            self._wakeup.set()
+
+    async def count(self) -> int:
+        await self.flush()
+        return await asyncio.to_thread(self._count)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        async with self._flush_lock:
+            if not self._new and not self._dirty:
+                return
+            new, fields = self._inflight = self._new, self._dirty
+            self._new, self._dirty = {}, {}
+            try:
+                await asyncio.to_thread(self._write_batch, new, fields)
+            except Exception as e:
+                logger.error("💾 SQLite flush error: %s", e)
+                # Возвращаем в буфер то, что не было перезаписано новыми изменениями
+                for user_id, raw in new.items():
+                    self._new.setdefault(user_id, raw)
+                for user_id, changed in fields.items():
+                    pending = self._dirty.setdefault(user_id, {})
+                    for field, value in changed.items():
+                        pending.setdefault(field, value)
+            finally:
+                self._inflight = ({}, {})
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        with self._lock:
+            self._conn.close()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def _read(self, user_id: int) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def _count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def _write_batch(self, new: Dict[int, str], fields: Dict[int, Dict[str, str]]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO users (user_id, data) VALUES (?, ?) ON CONFLICT(user_id) DO NOTHING",
+                    new.items()
+                )
+                # Поле меняется внутри JSON строки - остальные поля остаются как есть в базе
+                self._conn.executemany(
+                    "INSERT INTO users (user_id, data) VALUES (:user_id, json_set('{}', :path, json(:value))) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = json_set(users.data, :path, json(:value))",
+                    ({"user_id": user_id, "path": f'$."{field}"', "value": value}
+                     for user_id, changed in fields.items() for field, value in changed.items())
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+class RedisUserStore(UserStore):
+    """Хранилище в Redis или любом совместимом сервере (KeyDB, Dragonfly и т.п.).
+
+    Запись пользователя - хеш: поле записи -> JSON значения. save пишет
+    только измененные поля (HSET), create - только отсутствующие (HSETNX).
+    """
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX, client=None):
+        """client - готовый клиент redis.asyncio (или совместимый, например в тестах)"""
+        if client is None:
+            try:
+                import redis.asyncio as aioredis
+            except ImportError:  # Redis - необязательная зависимость
+                raise RuntimeError("Redis backend requires the 'redis' package")
+            client = aioredis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._redis = client
+        self._users_key = f"{prefix}:users"
+        logger.info("💾 Redis user store", extra={"prefix": prefix})
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:user:{user_id}"
+
+    async def get(self, user_id: int) -> Optional[Dict]:
+        raw = await self._redis.hgetall(self._key(user_id))
+        return {field: json.loads(value) for field, value in raw.items()} if raw else None
+
+    async def save(self, user_id: int, data: Dict, fields: Optional[Iterable[str]] = None):
+        mapping = {field: dumps(data.get(field)) for field in (data if fields is None else fields)}
+        if not mapping:
+            return
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hset(self._key(user_id), mapping=mapping)
+            pipe.sadd(self._users_key, user_id)
+            await pipe.execute()
+
+    async def create(self, user_id: int, data: Dict):
+        key = self._key(user_id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for field, value in data.items():
+                pipe.hsetnx(key, field, dumps(value))
+            pipe.sadd(self._users_key, user_id)
+            await pipe.execute()
+
+    async def count(self) -> int:
+        return await self._redis.scard(self._users_key)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_user_store(backend: str = STORAGE_BACKEND) -> UserStore:
+    """Создает хранилище по имени бэкенда: memory, sqlite или redis"""
+    if backend == 'sqlite':
+        return SQLiteUserStore()
+    if backend == 'redis':
+        return RedisUserStore()
+    if backend != 'memory':
+        logger.warning("⚠️ Unknown storage backend '%s', using memory", backend)
+    return MemoryUserStore()
@@ -0,0 +1,27 @@
+"""Минимальное приложение для процессов ShardPool в тестах"""
+import random
+import asyncio
+
+processed = []
+# chat_id -> номера обновлений чата в порядке обработки
+chats = {}
+
+
+async def start_shard():
+    pass
+
+
+async def process_shard_update(update):
+    if "seq" in update:
+        # Случайная задержка: без очереди по чатам обновления обогнали бы друг друга
+        await asyncio.sleep(random.random() * 0.003)
+        chats.setdefault(update["chat_id"], []).append(update["seq"])
+    processed.append(update)
+
+
+def shard_stats():
+    return {"processed": len(processed), "chats": chats}
+
+
+async def stop_shard():
+    pass
@@ -0,0 +1,85 @@
+import asyncio
+
+from ai_service import SYSTEM_PROMPT, DeepSeekService, ResponseCleaner
+from history_packer import AI_HISTORY_TOKEN_BUDGET, AI_SUMMARY_TOKEN_BUDGET, estimate_tokens, message_tokens
+
+
+def turn(i: int, size: int = 40) -> dict:
+    return {"user": f"сообщение {i} " + "тревожно " * size, "ai": f"ответ {i} " + "понимаю " * size}
+
+
+def test_request_history_stays_within_budget():
+    service = DeepSeekService()
+    context = {"name": "Аня", "chat_history": [turn(i) for i in range(500)]}
+    messages = service._build_messages("мне тревожно", context)
+
+    # Неизменный системный промпт - первым, новое сообщение - последним
+    assert messages[0] == {"role": "system", "content": SYSTEM_PROMPT}
+    assert messages[-1]["role"] == "user" and "мне тревожно" in messages[-1]["content"]
+    summary = messages[1]
+    assert summary["role"] == "system" and estimate_tokens(summary["content"]) <= AI_SUMMARY_TOKEN_BUDGET
+
+    history = [message for message in messages if message["role"] in ("user", "assistant")][:-1]
+    assert history and sum(message_tokens(message) for message in history) <= AI_HISTORY_TOKEN_BUDGET
+    assert history[-1]["content"].startswith("ответ 499 ")
+    # Сведения о пользователе - после истории, чтобы не сбивать кешируемый префикс
+    assert messages[-2] == {"role": "system", "content": "Имя пользователя: Аня"}
+
+
+def test_request_size_does_not_grow_with_history():
+    service = DeepSeekService()
+
+    def request_tokens(turns: int) -> int:
+        messages = service._build_messages("привет", {"chat_history": [turn(i) for i in range(turns)]})
+        return sum(message_tokens(message) for message in messages)
+
+    # Системный промпт, сообщение пользователя и служебные токены - сверх бюджетов истории и сводки
+    fixed = request_tokens(0)
+    ceiling = fixed + AI_HISTORY_TOKEN_BUDGET + AI_SUMMARY_TOKEN_BUDGET
+    assert request_tokens(100) <= ceiling
+    assert request_tokens(10000) <= ceiling
+    assert len(service._build_messages("привет", {"chat_history": [turn(1)]})) == 4
+    assert len(service._build_messages("привет", None)) == 2
+
+
+def stream_pieces(service: DeepSeekService, deltas) -> list:
+    async def fake_api(message, context=None):
+        for delta in deltas:
+            yield delta
+
+    async def collect():
+        return [piece async for piece in service.get_ai_response_stream("мне тревожно", {"is_crisis": False})]
+
+    service.api_key = "test"
+    service._stream_deepseek_api = fake_api
+    return asyncio.run(collect())
+
+
+def test_stream_is_cleaned_like_the_full_response():
+    deltas = ["Как искусст", "венный интеллект, я могу ", "сказать, что  **попробуй", "те** дыхание\n\n",
+              "*4-7-8*:   вдох на 4 счета ", "и медленный выдох 🌿"]
+    pieces = stream_pieces(DeepSeekService(), deltas)
+
+    # Шаблонная фраза, разрезанная между частями, не показывается даже частично
+    assert not any("интеллект" in piece for piece in pieces)
+    assert len(pieces) > 1
+    assert "".join(pieces) == DeepSeekService()._clean_response("".join(deltas))
+    assert "".join(pieces).startswith("**попробуйте** дыхание *4-7-8*: вдох")
+
+
+def test_cleaner_waits_while_start_matches_a_phrase():
+    cleaner = ResponseCleaner()
+    assert cleaner.feed("Я понимаю") == ""
+    assert cleaner.has_content
+    assert cleaner.feed(" тебя") == "Я понимаю тебя"
+    assert cleaner.feed(",   правда ") == ", правда"
+    assert cleaner.feed("\n") == ""
+    assert cleaner.feed("очень понимаю и хочу помочь") == " очень понимаю и хочу помочь"
+    assert cleaner.finish() == ""
+
+
+def test_empty_stream_falls_back():
+    service = DeepSeekService()
+    pieces = stream_pieces(service, ["", "   "])
+    assert len(pieces) == 1 and pieces[0]
+    assert service.circuit.stats()["error_rate"] == 1.0
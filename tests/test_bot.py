@@ -0,0 +1,198 @@
+import re
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram import KeyboardButton, ReplyKeyboardMarkup  # noqa: E402
+from telegram.error import BadRequest  # noqa: E402
+
+import bot  # noqa: E402
+from crisis_handler import QUICK_HELP_TEXT, crisis_handler, escape_markdown  # noqa: E402
+from rate_limiter import SendShaper  # noqa: E402
+from send_pipeline import OutboundPipeline  # noqa: E402
+from storage import MemoryUserStore  # noqa: E402
+
+
+class FakeMessage:
+    """Отправленное сообщение: запоминает редактирования, Markdown проверяет как Telegram - по парам"""
+
+    def __init__(self, text):
+        self.versions = [(text, None)]
+
+    async def edit_text(self, text, parse_mode=None):
+        if parse_mode == 'Markdown' and text.count('*') % 2:
+            raise BadRequest("Can't parse entities: can't find end of the entity")
+        self.versions.append((text, parse_mode))
+
+
+class FakeUpdate:
+    def __init__(self):
+        self.sent = []
+        self.effective_chat = SimpleNamespace(id=1)
+        self.message = SimpleNamespace(reply_text=self.reply_text)
+
+    async def reply_text(self, text, **kwargs):
+        message = FakeMessage(text)
+        self.sent.append(message)
+        return message
+
+
+@pytest.fixture
+def streaming(monkeypatch):
+    """Поток ответа ИИ из заданных частей; часы сдвигаются на секунду на каждую часть"""
+    clock = [0.0]
+
+    def stream(pieces):
+        async def fake_stream(message, context):
+            for piece in pieces:
+                clock[0] += 1.0
+                yield piece
+        monkeypatch.setattr(bot.ai_service, "get_ai_response_stream", fake_stream)
+
+    monkeypatch.setattr(bot.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(bot, "outbound", OutboundPipeline(shaper=SendShaper(per_second=0, chat_per_minute=0)))
+    monkeypatch.setattr(bot, "STREAM_EDIT_INTERVAL", 1.0)
+    monkeypatch.setattr(bot, "STREAM_MIN_CHARS", 5)
+    return stream
+
+
+def test_stream_sends_first_piece_then_edits(streaming):
+    streaming(["Привет", "!", " Давай попробуем", " *дыхание 4-7-8*", " вместе."])
+    update = FakeUpdate()
+    text = asyncio.run(bot.stream_ai_reply(update, "мне тревожно", {}))
+
+    assert text == "Привет! Давай попробуем *дыхание 4-7-8* вместе."
+    assert len(update.sent) == 1
+    versions = update.sent[0].versions
+    assert versions[0] == ("🤖 Помощник:\n\nПривет", None)
+    # Прирост в один символ не редактируется; промежуточные версии - без разметки
+    assert versions[1] == ("🤖 Помощник:\n\nПривет! Давай попробуем", None)
+    assert all(mode is None for _, mode in versions[1:-1])
+    assert versions[-1] == (f"🤖 *Помощник:*\n\n{text}", 'Markdown')
+
+
+def test_stream_with_unbalanced_markdown_ends_as_plain_text(streaming):
+    streaming(["Попробуй ", "*дыхание", " животом и расслабься"])
+    update = FakeUpdate()
+    text = asyncio.run(bot.stream_ai_reply(update, "мне тревожно", {}))
+
+    versions = update.sent[0].versions
+    assert versions[-1] == (f"🤖 Помощник:\n\n{text}", None)
+    assert all(mode is None for _, mode in versions)
+
+
+def test_single_piece_is_sent_without_edits(streaming):
+    streaming(["Я рядом 🤗"])
+    update = FakeUpdate()
+    asyncio.run(bot.stream_ai_reply(update, "привет", {}))
+    assert update.sent[0].versions == [("🤖 Помощник:\n\nЯ рядом 🤗", None), ("🤖 *Помощник:*\n\nЯ рядом 🤗", 'Markdown')]
+
+
+def markdown_is_balanced(text: str) -> bool:
+    """Разметка parse_mode='Markdown' закрыта: *, _ и ` парные (экранированные не считаются)"""
+    text = re.sub(r'\\[_*`\[]', '', text)
+    return all(text.count(mark) % 2 == 0 for mark in '*_`')
+
+
+KEYBOARDS = {
+    "MAIN_KEYBOARD": [
+        ["📊 Записать настроение", "🧘 Техники релаксации"],
+        ["💫 Позитивные аффирмации", "📈 Моя статистика"],
+        ["💬 Чат с ИИ-помощником", "🚨 Кризисная помощь"],
+        ["ℹ️ Помощь"],
+    ],
+    "MOOD_KEYBOARD": [
+        ["1 😫", "2 😔", "3 😟"], ["4 😐", "5 🙂", "6 😊"], ["7 😄", "8 🤩", "9 🥰"], ["10 🎉", "↩️ Назад"],
+    ],
+    "CHAT_MODE_KEYBOARD": [
+        ["🔄 Новый вопрос", "🚨 Кризисная помощь"], ["↩️ В главное меню"],
+    ],
+}
+
+
+@pytest.mark.parametrize("name", KEYBOARDS)
+def test_precomputed_keyboard_serializes_like_a_fresh_one(name):
+    keyboard = getattr(bot, name)
+    fresh = ReplyKeyboardMarkup([[KeyboardButton(label) for label in row] for row in KEYBOARDS[name]],
+                                resize_keyboard=True)
+    assert keyboard == fresh
+    assert keyboard.to_dict() == fresh.to_dict()
+    assert json.loads(keyboard.to_json()) == json.loads(fresh.to_json())
+
+
+@pytest.mark.parametrize("name", KEYBOARDS)
+def test_every_button_has_a_route(name):
+    for row in KEYBOARDS[name]:
+        for label in row:
+            assert label in bot.router, label
+
+
+def test_prepared_texts_are_valid_markdown():
+    texts = [bot.HELP_TEXT, bot.MOOD_PROMPT_TEXT, bot.CHAT_MODE_TEXT, bot.NEW_QUESTION_TEXT,
+             bot.START_TEMPLATE.format(name=escape_markdown("Ann_Marie *")),
+             *bot.RELAXATION_TEXTS, *bot.AFFIRMATION_TEXTS, QUICK_HELP_TEXT]
+    texts += [response for responses in crisis_handler._responses.values() for response in responses]
+    for text in texts:
+        assert markdown_is_balanced(text), text
+
+
+def test_prepared_texts_match_their_sources():
+    assert bot.RELAXATION_TEXTS == [bot.render_relaxation_technique(t) for t in bot.RELAXATION_TECHNIQUES]
+    assert [text.split("\n\n", 1)[1] for text in bot.AFFIRMATION_TEXTS] == bot.POSITIVE_AFFIRMATIONS
+    techniques = crisis_handler.crisis_resources["self_help_techniques"]
+    assert crisis_handler._responses[1] == [crisis_handler._render_response(1, t) for t in techniques]
+    for level in (2, 3):
+        assert crisis_handler.get_crisis_response_by_level(level) == crisis_handler._render_response(level)
+    assert crisis_handler.get_crisis_response() == crisis_handler._render_response(2)
+
+
+class ReplyUpdate(FakeUpdate):
+    """Обновление от пользователя: запоминает аргументы ответов"""
+
+    def __init__(self, text=""):
+        super().__init__()
+        self.replies = []
+        self.effective_user = SimpleNamespace(id=1, first_name="Ann_Marie")
+        self.message.text = text
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append((text, kwargs))
+        return await super().reply_text(text)
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    monkeypatch.setattr(bot, "outbound", OutboundPipeline(shaper=SendShaper(per_second=0, chat_per_minute=0)))
+    monkeypatch.setattr(bot, "user_store", MemoryUserStore())
+
+    def call(handler, text=""):
+        update = ReplyUpdate(text)
+        asyncio.run(handler(update, None))
+        return update.replies
+
+    return call
+
+
+def test_handlers_send_the_prepared_replies(handlers):
+    [(text, kwargs)] = handlers(bot.help_command)
+    assert text is bot.HELP_TEXT and kwargs["parse_mode"] == 'Markdown'
+
+    [(text, kwargs)] = handlers(bot.relax_command)
+    assert text in bot.RELAXATION_TEXTS
+
+    [(text, kwargs)] = handlers(bot.affirmation_command)
+    assert text in bot.AFFIRMATION_TEXTS
+
+    [(text, kwargs)] = handlers(bot.mood_command)
+    assert text is bot.MOOD_PROMPT_TEXT and kwargs["reply_markup"] is bot.MOOD_KEYBOARD
+
+    [(text, kwargs)] = handlers(bot.chat_command)
+    assert text is bot.CHAT_MODE_TEXT and kwargs["reply_markup"] is bot.CHAT_MODE_KEYBOARD
+
+    [(text, kwargs)] = handlers(bot.start)
+    assert "Ann\\_Marie" in text and markdown_is_balanced(text)
+    assert kwargs["reply_markup"] is bot.MAIN_KEYBOARD
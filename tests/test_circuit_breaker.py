@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+
+from circuit_breaker import CircuitBreaker
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", min_requests=1, open_seconds=0)
+    breaker.record_failure(0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow_request()  # пробный вызов
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    return breaker
+
+
+def test_cancelled_probe_releases_half_open_slot():
+    breaker = half_open_breaker()
+    assert not breaker.allow_request()
+
+    breaker.record_cancelled()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancel_outside_half_open_is_ignored():
+    breaker = CircuitBreaker("test")
+    breaker.record_cancelled()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["window_requests"] == 0
+
+
+@pytest.fixture
+def service(monkeypatch):
+    pytest.importorskip("httpx")
+    import ai_service
+
+    service = ai_service.DeepSeekService()
+    service.api_key = "test"
+    service.circuit = half_open_breaker()
+    # Пробный слот уже занят half_open_breaker - вернем его, вызов займет снова
+    service.circuit.record_cancelled()
+    monkeypatch.setattr(ai_service, "AI_HEDGE_TIMEOUT_MS", 10)
+    return service
+
+
+def test_hedged_call_cancel_during_half_open(service):
+    async def hang(message, context):
+        await asyncio.sleep(60)
+
+    service._call_deepseek_api = hang
+
+    async def scenario():
+        assert service._acquire_call_slot()
+        assert await service._hedged_call("привет", {}, None) is None
+        await asyncio.sleep(0)  # отмена доходит до _guarded_call
+        assert service.circuit._probes_in_flight == 0
+        assert service.in_flight.stats()["in_flight"] == 0
+        assert service.circuit.allow_request()
+
+    asyncio.run(scenario())
+
+
+def test_aborted_stream_during_half_open(service):
+    async def stream(message, context):
+        yield "Первая часть ответа, достаточно длинная. "
+        await asyncio.sleep(60)
+        yield "не дойдет"
+
+    service._stream_deepseek_api = stream
+
+    async def scenario():
+        chunks = service.get_ai_response_stream("привет", {})
+        await chunks.__anext__()
+        started = time.monotonic()
+        await chunks.aclose()
+        assert time.monotonic() - started < 1
+        assert service.circuit._probes_in_flight == 0
+        assert service.circuit.allow_request()
+
+    asyncio.run(scenario())
@@ -0,0 +1,43 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timezone
+
+from crisis_audit import CrisisAuditLog, segment_name
+
+JANUARY = datetime(2024, 1, 31, 23, 59, tzinfo=timezone.utc).timestamp()
+FEBRUARY = datetime(2024, 2, 1, 0, 1, tzinfo=timezone.utc).timestamp()
+
+
+def rows(directory, ts):
+    with sqlite3.connect(directory / segment_name(ts)) as conn:
+        return conn.execute("SELECT user_id FROM events ORDER BY id").fetchall()
+
+
+def test_failed_segment_requeues_only_its_rows(tmp_path):
+    log = CrisisAuditLog(directory=str(tmp_path), alert_url="")
+    for user_id, ts in ((1, JANUARY), (2, JANUARY), (3, FEBRUARY)):
+        log.record(user_id, 2, "не хочу жить")["ts"] = ts
+
+    # Сегмент февраля не открывается с первой попытки
+    open_segment = log._open_segment
+    broken = {segment_name(FEBRUARY)}
+
+    def flaky(name):
+        if name in broken:
+            broken.discard(name)
+            raise OSError("disk full")
+        return open_segment(name)
+
+    log._open_segment = flaky
+
+    async def scenario():
+        await log.flush()
+        assert [event["user_id"] for event in log._pending] == [3]
+        assert log.written == 2 and log.failed_batches == 1
+        await log.flush()
+        assert log._pending == [] and log.written == 3
+        await log.stop()
+
+    asyncio.run(scenario())
+    assert rows(tmp_path, JANUARY) == [(1,), (2,)]
+    assert rows(tmp_path, FEBRUARY) == [(3,)]
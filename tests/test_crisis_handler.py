@@ -0,0 +1,63 @@
+import pytest
+
+from crisis_handler import crisis_handler
+
+# Уровни, которые давал прежний поиск подстрок, - морфологический индекс не должен их терять
+BASELINE_LEVELS = [
+    ("порезать себя", 3),
+    ("перерезать вены", 3),
+    ("хочу резать вены", 3),
+    ("я порежусь", 3),
+    ("думаю про суицид", 3),
+    ("хочу покончить с этим", 3),
+    ("я не хочу жить", 2),
+    ("все кончено", 2),
+    ("больше не могу", 2),
+    ("все пропало", 2),
+    ("все плохо", 1),
+    ("нет сил", 1),
+    ("сильная тревога", 1),
+    ("привет, как дела?", 0),
+    ("спасибо за совет", 0),
+]
+
+# Те же намерения в других формах: подстроки их не находили
+SELF_HARM = [
+    "порезала себя",
+    "режу себя",
+    "опять режу себя по ночам",
+    "порезала себе руку",
+    "перерезала вены",
+    "хочу вскрыть вены",
+    "Порежу себя",
+]
+
+NOT_CRISIS = [
+    "бесполезная кнопка",
+    "это бесполезный совет",
+    "бесполезные уведомления",
+    "кнопка сломалась",
+    "режим сна сбился",
+    "нарезать салат",
+    "режу овощи",
+]
+
+
+@pytest.mark.parametrize("message, level", BASELINE_LEVELS)
+def test_baseline_levels_kept(message, level):
+    assert crisis_handler.scan(message)[0] == level
+
+
+@pytest.mark.parametrize("message", SELF_HARM)
+def test_self_harm_is_acute(message):
+    assert crisis_handler.scan(message)[0] == 3
+
+
+@pytest.mark.parametrize("message", NOT_CRISIS)
+def test_ordinary_words_are_not_crisis(message):
+    assert crisis_handler.scan(message)[0] == 0
+
+
+def test_bespolezno_only_in_exact_form():
+    assert crisis_handler.scan("все бесполезно")[0] == 2
+    assert crisis_handler.scan("Бесполезно!")[0] == 2
@@ -0,0 +1,59 @@
+from history_packer import estimate_tokens, message_tokens, pack_history
+from response_cache import NAME_PLACEHOLDER, make_cache_key
+
+
+def turn(i: int, size: int = 200) -> dict:
+    return {"user": f"сообщение {i} " + "тревожно " * size, "ai": f"ответ {i} " + "понимаю " * size}
+
+
+def packed_tokens(packed) -> int:
+    return sum(message_tokens(message) for message in packed)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("a" * 400) == 100
+    assert estimate_tokens("я" * 250) == 100
+    # Смешанный текст не дешевле своей латинской части
+    assert estimate_tokens("hello мир") >= estimate_tokens("hello ")
+
+
+def test_long_history_stays_within_budget():
+    history = [turn(i, size=20) for i in range(1000)]
+    packed, summary = pack_history(history, budget=1200, summary_budget=150)
+
+    assert packed and packed_tokens(packed) <= 1200
+    # Самые свежие реплики в хронологическом порядке
+    assert packed[-1]["content"].startswith("ответ 999 ")
+    assert packed[-2]["content"].startswith("сообщение 999 ")
+    assert summary and estimate_tokens(summary) <= 150
+
+
+def test_oversized_turn_is_not_sent():
+    history = [turn(1, size=5), turn(2, size=5000)]
+    packed, summary = pack_history(history, budget=1200, summary_budget=150)
+
+    assert packed == []
+    assert summary and estimate_tokens(summary) <= 150
+    assert "сообщение 2" in summary
+
+
+def test_cache_key_depends_on_packed_history():
+    history = [{"user": "привет, Аня тут", "ai": "Привет, Аня! Как ты?"}]
+    key = make_cache_key("мне тревожно", {"name": "Аня", "chat_history": history})
+    assert key is not None
+    assert key == make_cache_key("мне тревожно", {"name": "Аня", "chat_history": list(history)})
+    assert key != make_cache_key("мне тревожно", {"name": "Аня"})
+
+    # Тот же разговор у другого пользователя - тот же ключ
+    other = [{"user": "привет, Олег тут", "ai": "Привет, Олег! Как ты?"}]
+    assert key == make_cache_key("мне тревожно", {"name": "Олег", "chat_history": other})
+
+    changed = history + [{"user": "все плохо", "ai": "Я рядом"}]
+    assert key != make_cache_key("мне тревожно", {"name": "Аня", "chat_history": changed})
+    assert NAME_PLACEHOLDER not in repr(key)
+
+
+def test_cache_key_skips_history_with_inflected_name():
+    history = [{"user": "привет", "ai": "Рада слышать, Ане сегодня лучше?"}]
+    assert make_cache_key("мне тревожно", {"name": "Аня", "chat_history": history}) is None
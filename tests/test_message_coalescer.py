@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+from message_coalescer import MessageCoalescer
+
+
+def run_scenario(fragments, window=0.2, reply_time=0.3):
+    """Отправляет фрагменты [(задержка, текст)] в один чат; возвращает пачки и время их начала"""
+    flushed = []
+
+    async def flush(key, items):
+        flushed.append((time.monotonic() - started, list(items)))
+        await asyncio.sleep(reply_time)
+
+    async def scenario():
+        coalescer = MessageCoalescer(flush, window=window, max_wait=5, max_messages=5)
+        for delay, text in fragments:
+            await asyncio.sleep(delay)
+            coalescer.add(1, text)
+        await asyncio.sleep(0)
+        await coalescer.stop()
+
+    started = time.monotonic()
+    asyncio.run(scenario())
+    return flushed
+
+
+def test_first_message_is_not_delayed():
+    flushed = run_scenario([(0, "привет")])
+    assert [items for _, items in flushed] == [["привет"]]
+    assert flushed[0][0] < 0.05
+
+
+def test_messages_during_reply_are_coalesced():
+    flushed = run_scenario([(0, "мне"), (0.05, "сегодня"), (0.05, "тревожно")])
+    assert [items for _, items in flushed] == [["мне"], ["сегодня", "тревожно"]]
+    # Вторая пачка ждет ответа на первую, а не лишнее окно после него
+    assert flushed[1][0] < 0.45
+
+
+def test_quiet_chat_after_reply_is_not_delayed():
+    flushed = run_scenario([(0, "раз"), (0.5, "два")], reply_time=0.1)
+    assert [items for _, items in flushed] == [["раз"], ["два"]]
+    assert flushed[1][0] - 0.5 < 0.05
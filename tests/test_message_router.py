@@ -0,0 +1,19 @@
+from message_router import ModeCache
+
+
+def test_mode_cache_lru():
+    cache = ModeCache(maxsize=2)
+    cache.set(1, True)
+    cache.set(2, False)
+    assert cache.get(1) is True
+    cache.set(3, True)  # вытесняет 2 - к нему обращались раньше всех
+    assert cache.get(2) is None
+    assert cache.get(3) is True
+    assert cache.stats()["hits"] == 2
+
+
+def test_disabled_mode_cache_always_reads_the_store():
+    cache = ModeCache(maxsize=0)
+    cache.set(1, True)
+    assert cache.get(1) is None
+    assert cache.stats() == {"enabled": False, "size": 0, "hits": 0, "misses": 0, "hit_rate": 0.0}
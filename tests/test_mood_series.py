@@ -0,0 +1,34 @@
+from datetime import datetime, timezone
+
+from mood_series import MoodSeries
+
+
+def utc(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def test_days_and_profiles_use_one_offset():
+    series = MoodSeries(utc_offset=3)
+    # 22:30 UTC понедельника - 01:30 вторника по Москве
+    series.add(4, utc(2024, 1, 1, 22, 30))
+    assert series.hour_counts[1] == 1 and series.weekday_counts[1] == 1
+
+    # Следующий московский день - серия продолжается, а не начинается в тот же день
+    series.add(6, utc(2024, 1, 2, 21, 30))
+    assert series.streak == 2
+    assert series.current_streak(utc(2024, 1, 3, 20, 0)) == 2
+    assert [avg for _, avg in series.daily_window(7, utc(2024, 1, 3, 20, 0))] == [4, 6]
+
+
+def test_offset_survives_round_trip():
+    series = MoodSeries(utc_offset=5.5)
+    series.add(7, utc(2024, 1, 1, 20, 0))
+    restored = MoodSeries.from_data(series.to_data())
+    assert restored.utc_offset == 5.5
+    assert list(restored.hour_counts) == list(series.hour_counts)
+    assert restored.streak == 1
+
+    # Пояс пользователя из /remind применяется к следующим записям
+    moved = MoodSeries.from_data(series.to_data(), utc_offset=-4)
+    moved.add(5, utc(2024, 1, 2, 2, 0))
+    assert moved.hour_counts[22] == 1
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import InFlightLimiter, RateLimiter, SendShaper
+
+
+def test_burst_then_limited():
+    limiter = RateLimiter(burst=3, per_minute=60)
+    assert [limiter.allow("u", now=0) for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow("other", now=0)
+    assert limiter.stats()["limited"] == 1
+
+
+def test_refill():
+    limiter = RateLimiter(burst=2, per_minute=60)  # токен в секунду
+    assert limiter.allow(1, now=0) and limiter.allow(1, now=0)
+    assert not limiter.allow(1, now=0.5)
+    assert limiter.wait_time(1, now=0.5) == pytest.approx(0.5)
+    assert limiter.allow(1, now=1.0)
+    # Пополнение не превышает запас
+    assert limiter.wait_time(1, now=100, need=2) == 0
+    assert limiter.allow(1, now=100) and limiter.allow(1, now=100)
+    assert not limiter.allow(1, now=100)
+
+
+def test_idle_buckets_are_evicted():
+    limiter = RateLimiter(burst=2, per_minute=60, max_buckets=2)
+    limiter.allow(1, now=0)
+    limiter.allow(2, now=0)
+    limiter.allow(3, now=0)  # сверх max_buckets - вытесняет самую давнюю
+    assert limiter.stats()["buckets"] == 2
+    limiter.allow(4, now=10)  # остальные простояли дольше полного пополнения
+    assert limiter.stats()["buckets"] == 1
+
+
+@pytest.mark.parametrize("burst, per_minute", [(0, 60), (5, 0), (5, -1)])
+def test_zero_limit_means_unlimited(burst, per_minute):
+    limiter = RateLimiter(burst=burst, per_minute=per_minute)
+    assert not limiter.enabled
+    assert all(limiter.allow("u", now=0) for _ in range(100))
+    assert limiter.wait_time("u", now=0, need=10) == 0
+
+
+def test_in_flight_cap():
+    limiter = InFlightLimiter(limit=2)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+    assert limiter.stats() == {"limit": 2, "in_flight": 2, "max_in_flight": 2, "rejected": 1}
+
+
+def test_in_flight_without_limit():
+    limiter = InFlightLimiter(limit=0)
+    assert all(limiter.try_acquire() for _ in range(100))
+    limiter.release()
+    assert limiter.in_flight == 99
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+
+    async def sleep(delay):
+        now[0] += delay
+
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", sleep)
+    return now
+
+
+def test_send_shaper_waits_for_chat_tokens(clock):
+    shaper = SendShaper(per_second=100, chat_per_minute=60, chat_burst=2)
+
+    async def send(count):
+        for _ in range(count):
+            await shaper.acquire(1)
+
+    asyncio.run(send(4))
+    # Два сообщения из запаса, еще два - по секунде на каждое
+    assert clock[0] == pytest.approx(1002.0)
+    assert shaper.stats()["waited_seconds"] == 2.0
+
+
+def test_send_shaper_keeps_reserve(clock):
+    shaper = SendShaper(per_second=4, chat_per_minute=0)
+    asyncio.run(shaper.acquire(1))
+    asyncio.run(shaper.acquire(2))
+    started = clock[0]
+    # Фоновой отправке нужен запас из двух токенов сверх своего - осталось два, ждем
+    asyncio.run(shaper.acquire(3, reserve=2))
+    assert clock[0] - started == pytest.approx(0.25)
+
+
+def test_send_shaper_without_limits(clock):
+    shaper = SendShaper(per_second=0, chat_per_minute=0)
+    asyncio.run(shaper.acquire(1))
+    assert shaper.stats()["waited_seconds"] == 0
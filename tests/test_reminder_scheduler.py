@@ -0,0 +1,89 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from reminder_scheduler import ReminderScheduler  # noqa: E402
+
+
+def test_one_owner_sends_and_any_process_edits(tmp_path):
+    path = str(tmp_path / "reminders.json")
+    with open(path, "w") as f:
+        json.dump([[1, 10, "mood", 9 * 60, 3.0, time.time() - 1]], f)
+
+    delivered = {"first": [], "second": []}
+
+    def deliver(name):
+        async def send(reminder):
+            delivered[name].append(reminder.user_id)
+        return send
+
+    async def scenario():
+        # Два процесса с общим файлом (блокировки flock различают открытые файлы и в одном процессе)
+        first = ReminderScheduler(deliver("first"), path, sync_interval=0.05)
+        second = ReminderScheduler(deliver("second"), path, sync_interval=0.05)
+        first.start()
+        second.start()
+        assert first.owner and not second.owner
+
+        await asyncio.sleep(0.2)
+        assert delivered == {"first": [1], "second": []}
+
+        # /remind во втором процессе: владелец видит изменения, уже отправленное не повторяет
+        await second.set(2, 20, "affirmation", 20 * 60, 5.0)
+        await asyncio.sleep(0.2)
+        assert [r.user_id for r in await first.for_user(2)] == [2]
+        assert delivered["first"] == [1]
+
+        await second.remove(1)
+        await asyncio.sleep(0.2)
+        assert await first.for_user(1) == []
+
+        # Владелец остановился - рассылку забирает другой процесс
+        await first.stop()
+        await asyncio.sleep(0.2)
+        assert second.owner
+        assert [r.user_id for r in await second.for_user(2)] == [2]
+        await second.stop()
+
+    asyncio.run(scenario())
+
+
+def test_corrupt_rows_are_skipped_and_sync_keeps_running(tmp_path):
+    path = str(tmp_path / "reminders.json")
+    with open(path, "w") as f:
+        json.dump([[1, 10, "mood", 9 * 60, 3.0, time.time() + 3600]], f)
+
+    async def deliver(reminder):
+        pass
+
+    async def scenario():
+        first = ReminderScheduler(deliver, path, sync_interval=0.05)
+        second = ReminderScheduler(deliver, path, sync_interval=0.05)
+        first.start()
+        second.start()
+
+        # Другая версия бота или ручная правка оставила в файле битые строки
+        with open(path, "w") as f:
+            json.dump([[1, 10, "mood", 9 * 60, 3.0, time.time() + 3600],
+                       [2, 20, "mood", "09:00", 3.0, 0],
+                       [3, 30, "unknown", 60, 0, 0],
+                       [4, 40],
+                       "garbage"], f)
+        await asyncio.sleep(0.2)
+        assert [r.user_id for r in await second.for_user(1)] == [1]
+        assert await second.for_user(2) == []
+
+        # Цикл синхронизации жив: следующее изменение файла доходит до владельца
+        await second.set(5, 50, "affirmation", 20 * 60, 0.0)
+        await asyncio.sleep(0.2)
+        assert [r.user_id for r in await first.for_user(5)] == [5]
+        assert first._syncer is not None and not first._syncer.done()
+
+        await second.stop()
+        await first.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+httpx = pytest.importorskip("httpx")
+
+from telegram.error import BadRequest, NetworkError, TimedOut  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+from rate_limiter import SendShaper  # noqa: E402
+from send_pipeline import OutboundPipeline  # noqa: E402
+
+
+def failing(*errors, result="ok"):
+    """Вызов, который сначала бросает errors по одной, затем возвращает result"""
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return call, calls
+
+
+def telegram_error(httpx_error):
+    """Ошибка, которую python-telegram-bot выдает, когда httpx бросает httpx_error"""
+    def transport(request):
+        raise httpx_error("boom", request=request)
+
+    async def attempt():
+        request = HTTPXRequest()
+        request._client = httpx.AsyncClient(transport=httpx.MockTransport(transport))
+        try:
+            await request.do_request("https://api.telegram.org/botTOKEN/sendMessage", "POST")
+        except NetworkError as e:
+            return e
+        finally:
+            await request._client.aclose()
+
+    error = asyncio.run(attempt())
+    assert isinstance(error.__cause__, httpx_error)
+    return error
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    monkeypatch.setattr("send_pipeline.random.random", lambda: 0.0)
+    monkeypatch.setattr("send_pipeline.asyncio.sleep", _no_sleep)
+    return OutboundPipeline(shaper=SendShaper(per_second=0))
+
+
+async def _no_sleep(delay):
+    pass
+
+
+def test_timed_out_send_is_not_retried(pipeline):
+    call, calls = failing(telegram_error(httpx.ReadTimeout))
+    with pytest.raises(TimedOut):
+        run(pipeline.send(1, call))
+    assert len(calls) == 1
+
+
+def test_send_retried_when_connection_failed_before_writing(pipeline):
+    call, calls = failing(telegram_error(httpx.ConnectError), telegram_error(httpx.PoolTimeout),
+                          telegram_error(httpx.ConnectTimeout))
+    assert run(pipeline.send(1, call)) == "ok"
+    assert len(calls) == 4
+
+
+def test_send_not_retried_after_connection_broke_mid_request(pipeline):
+    call, calls = failing(telegram_error(httpx.ReadError))
+    with pytest.raises(NetworkError):
+        run(pipeline.send(1, call))
+    assert len(calls) == 1
+
+
+def test_idempotent_edit_retried_after_timeout(pipeline):
+    call, calls = failing(telegram_error(httpx.ReadTimeout))
+    assert run(pipeline.send(1, call, idempotent=True)) == "ok"
+    assert len(calls) == 2
+
+
+def test_edit_that_landed_before_timeout(pipeline):
+    call, calls = failing(telegram_error(httpx.ReadTimeout), BadRequest("Message is not modified"))
+    assert run(pipeline.send(1, call, idempotent=True)) is None
+    assert len(calls) == 2
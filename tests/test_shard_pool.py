@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from shard_pool import HashRing, ShardPool
+
+
+def test_collect_stats_and_stop():
+    async def scenario():
+        pool = ShardPool("shard_app", 2)
+        pool.start()
+        for chat_id in range(20):
+            assert pool.submit(chat_id, {"update_id": chat_id})
+        assert await pool.wait_idle(30)
+
+        shards = await pool.collect_stats(timeout=30)
+        assert sorted(shards) == [0, 1]
+        assert sum(stats["processed"] for stats in shards.values()) == 20
+        assert all(stats["queue"]["workers"] > 0 for stats in shards.values())
+
+        await pool.stop()
+        # Поток подтверждений завершен до сброса event loop
+        assert not pool._ack_thread.is_alive()
+        assert not pool.running
+        assert await pool.collect_stats() == {}
+
+    asyncio.run(scenario())
+
+
+def test_hash_ring_placement_is_stable():
+    ring = HashRing(range(4))
+    assert [ring.node_for(key) for key in range(1000)] == [HashRing(range(4)).node_for(key) for key in range(1000)]
+    assert set(ring.node_for(key) for key in range(1000)) == {0, 1, 2, 3}
+
+
+def test_hash_ring_moves_keys_only_to_the_added_node():
+    before, after = HashRing(range(4)), HashRing(range(5))
+    moved = [key for key in range(10000) if before.node_for(key) != after.node_for(key)]
+    assert all(after.node_for(key) == 4 for key in moved)
+    assert 0.1 < len(moved) / 10000 < 0.3  # в идеале 1/5
+
+    after.remove(4)
+    assert all(after.node_for(key) == before.node_for(key) for key in range(10000))
+
+
+def test_empty_hash_ring():
+    with pytest.raises(LookupError):
+        HashRing().node_for(1)
+
+
+def test_chat_stays_on_its_shard_in_order():
+    async def scenario():
+        pool = ShardPool("shard_app", 3, concurrency=8)
+        pool.start()
+        for seq in range(1, 21):
+            for chat_id in range(30):
+                assert pool.submit(chat_id, {"chat_id": chat_id, "seq": seq})
+        assert await pool.wait_idle(60)
+        shards = await pool.collect_stats(timeout=30)
+        await pool.stop()
+        return pool, shards
+
+    pool, shards = asyncio.run(scenario())
+    seen = {}
+    for index, stats in shards.items():
+        for chat_id, seqs in stats["chats"].items():
+            assert chat_id not in seen, "чат обработан в двух процессах"
+            assert pool.ring.node_for(chat_id) == index
+            seen[chat_id] = seqs
+    assert seen == {chat_id: list(range(1, 21)) for chat_id in range(30)}
@@ -0,0 +1,195 @@
+import json
+import asyncio
+import threading
+
+from storage import RedisUserStore, SQLiteUserStore
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_sqlite_read_during_flush_sees_inflight_batch(tmp_path):
+    async def scenario():
+        store = SQLiteUserStore(str(tmp_path / "users.db"), flush_interval=60)
+        await store.save(1, {"v": 1})
+        await store.start()  # save() только кладет в буфер
+
+        # Запись следующей пачки зависает в потоке до release
+        entered, release = threading.Event(), threading.Event()
+        write_batch = store._write_batch
+
+        def slow_write(new, fields):
+            entered.set()
+            release.wait(5)
+            write_batch(new, fields)
+
+        store._write_batch = slow_write
+        store._dirty[1] = {"v": "2"}
+        flush = asyncio.create_task(store.flush())
+        await asyncio.to_thread(entered.wait, 5)
+
+        # Пока пачка не закоммичена, в базе еще {"v": 1}
+        assert await store.get(1) == {"v": 2}
+        data = await store.get(1)
+        data["w"] = 3
+        await store.save(1, data)
+
+        release.set()
+        await flush
+        await store.flush()
+        assert json.loads(store._read(1)) == {"v": 2, "w": 3}
+        await store.close()
+
+    run(scenario())
+
+
+def test_sqlite_failed_flush_keeps_batch(tmp_path):
+    async def scenario():
+        store = SQLiteUserStore(str(tmp_path / "users.db"))
+
+        def broken(new, fields):
+            raise RuntimeError("disk full")
+
+        write_batch, store._write_batch = store._write_batch, broken
+        await store.save(1, {"v": 1})
+        assert await store.get(1) == {"v": 1}
+
+        store._write_batch = write_batch
+        await store.flush()
+        assert json.loads(store._read(1)) == {"v": 1}
+        await store.close()
+
+    run(scenario())
+
+
+def test_sqlite_two_stores_keep_each_others_fields(tmp_path):
+    async def scenario():
+        # Два процесса с общим файлом: каждый прочитал запись до изменения другим
+        path = str(tmp_path / "users.db")
+        first, second = SQLiteUserStore(path), SQLiteUserStore(path)
+        await first.get_or_create(1, "Аня")
+        a, b = await first.get(1), await second.get(1)
+
+        a["chat_history"].append({"user": "привет", "ai": "здравствуй"})
+        b["in_chat_mode"] = True
+        await first.save(1, a, ("chat_history",))
+        await second.save(1, b, ("in_chat_mode",))
+
+        # Запоздавшее создание записи другим процессом ее не затирает
+        await second.create(1, {"name": "Аня", "chat_history": [], "in_chat_mode": False})
+
+        for store in (first, second):
+            data = await store.get(1)
+            assert data["chat_history"] == [{"user": "привет", "ai": "здравствуй"}]
+            assert data["in_chat_mode"] is True
+            assert data["name"] == "Аня"
+        await first.close()
+        await second.close()
+
+    run(scenario())
+
+
+def test_sqlite_buffered_fields_overlay_the_row(tmp_path):
+    async def scenario():
+        store = SQLiteUserStore(str(tmp_path / "users.db"), flush_interval=60)
+        await store.start()
+        await store.create(1, {"name": "Аня", "utc_offset": None})
+        await store.save(1, {"utc_offset": 3.0}, ("utc_offset",))
+        assert await store.get(1) == {"name": "Аня", "utc_offset": 3.0}
+        assert store._read(1) is None
+
+        await store.flush()
+        assert json.loads(store._read(1)) == {"name": "Аня", "utc_offset": 3.0}
+        await store.close()
+
+    run(scenario())
+
+
+class FakeRedis:
+    """Локальная замена redis.asyncio: только команды, которые использует RedisUserStore"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.sets = {}
+        self.closed = False
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def scard(self, key):
+        return len(self.sets.get(key, ()))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def hset(self, key, mapping):
+        self.commands.append(lambda: self.redis.hashes.setdefault(key, {}).update(mapping))
+
+    def hsetnx(self, key, field, value):
+        self.commands.append(lambda: self.redis.hashes.setdefault(key, {}).setdefault(field, value))
+
+    def sadd(self, key, member):
+        self.commands.append(lambda: self.redis.sets.setdefault(key, set()).add(str(member)))
+
+    async def execute(self):
+        for command in self.commands:
+            command()
+
+
+def test_redis_store_round_trip():
+    async def scenario():
+        client = FakeRedis()
+        store = RedisUserStore(prefix="test", client=client)
+        assert await store.get(1) is None
+
+        data = await store.get_or_create(1, "Аня")
+        data["mood_history"] = [[1700000000, 7]]
+        await store.save(1, data)
+        await store.save(2, {"name": "Борис"})
+
+        assert (await store.get(1))["mood_history"] == [[1700000000, 7]]
+        assert client.hashes["test:user:1"]["name"] == '"Аня"'
+        assert await store.count() == 2
+        await store.close()
+        assert client.closed
+
+    run(scenario())
+
+
+def test_redis_two_stores_keep_each_others_fields():
+    async def scenario():
+        client = FakeRedis()
+        first, second = RedisUserStore(prefix="test", client=client), RedisUserStore(prefix="test", client=client)
+        await first.get_or_create(1, "Аня")
+        a, b = await first.get(1), await second.get(1)
+
+        a["chat_history"].append({"user": "привет", "ai": "здравствуй"})
+        b["in_chat_mode"] = True
+        await first.save(1, a, ("chat_history",))
+        await second.save(1, b, ("in_chat_mode",))
+        await second.create(1, {"name": "Борис", "chat_history": [], "utc_offset": 3.0})
+
+        data = await first.get(1)
+        assert data["chat_history"] == [{"user": "привет", "ai": "здравствуй"}]
+        assert data["in_chat_mode"] is True
+        # create дописывает только отсутствующие поля
+        assert (data["name"], data["utc_offset"]) == ("Аня", 3.0)
+        assert await first.count() == 1
+
+    run(scenario())
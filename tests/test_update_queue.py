@@ -0,0 +1,99 @@
+import random
+import asyncio
+
+from update_queue import UpdateQueue
+
+
+def test_chat_updates_are_processed_in_order():
+    async def scenario():
+        seen = {}
+        active = set()
+
+        async def process(update):
+            chat_id, seq = update
+            assert chat_id not in active, "два воркера в одном чате"
+            active.add(chat_id)
+            await asyncio.sleep(random.random() * 0.002)
+            seen.setdefault(chat_id, []).append(seq)
+            active.discard(chat_id)
+
+        queue = UpdateQueue(process, workers=8)
+        queue.start()
+        for seq in range(20):
+            for chat_id in range(10):
+                assert queue.submit(chat_id, (chat_id, seq))
+        await queue.stop(timeout=10)
+        return seen, queue.stats()
+
+    seen, stats = asyncio.run(scenario())
+    assert seen == {chat_id: list(range(20)) for chat_id in range(10)}
+    assert stats["processed"] == 200 and stats["depth"] == 0 and stats["active_chats"] == 0
+
+
+def test_slow_chat_does_not_block_others():
+    async def scenario():
+        release = asyncio.Event()
+        done = []
+
+        async def process(update):
+            if update == "slow":
+                await release.wait()
+            done.append(update)
+
+        queue = UpdateQueue(process, workers=2)
+        queue.start()
+        queue.submit(1, "slow")
+        queue.submit(1, "after slow")
+        queue.submit(2, "fast")
+        await asyncio.sleep(0.05)
+        assert done == ["fast"]
+        release.set()
+        await queue.stop(timeout=5)
+        return done
+
+    assert asyncio.run(scenario()) == ["fast", "slow", "after slow"]
+
+
+def test_full_queue_drops_updates():
+    async def scenario():
+        release = asyncio.Event()
+        done = []
+
+        async def process(update):
+            await release.wait()
+            done.append(update)
+
+        queue = UpdateQueue(process, workers=1, maxsize=3)
+        queue.start()
+        await asyncio.sleep(0)
+        accepted = [queue.submit(chat_id, chat_id) for chat_id in range(5)]
+        stats = queue.stats()
+        release.set()
+        await queue.stop(timeout=5)
+        return accepted, stats, done
+
+    accepted, stats, done = asyncio.run(scenario())
+    assert accepted == [True, True, True, False, False]
+    assert (stats["depth"], stats["dropped"], stats["max_depth"]) == (3, 2, 3)
+    assert done == [0, 1, 2]
+
+
+def test_failing_update_does_not_stop_the_chat():
+    async def scenario():
+        done = []
+
+        async def process(update):
+            if update == "bad":
+                raise ValueError("boom")
+            done.append(update)
+
+        queue = UpdateQueue(process, workers=1)
+        queue.start()
+        for update in ("first", "bad", "last"):
+            queue.submit(1, update)
+        await queue.stop(timeout=5)
+        return done, queue.stats()
+
+    done, stats = asyncio.run(scenario())
+    assert done == ["first", "last"]
+    assert (stats["processed"], stats["failed"]) == (2, 1)
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from webhook_fastpath import peek_update
+
+CHAT = {"id": 42, "type": "private"}
+SENDER = {"id": 7, "is_bot": False, "first_name": "Аня"}
+
+
+def body(**update):
+    return json.dumps({"update_id": 100, **update}).encode()
+
+
+def test_message_is_handled():
+    head = peek_update(body(message={"message_id": 1, "chat": CHAT, "from": SENDER, "text": "привет"}))
+    assert (head.update_id, head.kind, head.chat_id, head.text) == (100, "message", 42, "привет")
+    assert head.handled
+    assert head.payload["message"]["text"] == "привет"
+
+
+def test_message_without_text_is_not_handled():
+    head = peek_update(body(message={"message_id": 1, "chat": CHAT, "sticker": {}}))
+    assert head.chat_id == 42
+    assert head.text is None
+    assert not head.handled
+
+
+def test_edited_message_is_not_handled():
+    head = peek_update(body(edited_message={"message_id": 1, "chat": CHAT, "text": "исправила"}))
+    assert (head.kind, head.chat_id) == ("edited_message", 42)
+    assert not head.handled
+
+
+def test_callback_query_takes_chat_of_the_message():
+    head = peek_update(body(callback_query={"id": "1", "from": SENDER, "data": "mood_5",
+                                            "message": {"message_id": 3, "chat": CHAT}}))
+    assert (head.kind, head.chat_id) == ("callback_query", 42)
+    assert not head.handled
+
+
+def test_update_without_chat_falls_back_to_sender_then_update_id():
+    head = peek_update(body(inline_query={"id": "1", "from": SENDER, "query": "", "offset": ""}))
+    assert (head.kind, head.chat_id) == ("inline_query", 7)
+    head = peek_update(body(poll={"id": "1", "question": "?", "options": []}))
+    assert (head.kind, head.chat_id) == ("poll", 100)
+
+
+def test_unknown_update_type_is_other():
+    head = peek_update(body(some_future_update={"chat": CHAT}))
+    assert (head.kind, head.chat_id) == ("other", 42)
+
+
+def test_dict_body_is_not_parsed_again():
+    payload = {"update_id": 1, "message": {"chat": CHAT, "text": "/start"}}
+    assert peek_update(payload).payload is payload
+
+
+@pytest.mark.parametrize("raw", [b"[]", b"42", b'{"update_id": 1}', b'{"update_id": 1, "message": "text"}'])
+def test_body_that_is_not_an_update(raw):
+    assert peek_update(raw) is None
+
+
+@pytest.mark.parametrize("raw", [b"", b"{", b'{"update_id": 1,', b"\xff"])
+def test_malformed_json_raises(raw):
+    with pytest.raises(ValueError):
+        peek_update(raw)
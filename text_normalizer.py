@@ -0,0 +1,192 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import List, Tuple
+
+# Невидимые и служебные символы, которыми разбивают слова
+_INVISIBLE = dict.fromkeys(map(ord, '­​‌‍⁠﻿᠎'), None)
+
+# Латинские буквы и цифры, похожие на кириллические (применяются только к словам с кириллицей)
+_HOMOGLYPHS = str.maketrans({
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м',
+    'n': 'п', 'o': 'о', 'p': 'р', 'r': 'г', 't': 'т', 'u': 'и', 'x': 'х', 'y': 'у',
+    '0': 'о', '3': 'з', '4': 'ч', '6': 'б'
+})
+
+# Символы-разделители внутри слова: "пове*шусь", "по-ве-шусь"
+_INNER_SEPARATORS = re.compile(r'(?<=\w)[-*_·|\'`~]+(?=\w)')
+# Точка склеивает только отдельные буквы ("у.м.р.у"); между словами это конец
+# предложения: "Устал.Не хочу жить" - три слова
+_DOTTED_LETTERS = re.compile(r'(?<!\w)[^\W\d_](?:\.[^\W\d_])+(?!\w)')
+# Повторы одной буквы 3+ раз: "умруууу"
+_REPEATS = re.compile(r'([^\W\d_])\1{2,}')
+_TOKEN = re.compile(r'[а-яa-z0-9]+')
+# Слово, похожее на кириллическое: кириллица вперемешку с латиницей/цифрами-двойниками
+_MIXED_WORD = re.compile(r'[а-яa-z0-9]*[а-я][а-яa-z0-9]*')
+
+
+def normalize(text: str) -> str:
+    """Приводит текст к каноническому виду для поиска ключевых слов.
+
+    Unicode NFKC, нижний регистр, удаление диакритики и невидимых символов,
+    ё -> е, замена латинских двойников в кириллических словах, склейка слов,
+    разбитых символами-разделителями, и сжатие повторов букв.
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize('NFKC', text).casefold().translate(_INVISIBLE)
+    # Ударения и прочие комбинируемые знаки (й сохраняем)
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch) or ch == '̆')
+    text = unicodedata.normalize('NFC', text).replace('ё', 'е')
+    text = _DOTTED_LETTERS.sub(lambda m: m.group().replace('.', ''), text)
+    text = _INNER_SEPARATORS.sub('', text)
+    text = _MIXED_WORD.sub(lambda m: m.group().translate(_HOMOGLYPHS), text)
+    return _REPEATS.sub(r'\1', text)
+
+
+def tokenize(text: str) -> List[Tuple[str, int, int]]:
+    """Разбивает нормализованный текст на токены (слово, начало, конец).
+
+    Серии из трех и более однобуквенных токенов ("п о в е ш у с ь")
+    склеиваются в одно слово.
+    """
+    tokens: List[Tuple[str, int, int]] = []
+    run_start = None
+    for match in _TOKEN.finditer(text):
+        word = match.group()
+        tokens.append((word, match.start(), match.end()))
+        if len(word) == 1:
+            if run_start is None:
+                run_start = len(tokens) - 1
+            continue
+        if run_start is not None:
+            _merge_run(tokens, run_start, len(tokens) - 1)
+            run_start = None
+    if run_start is not None:
+        _merge_run(tokens, run_start, len(tokens))
+    return tokens
+
+
+def _merge_run(tokens: List[Tuple[str, int, int]], start: int, end: int):
+    if end - start < 3:
+        return
+    run = tokens[start:end]
+    tokens[start:end] = [(''.join(word for word, _, _ in run), run[0][1], run[-1][2])]
+
+
+# ========== СТЕММИНГ ==========
+# Упрощенный стеммер русского языка в духе Snowball: окончания
+# отрезаются только в области после первой гласной (RV).
+_VOWELS = set('аеиоуыэюя')
+_PERFECTIVE_GERUND = ('ившись', 'ывшись', 'вшись', 'ивши', 'ывши', 'вши', 'ив', 'ыв', 'в')
+_REFLEXIVE = ('ся', 'сь')
+_ADJECTIVE = (
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой',
+    'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'
+)
+_PARTICIPLE = ('ивш', 'ывш', 'ующ', 'вш', 'ющ', 'ем', 'нн', 'щ')
+# Глагольные окончания вместе с тематической гласной: резать/режу, вешаюсь/вешу
+_VERB_THEMATIC = (
+    'ать', 'ять', 'ала', 'яла', 'али', 'яли', 'ало', 'яло', 'ает', 'яет', 'ают', 'яют',
+    'аешь', 'яешь', 'ал', 'ял', 'аю', 'яю', 'ай', 'яй'
+)
+# Окончания, которые отрезаются только после "а" или "я" (группа 1 Snowball)
+_VERB_AFTER_A = ('ешь', 'нно', 'ете', 'йте', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+_VERB = (
+    'ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют',
+    'ены', 'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ут', 'ит', 'ыт',
+    'ую', 'ю'
+)
+_NOUN = (
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей',
+    'ой', 'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й',
+    'о', 'у', 'ы', 'ь', 'ю', 'я'
+)
+
+
+def _by_length(*groups: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Объединяет группы окончаний, самые длинные - первыми"""
+    return tuple(sorted({ending for group in groups for ending in group}, key=len, reverse=True))
+
+
+_PERFECTIVE_GERUND = _by_length(_PERFECTIVE_GERUND)
+_ADJECTIVE = _by_length(_ADJECTIVE)
+_PARTICIPLE = _by_length(_PARTICIPLE)
+_VERB = _by_length(_VERB_THEMATIC, _VERB)
+_VERB_AFTER_A = _by_length(_VERB_AFTER_A)
+_NOUN = _by_length(_NOUN)
+
+
+def _strip(word: str, rv: int, endings: Tuple[str, ...]) -> str:
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= rv:
+            return word[:-len(ending)]
+    return word
+
+
+def _strip_verb(word: str, rv: int) -> str:
+    """Отрезает самое длинное глагольное окончание с учетом условия группы 1"""
+    stripped = _strip(word, rv, _VERB)
+    for ending in _VERB_AFTER_A:
+        if len(ending) <= len(word) - len(stripped):
+            break
+        cut = len(word) - len(ending)
+        if word.endswith(ending) and cut - 1 >= rv and word[cut - 1] in 'ая':
+            return word[:cut]
+    return stripped
+
+
+@lru_cache(maxsize=50000)
+def stem(word: str) -> str:
+    """Возвращает основу русского слова (для латиницы и цифр - слово как есть)"""
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+    if rv >= len(word):
+        return word
+
+    stripped = _strip(word, rv, _PERFECTIVE_GERUND)
+    if stripped == word:
+        word = _strip(word, rv, _REFLEXIVE)
+        stripped = _strip(word, rv, _ADJECTIVE)
+        if stripped != word:
+            stripped = _strip(stripped, rv, _PARTICIPLE)
+        else:
+            stripped = _strip_verb(word, rv)
+            if stripped == word:
+                stripped = _strip(word, rv, _NOUN)
+    word = stripped
+
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    if word.endswith('нн'):
+        word = word[:-1]
+    elif word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+# Чередования согласных в основах: режусь/порезаться, повешусь/повеситься, травлюсь/травиться
+_ALTERNATIONS = (('ж', 'з'), ('ж', 'д'), ('ш', 'с'), ('ш', 'х'), ('ч', 'т'), ('ч', 'к'),
+                 ('щ', 'ст'), ('вл', 'в'), ('бл', 'б'), ('пл', 'п'), ('мл', 'м'))
+
+
+def is_reflexive(word: str) -> bool:
+    """Возвратная форма глагола: повешусь, порезаться"""
+    return word.endswith(_REFLEXIVE)
+
+
+def stem_variants(word_stem: str) -> List[str]:
+    """Основа и ее варианты с чередованием конечной согласной (для построения индекса)"""
+    variants = [word_stem]
+    for first, second in _ALTERNATIONS:
+        for source, target in ((first, second), (second, first)):
+            if word_stem.endswith(source) and len(word_stem) > len(source) + 1:
+                variant = word_stem[:-len(source)] + target
+                if variant not in variants:
+                    variants.append(variant)
+    return variants
+
+
+def stem_tokens(text: str) -> List[Tuple[str, int, int]]:
+    """Нормализует текст и возвращает основы токенов с позициями в нормализованном тексте"""
+    return [(stem(word), start, end) for word, start, end in tokenize(normalize(text))]
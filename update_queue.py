@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateQueue:
+    """Ограниченная очередь входящих обновлений с пулом асинхронных воркеров.
+
+    Обновления одного чата обрабатываются строго по порядку (в каждый момент
+    времени чат занят не более чем одним воркером), а разные чаты - параллельно,
+    без блокировки друг друга медленными ответами ИИ.
+    """
+
+    def __init__(self, process: Callable[[Any], Awaitable[None]], workers: int = 8, maxsize: int = 1000):
+        self.process = process
+        self.workers = max(1, workers)
+        self.maxsize = max(1, maxsize)
+
+        # Очереди ожидающих обновлений по чатам и очередь чатов, готовых к обработке
+        self._pending: Dict[Hashable, Deque[Tuple[float, Any]]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+        self.depth = 0
+        self.max_depth = 0
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._dequeued = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Запускает воркеры (вызывается из работающего event loop)"""
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info("📥 Update queue started: %s workers, maxsize %s", self.workers, self.maxsize)
+
+    async def stop(self, timeout: float = 10.0):
+        """Дожидается обработки очереди (не дольше timeout) и останавливает воркеры"""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("📥 Update queue stopped (%s updates left unprocessed)", self.depth)
+
+    def submit(self, chat_id: Hashable, update: Any) -> bool:
+        """Ставит обновление в очередь. Возвращает False, если очередь переполнена"""
+        if self.depth >= self.maxsize:
+            self.dropped += 1
+            logger.warning("📥 Update queue full, dropping update", extra={"event": "queue_drop", "chat_id": chat_id})
+            return False
+
+        chat_queue = self._pending.get(chat_id)
+        if chat_queue is None:
+            # Чат не занят воркером и не стоит в очереди - планируем его
+            chat_queue = self._pending[chat_id] = deque()
+            self._ready.put_nowait(chat_id)
+        chat_queue.append((time.monotonic(), update))
+
+        self.enqueued += 1
+        self.depth += 1
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+        return True
+
+    async def _worker(self, index: int):
+        while True:
+            chat_id = await self._ready.get()
+            chat_queue = self._pending[chat_id]
+            enqueued_at, update = chat_queue.popleft()
+            self.depth -= 1
+
+            wait = time.monotonic() - enqueued_at
+            self._dequeued += 1
+            self._wait_total += wait
+            if wait > self._wait_max:
+                self._wait_max = wait
+
+            try:
+                await self.process(update)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error("📥 Update processing error (worker %s): %s", index, e)
+            finally:
+                # Следующее обновление этого чата берет любой свободный воркер
+                if chat_queue:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._pending[chat_id]
+
+    def stats(self) -> Dict:
+        """Текущие показатели очереди"""
+        return {
+            "workers": self.workers,
+            "maxsize": self.maxsize,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "active_chats": len(self._pending),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "wait_avg_ms": round(self._wait_total / self._dequeued * 1000, 2) if self._dequeued else 0.0,
+            "wait_max_ms": round(self._wait_max * 1000, 2)
+        }
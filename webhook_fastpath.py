@@ -0,0 +1,65 @@
+import json
+from typing import Dict, Hashable, NamedTuple, Optional, Union
+
+try:
+    import orjson  # необязательная зависимость: разбирает JSON в несколько раз быстрее json
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# Типы обновлений Bot API 6.9; незнакомые считаются как "other" (метка метрики)
+UPDATE_TYPES = frozenset({
+    "message", "edited_message", "channel_post", "edited_channel_post", "inline_query",
+    "chosen_inline_result", "callback_query", "shipping_query", "pre_checkout_query",
+    "poll", "poll_answer", "my_chat_member", "chat_member", "chat_join_request",
+})
+
+# Типы обновлений, у которых есть обработчики (команды и текст - см. register_handlers).
+# edited_message, channel_post и прочее обработчики не ждут: они отвечают через update.message
+HANDLED_UPDATE_TYPES = frozenset({"message"})
+
+
+class UpdateHead(NamedTuple):
+    """То, что нужно для маршрутизации обновления, без разбора в объекты Telegram"""
+    update_id: Optional[int]
+    kind: str
+    chat_id: Optional[Hashable]
+    text: Optional[str]
+    payload: Dict  # исходный JSON - для Update.de_json, если обновление дойдет до обработчика
+
+    @property
+    def handled(self) -> bool:
+        """Есть ли обработчик: сообщение с текстом (команды - тоже текст)"""
+        return self.kind in HANDLED_UPDATE_TYPES and self.text is not None
+
+
+def peek_update(body: Union[bytes, str, Dict]) -> Optional[UpdateHead]:
+    """Тип обновления, chat_id и текст из тела вебхука.
+
+    Полный Update здесь не строится: обновления без обработчика
+    отбрасываются по UpdateHead, не создав ни одного объекта Telegram.
+    None - тело не похоже на обновление. Битый JSON - ValueError.
+    """
+    payload = body if isinstance(body, dict) else loads(body)
+    if not isinstance(payload, dict):
+        return None
+    update_id = payload.get("update_id")
+    for kind, value in payload.items():
+        if kind != "update_id" and isinstance(value, dict):
+            break
+    else:
+        return None
+
+    # Как update.effective_chat: чат сообщения (или сообщения под кнопкой), иначе - отправитель
+    chat = value.get("chat") or (value.get("message") or {}).get("chat")
+    sender = value.get("from")
+    if chat:
+        chat_id = chat.get("id")
+    elif sender:
+        chat_id = sender.get("id")
+    else:
+        chat_id = update_id
+    text = value.get("text")
+    if kind not in UPDATE_TYPES:
+        kind = "other"
+    return UpdateHead(update_id, kind, chat_id, text if isinstance(text, str) else None, payload)